@@ -1,8 +1,9 @@
 from django.contrib import admin
 from .models import (
     SerieDocumental, SubserieDocumental, RegistroDeArchivo, PermisoUsuarioSerie, 
-    EntidadProductora, UnidadAdministrativa, OficinaProductora, Objeto, FUID, FichaPaciente
+    EntidadProductora, UnidadAdministrativa, OficinaProductora, Objeto, FUID, FichaPaciente, PerfilUsuario
 )
+from .busqueda import buscar as buscar_registros
 
 
 @admin.register(SerieDocumental)
@@ -26,6 +27,11 @@ class RegistroDeArchivoAdmin(admin.ModelAdmin):
     )
     list_filter = ('soporte_fisico', 'soporte_electronico', 'fecha_archivo', 'creado_por')
     search_fields = ('numero_orden', 'unidad_documental', 'ubicacion', 'notas')
+    search_help_text = (
+        "Busca palabras que empiecen por lo escrito (número de orden, unidad documental, "
+        "ubicación, caja, carpeta, serie, subserie o notas): «hist» encuentra «Historia», "
+        "pero «123» no encuentra «00123»."
+    )
     readonly_fields = ('fecha_creacion',)
     fieldsets = (
         ('Información General', {
@@ -44,6 +50,12 @@ class RegistroDeArchivoAdmin(admin.ModelAdmin):
         }),
     )
 
+    def get_search_results(self, request, queryset, search_term):
+        # Usa el índice de texto completo en lugar de LIKE '%...%' sobre cada campo
+        if not search_term:
+            return queryset, False
+        return buscar_registros(queryset, search_term), False
+
 
 @admin.register(PermisoUsuarioSerie)
 class PermisoUsuarioSerieAdmin(admin.ModelAdmin):
@@ -90,7 +102,8 @@ class FichaPacienteAdmin(admin.ModelAdmin):
     list_filter = ('activo', 'sexo', 'tipo_identificacion')
     search_fields = ('primer_nombre', 'primer_apellido', 'num_identificacion', 'Numero_historia_clinica')
 
-# @admin.register(PerfilUsuario)
-# class PerfilUsuarioAdmin(admin.ModelAdmin):
-#     list_display = ('user', 'oficina')
-#     search_fields = ('user__username', 'oficina__nombre')
\ No newline at end of file
+@admin.register(PerfilUsuario)
+class PerfilUsuarioAdmin(admin.ModelAdmin):
+    list_display = ('user', 'oficina')
+    list_select_related = ('user', 'oficina')
+    search_fields = ('user__username', 'oficina__nombre')
@@ -4,3 +4,13 @@ from django.apps import AppConfig
 class DocumentosConfig(AppConfig):
     default_auto_field = "django.db.models.BigAutoField"
     name = "documentos"
+
+    def ready(self):
+        from django.db.models.signals import post_migrate
+
+        # Registra los receptores de señales (conteos cacheados, índice de búsqueda, etc.)
+        from . import signals  # noqa: F401
+        from .busqueda import asegurar_estructuras_post_migrate
+
+        # Crea el índice de texto completo del motor después de migrar
+        post_migrate.connect(asegurar_estructuras_post_migrate, sender=self)
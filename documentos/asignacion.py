@@ -0,0 +1,69 @@
+"""
+Asignación masiva de registros a un FUID.
+
+En lugar de traer los ids a Python y pasarlos a ``fuid.registros.set()`` (que
+compara la lista contra la tabla intermedia y luego inserta fila a fila), la
+asignación se hace con una sola sentencia::
+
+    INSERT INTO <intermedia> (fuid_id, registrodearchivo_id)
+    SELECT <fuid>, c.registro_id FROM (<registros filtrados>) c
+    WHERE NOT EXISTS (SELECT 1 FROM <intermedia> t WHERE t.registrodearchivo_id = c.registro_id)
+
+El ``NOT EXISTS`` descarta los registros que ya tienen FUID, incluidos los que
+otra petición asignó mientras tanto. En SQL Server la subconsulta lleva
+``UPDLOCK, HOLDLOCK``: dos asignaciones simultáneas sobre los mismos registros
+se serializan y la segunda omite lo que ya reclamó la primera. En SQLite se
+serializan con el candado de ``reservas.escritura_exclusiva``.
+
+Como no pasa por el ORM no se emite ``m2m_changed``; las generaciones de
+``conteos`` se incrementan aquí para invalidar conteos y respuestas cacheadas,
+y también la versión del FUID para su libro en caché (``cache_fuid``).
+"""
+from django.db import connections, router, transaction
+from django.db.models import F
+
+from . import cache_fuid, conteos
+from .reservas import escritura_exclusiva
+from .models import FUID, RegistroDeArchivo
+
+# Bloqueo de rango para que el NOT EXISTS siga siendo cierto hasta el INSERT
+PISTAS_BLOQUEO = {'microsoft': 'WITH (UPDLOCK, HOLDLOCK)'}
+
+
+def asignar_registros(fuid, registros):
+    """
+    Asocia a ``fuid`` todos los registros de ``registros`` (un queryset de
+    RegistroDeArchivo) que aún no pertenecen a ningún FUID. Devuelve cuántos
+    se asignaron.
+    """
+    intermedia = FUID.registros.through
+    campo = FUID._meta.get_field('registros')
+    using = router.db_for_write(intermedia)
+    conexion = connections[using]
+    q = conexion.ops.quote_name
+
+    tabla = q(intermedia._meta.db_table)
+    columna_fuid = q(campo.m2m_column_name())
+    columna_registro = q(campo.m2m_reverse_name())
+    pista = PISTAS_BLOQUEO.get(conexion.vendor, '')
+
+    # Sin ORDER BY: SQL Server no lo admite en una tabla derivada sin TOP
+    subconsulta, params = (
+        registros.order_by().annotate(registro_id=F('pk')).values('registro_id').query.sql_with_params()
+    )
+    sql = (
+        f'INSERT INTO {tabla} ({columna_fuid}, {columna_registro}) '
+        f'SELECT %s, c.registro_id FROM ({subconsulta}) c '
+        f'WHERE NOT EXISTS (SELECT 1 FROM {tabla} t {pista} WHERE t.{columna_registro} = c.registro_id)'
+    )
+    with escritura_exclusiva(using), transaction.atomic(using=using):
+        with conexion.cursor() as cursor:
+            cursor.execute(sql, [fuid.pk, *params])
+            asignados = max(cursor.rowcount, 0)
+
+    if asignados:
+        # Mismo efecto que invalidar_conteos_fuid_registros (signals.py)
+        conteos.invalidar(RegistroDeArchivo)
+        conteos.invalidar(FUID)
+        cache_fuid.tocar(FUID.objects.filter(pk=fuid.pk))
+    return asignados
@@ -0,0 +1,56 @@
+"""
+Backends de permisos por propiedad y por serie.
+
+Quien crea un registro o un FUID (``creado_por``) tiene sobre él los permisos
+``*_own_*`` de ``PERMISOS_DEL_CREADOR`` sin que haga falta una fila de
+guardian por objeto y permiso. Guardian queda sólo para lo que se comparte
+explícitamente con otros usuarios o grupos (y para permisos que no se dan por
+defecto al creador, como eliminar sus registros).
+
+``SeriePermisoBackend`` concede esos mismos permisos sobre los registros de
+las series indicadas en ``PermisoUsuarioSerie`` (ver ``permisos_serie.py``).
+
+Van en AUTHENTICATION_BACKENDS junto a ModelBackend y ObjectPermissionBackend;
+``permisos.PermisosObjeto`` aplica las mismas reglas antes de consultar guardian.
+"""
+from django.contrib.auth.backends import BaseBackend
+
+from . import permisos_serie
+
+# Permisos implícitos del creador por modelo (mismos que se asignaban con assign_perm al crear)
+PERMISOS_DEL_CREADOR = {
+    'documentos.registrodearchivo': frozenset({'view_own_registro', 'edit_own_registro'}),
+    'documentos.fuid': frozenset({'view_own_fuid', 'edit_own_fuid', 'delete_own_fuid'}),
+}
+
+
+def otorga_el_creador(usuario, permiso, obj):
+    """True si ``usuario`` tiene ``permiso`` sobre ``obj`` por ser su creador (sin consultas)."""
+    if obj is None or not usuario.is_active:
+        return False
+    codename = permiso.split('.', 1)[-1]
+    if codename not in PERMISOS_DEL_CREADOR.get(obj._meta.label_lower, ()):
+        return False
+    return usuario.pk is not None and getattr(obj, 'creado_por_id', None) == usuario.pk
+
+
+class PropietarioBackend(BaseBackend):
+    def has_perm(self, user_obj, perm, obj=None):
+        return otorga_el_creador(user_obj, perm, obj)
+
+
+def otorga_la_serie(usuario, permiso, obj):
+    """True si ``PermisoUsuarioSerie`` da a ``usuario`` ``permiso`` sobre el registro ``obj``."""
+    if obj is None or obj._meta.label_lower != 'documentos.registrodearchivo' or not usuario.is_active:
+        return False
+    accion = permisos_serie.PERMISOS_REGISTRO.get(permiso.split('.', 1)[-1])
+    if accion is None:
+        return False
+    series = permisos_serie.series_permitidas(usuario, accion)
+    # Sin filas por serie no se concede nada aquí: deciden los demás backends
+    return series is not None and obj.codigo_serie_id in series
+
+
+class SeriePermisoBackend(BaseBackend):
+    def has_perm(self, user_obj, perm, obj=None):
+        return otorga_la_serie(user_obj, perm, obj)
@@ -0,0 +1,287 @@
+"""
+Índice de texto completo para las búsquedas sobre RegistroDeArchivo.
+
+Los campos de texto buscables se copian a ``IndiceBusquedaRegistro`` (una fila
+por registro, sincronizada mediante señales en cada save que cambie un campo
+indexado y en cada delete) y sobre esa tabla se monta el índice del motor:
+
+- SQL Server: catálogo e índice FULLTEXT (CHANGE_TRACKING AUTO), consultado con CONTAINS.
+- SQLite (entorno local): tabla virtual FTS5 de contenido externo mantenida por triggers.
+
+Las búsquedas son por prefijo de palabra: "hist 2023" encuentra registros con
+una palabra que empiece por "hist" y otra que empiece por "2023". Es un cambio
+respecto a la búsqueda anterior (``icontains``, subcadena en cualquier
+posición):
+
+- "123" ya no encuentra "00123" ni "A123": hay que escribir el comienzo de la
+  palabra ("00123", "001").
+- Las palabras se separan por cualquier carácter que no sea letra o número:
+  "HC-2023" se busca como "HC" y "2023", y también la encuentra "2023".
+- Con FTS5 no se distinguen mayúsculas ni tildes ("clinica" encuentra
+  "Clínica"); en SQL Server depende de la intercalación del catálogo.
+
+Si el motor no tiene índice de texto completo (o aún no se ha creado) se usa
+``icontains`` sobre los campos originales, como antes.
+
+La tabla se crea y se llena con los registros existentes en la migración
+0002_indice_busqueda_registro. Para volver a generarla (por ejemplo tras
+cargas hechas fuera de la aplicación):
+    python manage.py reconstruir_indice_busqueda
+"""
+import logging
+import re
+
+from django.db import DatabaseError, connections, transaction
+from django.db.models import Q, QuerySet, prefetch_related_objects
+from django.db.models.expressions import RawSQL
+
+from .datatables import Columna
+from .models import IndiceBusquedaRegistro, RegistroDeArchivo
+
+logger = logging.getLogger(__name__)
+
+TABLA = IndiceBusquedaRegistro._meta.db_table
+TABLA_FTS = f'{TABLA}_fts'
+CATALOGO_MSSQL = 'documentos_busqueda'
+
+# Columnas del índice y el campo de RegistroDeArchivo del que sale cada una
+COLUMNAS_INDICE = {
+    'numero_orden': 'numero_orden',
+    'unidad_documental': 'unidad_documental',
+    'ubicacion': 'ubicacion',
+    'caja': 'caja',
+    'carpeta': 'carpeta',
+    'serie': 'codigo_serie__nombre',
+    'subserie': 'codigo_subserie__nombre',
+    'notas': 'notas',
+}
+
+# Motor detectado por alias de base de datos ('fts5', 'mssql' o None)
+_motores = {}
+
+
+def _tokens(texto):
+    return re.findall(r'\w+', texto or '')
+
+
+def motor(using='default'):
+    """Indica qué índice de texto completo está disponible en la base de datos."""
+    if using not in _motores:
+        _motores[using] = _detectar_motor(connections[using])
+    return _motores[using]
+
+
+def _detectar_motor(conexion):
+    try:
+        with conexion.cursor() as cursor:
+            if conexion.vendor == 'sqlite':
+                cursor.execute("SELECT 1 FROM sqlite_master WHERE type = 'table' AND name = %s", [TABLA_FTS])
+                return 'fts5' if cursor.fetchone() else None
+            if conexion.vendor == 'microsoft':
+                cursor.execute("SELECT 1 FROM sys.fulltext_indexes WHERE object_id = OBJECT_ID(%s)", [TABLA])
+                return 'mssql' if cursor.fetchone() else None
+    except DatabaseError:
+        pass
+    return None
+
+
+def asegurar_estructuras(using='default'):
+    """
+    Crea el índice de texto completo del motor si no existe.
+    Devuelve el motor disponible después de intentarlo.
+    """
+    conexion = connections[using]
+    _motores.pop(using, None)
+    if motor(using):
+        return motor(using)
+    if TABLA not in conexion.introspection.table_names():
+        return None  # p. ej. tras 'migrate documentos 0001 --fake': se crea al aplicar 0002
+    try:
+        if conexion.vendor == 'sqlite':
+            # Todo o nada: una tabla FTS5 sin sus triggers quedaría desactualizada
+            with transaction.atomic(using=using):
+                _crear_fts5(conexion)
+        elif conexion.vendor == 'microsoft':
+            _crear_fulltext_mssql(conexion)
+    except DatabaseError as e:
+        logger.warning("No se pudo crear el índice de texto completo: %s", e)
+    _motores.pop(using, None)
+    return motor(using)
+
+
+def _crear_fts5(conexion):
+    columnas = ', '.join(COLUMNAS_INDICE)
+    nuevas = ', '.join(f'new.{c}' for c in COLUMNAS_INDICE)
+    viejas = ', '.join(f'old.{c}' for c in COLUMNAS_INDICE)
+    with conexion.cursor() as cursor:
+        cursor.execute(
+            f"CREATE VIRTUAL TABLE {TABLA_FTS} USING fts5({columnas}, content='{TABLA}', "
+            f"content_rowid='registro_id', tokenize='unicode61 remove_diacritics 2')"
+        )
+        # Triggers estándar de FTS5 para tablas de contenido externo
+        cursor.execute(
+            f"CREATE TRIGGER {TABLA_FTS}_ai AFTER INSERT ON {TABLA} BEGIN "
+            f"INSERT INTO {TABLA_FTS}(rowid, {columnas}) VALUES (new.registro_id, {nuevas}); END"
+        )
+        cursor.execute(
+            f"CREATE TRIGGER {TABLA_FTS}_ad AFTER DELETE ON {TABLA} BEGIN "
+            f"INSERT INTO {TABLA_FTS}({TABLA_FTS}, rowid, {columnas}) VALUES ('delete', old.registro_id, {viejas}); END"
+        )
+        cursor.execute(
+            f"CREATE TRIGGER {TABLA_FTS}_au AFTER UPDATE ON {TABLA} BEGIN "
+            f"INSERT INTO {TABLA_FTS}({TABLA_FTS}, rowid, {columnas}) VALUES ('delete', old.registro_id, {viejas}); "
+            f"INSERT INTO {TABLA_FTS}(rowid, {columnas}) VALUES (new.registro_id, {nuevas}); END"
+        )
+        cursor.execute(f"INSERT INTO {TABLA_FTS}({TABLA_FTS}) VALUES ('rebuild')")
+
+
+def _crear_fulltext_mssql(conexion):
+    with conexion.cursor() as cursor:
+        cursor.execute(
+            "SELECT name FROM sys.indexes WHERE object_id = OBJECT_ID(%s) AND is_primary_key = 1", [TABLA]
+        )
+        indice_pk = cursor.fetchone()[0]
+        cursor.execute("SELECT 1 FROM sys.fulltext_catalogs WHERE name = %s", [CATALOGO_MSSQL])
+        if not cursor.fetchone():
+            cursor.execute(f"CREATE FULLTEXT CATALOG {CATALOGO_MSSQL}")
+        columnas = ', '.join(COLUMNAS_INDICE)
+        cursor.execute(
+            f"CREATE FULLTEXT INDEX ON {TABLA} ({columnas}) KEY INDEX [{indice_pk}] "
+            f"ON {CATALOGO_MSSQL} WITH CHANGE_TRACKING AUTO"
+        )
+
+
+def asegurar_estructuras_post_migrate(sender, using='default', **kwargs):
+    asegurar_estructuras(using)
+
+
+def _subconsulta(texto, columna, using):
+    """SQL que devuelve los ids de registro que coinciden, o None si no hay índice."""
+    tokens = _tokens(texto)
+    if not tokens:
+        return None
+    motor_actual = motor(using)
+    if motor_actual == 'fts5':
+        prefijo = f'{columna} : ' if columna else ''
+        expresion = ' AND '.join(f'{prefijo}"{token}"*' for token in tokens)
+        return RawSQL(f"SELECT rowid FROM {TABLA_FTS} WHERE {TABLA_FTS} MATCH %s", [expresion])
+    if motor_actual == 'mssql':
+        expresion = ' AND '.join(f'"{token}*"' for token in tokens)
+        return RawSQL(f"SELECT registro_id FROM {TABLA} WHERE CONTAINS(({columna or '*'}), %s)", [expresion])
+    return None
+
+
+def buscar(queryset, texto, columna=None):
+    """
+    Filtra un queryset de RegistroDeArchivo por texto usando el índice.
+
+    ``columna`` restringe la búsqueda a una columna del índice (ver COLUMNAS_INDICE);
+    sin ella se busca en todas. Sin índice disponible se usa icontains.
+    """
+    if not _tokens(texto):
+        return queryset
+    subconsulta = _subconsulta(texto, columna, queryset.db)
+    if subconsulta is not None:
+        return queryset.filter(pk__in=subconsulta)
+
+    # Sin índice: mismo comportamiento que antes (LIKE '%texto%')
+    campos = [COLUMNAS_INDICE[columna]] if columna else list(COLUMNAS_INDICE.values())
+    condicion = Q()
+    for campo in campos:
+        condicion |= Q(**{f'{campo}__icontains': texto})
+    return queryset.filter(condicion)
+
+
+class ColumnaTextoCompleto(Columna):
+    """Columna de DataTables cuya búsqueda se resuelve con el índice de texto completo."""
+
+    def __init__(self, nombre, campo=None, indice=None, **kwargs):
+        super().__init__(nombre, campo, **kwargs)
+        self.indice = indice or nombre
+
+    def filtrar(self, queryset, valor):
+        return buscar(queryset, valor, self.indice)
+
+
+def valores_indice(registro):
+    """Campos del índice para una instancia de RegistroDeArchivo."""
+    return {
+        'numero_orden': registro.numero_orden or '',
+        'unidad_documental': registro.unidad_documental or '',
+        'ubicacion': registro.ubicacion or '',
+        'caja': registro.caja or '',
+        'carpeta': registro.carpeta or '',
+        'serie': registro.codigo_serie.nombre if registro.codigo_serie_id else '',
+        'subserie': registro.codigo_subserie.nombre if registro.codigo_subserie_id else '',
+        'notas': registro.notas or '',
+    }
+
+
+# Campos de RegistroDeArchivo de los que salen las columnas del índice (los
+# nombres de serie y subserie se reindexan al cambiar la serie, ver signals.py)
+CAMPOS_ORIGEN = (
+    'numero_orden', 'unidad_documental', 'ubicacion', 'caja', 'carpeta', 'notas',
+    'codigo_serie_id', 'codigo_subserie_id',
+)
+
+
+def huella_indice(registro):
+    """Valores de CAMPOS_ORIGEN cargados en la instancia (los diferidos cuentan como None)."""
+    return tuple(registro.__dict__.get(campo) for campo in CAMPOS_ORIGEN)
+
+
+def indexar_registro(registro, creado=False):
+    if creado:
+        IndiceBusquedaRegistro.objects.create(registro_id=registro.pk, **valores_indice(registro))
+    else:
+        IndiceBusquedaRegistro.objects.update_or_create(registro_id=registro.pk, defaults=valores_indice(registro))
+
+
+def indexar_registros(registros, batch_size=1000):
+    """
+    Crea las filas del índice para registros nuevos (por ejemplo tras un
+    bulk_create). Acepta un queryset o instancias; las series y subseries se
+    cargan en bloque, no una consulta por registro.
+    """
+    if isinstance(registros, QuerySet):
+        registros = registros.select_related('codigo_serie', 'codigo_subserie')
+    else:
+        registros = list(registros)
+        # Sólo consulta las que no estén ya cargadas en las instancias
+        prefetch_related_objects(registros, 'codigo_serie', 'codigo_subserie')
+    IndiceBusquedaRegistro.objects.bulk_create(
+        [IndiceBusquedaRegistro(registro_id=r.pk, **valores_indice(r)) for r in registros],
+        batch_size=batch_size,
+    )
+
+
+def reconstruir(using='default', chunk_size=2000, salida=None):
+    """
+    Vuelve a generar el índice completo a partir de RegistroDeArchivo.
+    Devuelve el número de registros indexados.
+    """
+    asegurar_estructuras(using)
+    # Sin relaciones ni señales: Django lo resuelve con un único DELETE
+    IndiceBusquedaRegistro.objects.using(using).all().delete()
+
+    campos = ['pk'] + list(COLUMNAS_INDICE.values())
+    filas = RegistroDeArchivo.objects.using(using).values_list(*campos).iterator(chunk_size=chunk_size)
+    lote, total = [], 0
+    for pk, *valores in filas:
+        lote.append(IndiceBusquedaRegistro(
+            registro_id=pk, **{c: v or '' for c, v in zip(COLUMNAS_INDICE, valores)}
+        ))
+        if len(lote) >= chunk_size:
+            IndiceBusquedaRegistro.objects.using(using).bulk_create(lote)
+            total += len(lote)
+            lote = []
+            if salida:
+                salida(total)
+    if lote:
+        IndiceBusquedaRegistro.objects.using(using).bulk_create(lote)
+        total += len(lote)
+
+    if motor(using) == 'fts5':
+        with connections[using].cursor() as cursor:
+            cursor.execute(f"INSERT INTO {TABLA_FTS}({TABLA_FTS}) VALUES ('rebuild')")
+    return total
@@ -0,0 +1,141 @@
+"""
+Caché en disco de los libros del formato FUID.
+
+Un FUID entregado prácticamente no cambia, pero cada descarga regeneraba el
+libro completo. Aquí el libro se guarda en
+``FUID_CACHE_DIR/<fuid>/<version>-<clave>.xlsx``, donde la clave resume:
+
+- ``FUID.version_contenido``, que ``tocar`` incrementa cuando cambia el FUID,
+  sus registros (o cuáles tiene) o un catálogo que el formato muestra (serie,
+  subserie, oficina, usuario creador...; ver ``signals.py`` y ``asignacion.py``);
+- ``exportacion_fuid.VERSION_FORMATO``, para los cambios de disposición;
+- el contenido del logo.
+
+Cualquier cambio produce una clave nueva: nunca se sirve un libro viejo. Al
+generar un libro se borran los de versiones anteriores del FUID, nunca los de
+una versión más nueva que otra petición haya escrito entretanto. La clave es
+también el ETag de la descarga y ``fecha_modificacion`` su Last-Modified, de
+modo que el navegador recibe un 304 si ya tiene la versión vigente.
+
+``FUID_CACHE_DIR`` no debe estar dentro de la carpeta de la FileBasedCache:
+su purga podría borrar libros.
+"""
+import hashlib
+import os
+import tempfile
+from pathlib import Path
+
+from django.conf import settings
+from django.contrib.auth.models import User
+from django.db.models import F
+from django.http import FileResponse
+from django.utils import timezone
+from django.utils.cache import get_conditional_response, patch_cache_control
+from django.utils.http import http_date
+
+from .exportacion_fuid import CONTENT_TYPE, VERSION_FORMATO, bloque_encabezado, escribir_fuid
+from .models import (
+    FUID, EntidadProductora, Objeto, OficinaProductora, RegistroDeArchivo, SerieDocumental, SubserieDocumental,
+    UnidadAdministrativa,
+)
+
+EXTENSION = '.xlsx'
+
+# Modelos cuyo contenido aparece en el formato FUID, con el camino desde FUID:
+# al cambiar uno de sus objetos cambia la versión de los FUIDs que lo muestran
+CONTENIDO_FUID = {
+    RegistroDeArchivo: 'registros',
+    SerieDocumental: 'registros__codigo_serie',
+    SubserieDocumental: 'registros__codigo_subserie',
+    User: 'registros__creado_por',
+    EntidadProductora: 'entidad_productora',
+    UnidadAdministrativa: 'unidad_administrativa',
+    OficinaProductora: 'oficina_productora',
+    Objeto: 'objeto',
+}
+
+
+def directorio():
+    return Path(getattr(settings, 'FUID_CACHE_DIR', Path(settings.BASE_DIR) / 'cache_fuids'))
+
+
+def tocar(fuids):
+    """Marca como modificados los FUIDs de un queryset: cambia su clave en la caché."""
+    return fuids.update(version_contenido=F('version_contenido') + 1, fecha_modificacion=timezone.now())
+
+
+def tocar_los_que_muestran(objeto):
+    """Cambia la versión de los FUIDs cuyo formato muestra ``objeto`` (ver CONTENIDO_FUID)."""
+    return tocar(FUID.objects.filter(**{CONTENIDO_FUID[type(objeto)]: objeto}))
+
+
+def clave(fuid):
+    huella = bloque_encabezado().huella_logo
+    return hashlib.sha1(f'{fuid.pk}:{fuid.version_contenido}:{VERSION_FORMATO}:{huella}'.encode()).hexdigest()
+
+
+def _ruta(fuid):
+    return directorio() / str(fuid.pk) / f'{fuid.version_contenido}-{clave(fuid)}{EXTENSION}'
+
+
+def _version(ruta):
+    """Versión del FUID con que se generó un libro de la caché (None si el nombre no la tiene)."""
+    version, _, _ = ruta.stem.partition('-')
+    return int(version) if version.isdigit() else None
+
+
+def en_cache(fuid):
+    """Indica si el libro vigente de ``fuid`` ya está generado."""
+    return _ruta(fuid).exists()
+
+
+def archivo(fuid, progreso=None):
+    """
+    Ruta del libro vigente de ``fuid``, generándolo si no está en la caché.
+    ``fuid`` debe estar recién leído (con ``select_related`` de sus relaciones)
+    para que su versión sea la actual.
+    """
+    ruta = _ruta(fuid)
+    if ruta.exists():
+        return ruta
+    carpeta = ruta.parent
+
+    carpeta.mkdir(parents=True, exist_ok=True)
+    # Se escribe aparte y se renombra: otra petición nunca ve un libro a medias
+    descriptor, parcial = tempfile.mkstemp(dir=carpeta, suffix='.parcial')
+    try:
+        with os.fdopen(descriptor, 'wb') as destino:
+            escribir_fuid(fuid, destino, progreso=progreso)
+        os.replace(parcial, ruta)
+    except BaseException:
+        Path(parcial).unlink(missing_ok=True)
+        raise
+
+    for anterior in carpeta.glob(f'*{EXTENSION}'):
+        version = _version(anterior)
+        # Una petición más lenta que termina después no borra el libro de una versión más nueva
+        if anterior != ruta and (version is None or version < fuid.version_contenido):
+            try:
+                anterior.unlink()
+            except OSError:
+                pass  # En Windows no se puede borrar mientras otra descarga lo lee
+    return ruta
+
+
+def respuesta_fuid(request, fuid):
+    """
+    Descarga del libro de ``fuid`` desde la caché, con ETag y Last-Modified;
+    304 si el navegador ya tiene la versión vigente.
+    """
+    etag = f'"{clave(fuid)}"'
+    modificado = int(fuid.fecha_modificacion.timestamp())
+    respuesta = get_conditional_response(request, etag=etag, last_modified=modificado)
+    if respuesta is None:
+        respuesta = FileResponse(
+            open(archivo(fuid), 'rb'), as_attachment=True, filename=f'FUID_{fuid.pk}.xlsx', content_type=CONTENT_TYPE,
+        )
+    respuesta['ETag'] = etag
+    respuesta['Last-Modified'] = http_date(modificado)
+    # Datos por oficina: sólo el navegador del usuario los guarda, y siempre revalida
+    patch_cache_control(respuesta, private=True, no_cache=True)
+    return respuesta
@@ -0,0 +1,192 @@
+"""
+Caché de respuestas de corta duración para las APIs de DataTables.
+
+Varios usuarios suelen tener abierta la misma tabla y cada redibujado repite
+exactamente la misma consulta. Aquí se guarda el cuerpo de la respuesta (sin
+``draw``, que DataTables incrementa en cada petición) bajo una clave que incluye:
+
+- el usuario y si es superusuario, para no servir a nadie datos de otro;
+- la generación de los modelos de los que depende la respuesta y la de los
+  permisos (ver ``conteos.generacion`` y ``signals.py``): cualquier escritura
+  o cambio de permisos invalida las entradas afectadas sin borrarlas una a una;
+- los parámetros de la petición normalizados (ordenados, sin ``draw`` ni el
+  ``_`` anti-caché que añade jQuery).
+
+Si llegan a la vez varias peticiones con la misma clave y no hay entrada, sólo
+una consulta la base de datos:
+
+- dentro del proceso, las demás esperan a que termine el hilo que la calcula
+  (un evento por clave: las claves distintas no se bloquean entre sí);
+- entre procesos se usa ``cache.add`` como candado con expiración. Quien no lo
+  obtiene espera un tiempo acotado y, si no aparece el resultado, calcula por
+  su cuenta. Cada proceso sólo borra el candado que puso él.
+
+Los aciertos, fallos y esperas se cuentan por endpoint en memoria de cada
+proceso, que publica sus totales en la caché bajo una clave propia (nadie más
+la escribe, así que no hace falta un incremento atómico); ``metricas()`` suma
+los de todos los procesos (ver la vista ``metricas_cache_respuestas``).
+"""
+import hashlib
+import json
+import os
+import socket
+import threading
+import time
+import uuid
+
+from django.conf import settings
+from django.contrib.auth.models import Permission
+from django.core.cache import cache
+
+from .conteos import generaciones
+
+# Parámetros que no cambian el contenido de la respuesta
+PARAMETROS_IGNORADOS = {'draw', '_'}
+
+EVENTOS = ('aciertos', 'coalescidas', 'fallos')
+CLAVE_PROCESOS = 'respuestas:metricas:procesos'
+# Cada cuánto (segundos) publica un proceso sus métricas y cuánto duran en la caché
+INTERVALO_METRICAS = 1
+DURACION_METRICAS = 24 * 60 * 60
+
+_mutex = threading.Lock()
+# clave -> evento del cálculo en curso en este proceso
+_en_curso = {}
+# Métricas de este proceso: pid con que se tomaron, ámbito -> evento -> cantidad, próxima publicación
+_metricas = {'pid': None, 'ambitos': {}, 'publicar_en': 0.0}
+
+
+def _ajuste(nombre, por_defecto):
+    return getattr(settings, nombre, por_defecto)
+
+
+def clave_respuesta(request, modelos):
+    usuario = request.user
+    parametros = sorted(
+        (nombre, valor)
+        for nombre, valores in request.GET.lists() if nombre not in PARAMETROS_IGNORADOS
+        for valor in valores
+    )
+    # Las generaciones entran en la huella: la clave no crece con el número de modelos
+    version = generaciones(*modelos, Permission)
+    huella = hashlib.sha1(json.dumps([request.path, parametros, version]).encode()).hexdigest()
+    return f'respuestas:{usuario.pk}:{int(usuario.is_superuser)}:{huella}'
+
+
+def _clave_proceso():
+    return f'respuestas:metricas:{socket.gethostname()}:{os.getpid()}'
+
+
+def _contar(ambito, evento):
+    with _mutex:
+        if _metricas['pid'] != os.getpid():
+            # Proceso nuevo (p. ej. tras un fork): no hereda lo contado por el padre
+            _metricas.update(pid=os.getpid(), ambitos={}, publicar_en=0.0)
+        conteo = _metricas['ambitos'].setdefault(ambito, dict.fromkeys(EVENTOS, 0))
+        conteo[evento] += 1
+    _publicar()
+
+
+def _publicar(forzar=False):
+    """Copia las métricas de este proceso a la caché, como mucho una vez por INTERVALO_METRICAS."""
+    with _mutex:
+        ahora = time.monotonic()
+        if _metricas['pid'] != os.getpid() or (not forzar and ahora < _metricas['publicar_en']):
+            return
+        _metricas['publicar_en'] = ahora + INTERVALO_METRICAS
+        copia = {ambito: dict(conteo) for ambito, conteo in _metricas['ambitos'].items()}
+    clave = _clave_proceso()
+    cache.set(clave, copia, DURACION_METRICAS)
+    procesos = cache.get(CLAVE_PROCESOS) or set()
+    if clave not in procesos:
+        # Si otro proceso se registra a la vez y pisa este registro, se repite en la siguiente publicación
+        cache.set(CLAVE_PROCESOS, procesos | {clave}, DURACION_METRICAS)
+
+
+def _esperar(clave, segundos):
+    """Espera hasta ``segundos`` a que otro proceso guarde la respuesta de ``clave``."""
+    limite = time.monotonic() + segundos
+    while time.monotonic() < limite:
+        time.sleep(0.05)
+        datos = cache.get(clave)
+        if datos is not None:
+            return datos
+    return None
+
+
+def _calcular(clave, ambito, calcular):
+    """Calcula y guarda la respuesta, coordinándose con los demás procesos."""
+    espera = _ajuste('RESPUESTAS_CACHE_ESPERA', 5)
+    candado = f'{clave}:calculando'
+    propio = uuid.uuid4().hex
+    adquirido = cache.add(candado, propio, espera)
+    if not adquirido:
+        # Otro proceso la está calculando: se espera su resultado un tiempo acotado
+        datos = _esperar(clave, espera)
+        if datos is not None:
+            _contar(ambito, 'coalescidas')
+            return datos
+        adquirido = cache.add(candado, propio, espera)
+    try:
+        _contar(ambito, 'fallos')
+        datos = calcular()
+        cache.set(clave, datos, _ajuste('RESPUESTAS_CACHE_TTL', 15))
+        return datos
+    finally:
+        # Si el cálculo duró más que la expiración, el candado puede ser ya de otro proceso
+        if adquirido and cache.get(candado) == propio:
+            cache.delete(candado)
+
+
+def obtener(request, modelos, calcular):
+    """
+    Devuelve ``calcular()`` (un diccionario serializable) desde la caché de respuestas.
+
+    ``modelos`` son los modelos de los que depende el resultado; una escritura
+    en cualquiera de ellos invalida la entrada. Las excepciones de ``calcular``
+    se propagan sin guardar nada.
+    """
+    ambito = request.resolver_match.url_name if request.resolver_match else request.path
+    clave = clave_respuesta(request, modelos)
+    datos = cache.get(clave)
+    if datos is not None:
+        _contar(ambito, 'aciertos')
+        return datos
+
+    with _mutex:
+        evento = _en_curso.get(clave)
+        propio = evento is None
+        if propio:
+            evento = _en_curso[clave] = threading.Event()
+
+    if not propio:
+        # Otro hilo de este proceso la está calculando: se espera sin retener ningún candado
+        evento.wait(_ajuste('RESPUESTAS_CACHE_ESPERA', 5))
+        datos = cache.get(clave)
+        if datos is not None:
+            _contar(ambito, 'coalescidas')
+            return datos
+        return _calcular(clave, ambito, calcular)
+
+    try:
+        return _calcular(clave, ambito, calcular)
+    finally:
+        with _mutex:
+            del _en_curso[clave]
+        evento.set()
+
+
+def metricas():
+    """Aciertos, esperas coalescidas, fallos y tasa de aciertos por endpoint (todos los procesos)."""
+    _publicar(forzar=True)
+    procesos = sorted(cache.get(CLAVE_PROCESOS) or ())
+    resultado = {}
+    for conteos in cache.get_many(procesos).values():
+        for ambito, conteo in conteos.items():
+            acumulado = resultado.setdefault(ambito, dict.fromkeys(EVENTOS, 0))
+            for evento in EVENTOS:
+                acumulado[evento] += conteo.get(evento, 0)
+    for conteo in resultado.values():
+        total = sum(conteo[e] for e in EVENTOS)
+        conteo['tasa_aciertos'] = round((conteo['aciertos'] + conteo['coalescidas']) / total, 4) if total else None
+    return dict(sorted(resultado.items()))
@@ -0,0 +1,152 @@
+"""
+Servicio de conteos para las APIs de DataTables (recordsTotal / recordsFiltered).
+
+- El total sin filtros de una tabla se guarda en caché detrás de una generación
+  por modelo, que las señales post_save/post_delete renuevan (ver
+  ``signals.py``); mientras nadie escriba, el total no se vuelve a contar.
+  La generación es un valor aleatorio, no un contador: si la caché la desaloja,
+  la que la reemplaza no coincide con ninguna anterior, así que lo guardado
+  bajo generaciones viejas nunca vuelve a ser válido.
+- Los conteos filtrados se guardan por consulta normalizada (SQL + parámetros)
+  con un TTL corto.
+- Cuando la tabla es grande (según las estadísticas del catálogo de la base de
+  datos) no se hace un COUNT exacto: el total sale del catálogo y los conteos
+  filtrados se acotan a ``CONTEOS_UMBRAL_EXACTO`` filas. En ambos casos el
+  conteo se marca como no exacto.
+"""
+import hashlib
+import uuid
+from typing import NamedTuple
+
+from django.conf import settings
+from django.core.cache import cache
+from django.db import DatabaseError, connections
+
+
+class Conteo(NamedTuple):
+    valor: int
+    exacto: bool
+
+
+def _ajuste(nombre, por_defecto):
+    return getattr(settings, nombre, por_defecto)
+
+
+def _clave_modelo(modelo):
+    return modelo._meta.label_lower
+
+
+def _clave_generacion(modelo):
+    return f'generacion:{_clave_modelo(modelo)}'
+
+
+def _nueva_generacion():
+    return uuid.uuid4().hex
+
+
+def generacion(modelo):
+    """Generación actual del modelo; cambia cada vez que se escribe en su tabla."""
+    clave = _clave_generacion(modelo)
+    valor = cache.get(clave)
+    if valor is None:
+        # add() evita pisar una generación que otro proceso acaba de fijar
+        cache.add(clave, _nueva_generacion(), None)
+        # Si la caché ya la desalojó, una generación nueva sin guardar sólo provoca un fallo
+        valor = cache.get(clave) or _nueva_generacion()
+    return valor
+
+
+def generaciones(*modelos):
+    """Generaciones de varios modelos con una sola lectura de la caché."""
+    claves = {_clave_generacion(modelo): modelo for modelo in modelos}
+    valores = cache.get_many(list(claves))
+    return [valores.get(clave) or generacion(modelo) for clave, modelo in claves.items()]
+
+
+def invalidar(modelo):
+    """Renueva la generación del modelo, invalidando todo lo cacheado sobre él."""
+    # Un set() de un valor nuevo, sin leer el anterior: no depende de que incr() sea atómico
+    cache.set(_clave_generacion(modelo), _nueva_generacion(), None)
+
+
+def estimar_filas(modelo, using='default'):
+    """
+    Número de filas de la tabla según las estadísticas del catálogo, sin recorrerla.
+    Devuelve None si el motor no ofrece una estimación.
+    """
+    conexion = connections[using]
+    tabla = modelo._meta.db_table
+    if conexion.vendor == 'microsoft':
+        sql = (
+            "SELECT SUM(row_count) FROM sys.dm_db_partition_stats "
+            "WHERE object_id = OBJECT_ID(%s) AND index_id IN (0, 1)"
+        )
+    elif conexion.vendor == 'postgresql':
+        sql = "SELECT reltuples::bigint FROM pg_class WHERE oid = %s::regclass"
+    elif conexion.vendor == 'mysql':
+        sql = (
+            "SELECT TABLE_ROWS FROM information_schema.TABLES "
+            "WHERE TABLE_SCHEMA = DATABASE() AND TABLE_NAME = %s"
+        )
+    else:
+        return None
+    try:
+        with conexion.cursor() as cursor:
+            cursor.execute(sql, [tabla])
+            fila = cursor.fetchone()
+    except DatabaseError:
+        return None
+    if not fila or fila[0] is None or fila[0] < 0:
+        return None
+    return int(fila[0])
+
+
+def _es_tabla_completa(queryset):
+    return not queryset.query.where and not queryset.query.distinct
+
+
+def contar_total(modelo):
+    """Total de filas del modelo, cacheado hasta la siguiente escritura."""
+    clave = f'conteos:total:{_clave_modelo(modelo)}:{generacion(modelo)}'
+    conteo = cache.get(clave)
+    if conteo is not None:
+        return Conteo(*conteo)
+
+    estimado = estimar_filas(modelo)
+    if estimado is not None and estimado > _ajuste('CONTEOS_UMBRAL_EXACTO', 200_000):
+        conteo = Conteo(estimado, False)
+    else:
+        conteo = Conteo(modelo._default_manager.count(), True)
+    cache.set(clave, tuple(conteo), _ajuste('CONTEOS_TTL_TOTAL', 60 * 60))
+    return conteo
+
+
+def contar(queryset):
+    """
+    Cuenta las filas de un queryset usando la caché.
+
+    Sin filtros equivale a ``contar_total``. Con filtros el resultado se guarda
+    por consulta normalizada con un TTL corto y, si la tabla es grande, el
+    conteo se acota al umbral configurado (``exacto=False`` si se alcanza).
+    """
+    modelo = queryset.model
+    if _es_tabla_completa(queryset):
+        return contar_total(modelo)
+
+    sql, params = queryset.order_by().values('pk').query.sql_with_params()
+    huella = hashlib.sha1(f'{sql}|{params!r}'.encode()).hexdigest()
+    clave = f'conteos:filtro:{_clave_modelo(modelo)}:{generacion(modelo)}:{huella}'
+    conteo = cache.get(clave)
+    if conteo is not None:
+        return Conteo(*conteo)
+
+    umbral = _ajuste('CONTEOS_UMBRAL_EXACTO', 200_000)
+    total = contar_total(modelo)
+    if total.valor > umbral:
+        # COUNT sobre un TOP/LIMIT: el costo queda acotado aunque el filtro sea poco selectivo
+        valor = queryset.order_by().values('pk')[:umbral + 1].count()
+        conteo = Conteo(min(valor, umbral), valor <= umbral)
+    else:
+        conteo = Conteo(queryset.count(), True)
+    cache.set(clave, tuple(conteo), _ajuste('CONTEOS_TTL_FILTRADO', 30))
+    return conteo
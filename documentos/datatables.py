@@ -0,0 +1,561 @@
+"""
+Motor declarativo para las APIs server-side de DataTables.
+
+Cada endpoint describe sus columnas con objetos ``Columna`` (campo del modelo,
+tipo de búsqueda y cómo se interpreta el valor escrito por el usuario) y
+``TablaDataTables`` se encarga de traducir los parámetros de DataTables
+(``columns[i][data]``, ``columns[i][search][value]``, ``start``, ``length``)
+en una sola consulta que trae únicamente las columnas pedidas, sin construir
+instancias del modelo. Las respuestas se codifican con orjson si está instalado.
+
+Además de la paginación clásica por ``start``/``length`` (OFFSET), las tablas
+aceptan un modo cursor (keyset): si la petición incluye el parámetro
+``cursor`` la página se obtiene buscando a partir de la última fila de la
+página anterior sobre la clave de orden, de modo que la página 5.000 cuesta
+lo mismo que la primera. La respuesta incluye ``nextCursor`` para pedir la
+página siguiente (``null`` cuando no hay más filas).
+
+El orden se resuelve en el servidor a partir de ``order[i][column]`` y
+``order[i][dir]``, sólo sobre las columnas marcadas como ``ordenable`` (las
+que tienen índice) y siempre con la clave única de la tabla como desempate.
+"""
+import copy
+import base64
+import json
+import re
+from datetime import date, datetime, time
+
+from django.conf import settings
+from django.core.exceptions import FieldDoesNotExist, ValidationError
+from django.core.serializers.json import DjangoJSONEncoder
+from django.db.models import Q
+from django.http import HttpResponse, JsonResponse, QueryDict
+from django.utils import timezone
+
+try:
+    import orjson  # Codificador JSON rápido (opcional)
+except ImportError:
+    orjson = None
+
+from . import cache_respuestas
+from .conteos import contar
+from .permisos import campos_para_permisos, permisos_de
+
+
+def _json_por_defecto(valor):
+    # Tipos que orjson no conoce (Decimal, textos traducibles...) se tratan como en Django
+    return DjangoJSONEncoder().default(valor)
+
+
+def respuesta_json(datos, status=200):
+    """
+    JsonResponse equivalente que usa orjson cuando está disponible. Las fechas
+    y horas pasan por DjangoJSONEncoder para que el formato sea el de siempre
+    (milisegundos y "Z" en UTC; orjson daría microsegundos y "+00:00").
+    """
+    if orjson is None:
+        return JsonResponse(datos, status=status)
+    return HttpResponse(
+        orjson.dumps(datos, default=_json_por_defecto, option=orjson.OPT_PASSTHROUGH_DATETIME),
+        content_type='application/json',
+        status=status,
+    )
+
+
+# Valores que los usuarios escriben en los filtros de columnas booleanas
+VALORES_VERDADEROS = {'✔', 'true', '1', 'si', 'sí'}
+VALORES_FALSOS = {'✖', 'false', '0', 'no'}
+
+
+def parsear_booleano(valor):
+    """
+    Convierte el texto de un filtro en True/False.
+    Devuelve None si el texto no se reconoce (no se filtra).
+    """
+    valor = valor.strip().lower()
+    if valor in VALORES_VERDADEROS:
+        return True
+    if valor in VALORES_FALSOS:
+        return False
+    return None
+
+
+def parsear_entero(valor, por_defecto=0):
+    """
+    Convierte un parámetro de la petición en entero, tolerando valores vacíos o inválidos.
+    """
+    try:
+        return int(valor)
+    except (TypeError, ValueError):
+        return por_defecto
+
+
+# Fechas parciales aceptadas en los filtros: AAAA, AAAA-MM, AAAA-MM-DD (también con "/"),
+# DD/MM/AAAA y MM/AAAA
+_FECHA_ISO = re.compile(r'^(\d{4})(?:[-/](\d{1,2})(?:[-/](\d{1,2}))?)?$')
+_FECHA_LOCAL = re.compile(r'^(?:(\d{1,2})[-/])?(\d{1,2})[-/](\d{4})$')
+
+
+def _siguiente_mes(anio, mes):
+    return date(anio + 1, 1, 1) if mes == 12 else date(anio, mes + 1, 1)
+
+
+def parsear_fecha_parcial(texto):
+    """
+    Convierte una fecha parcial en el intervalo semiabierto [desde, hasta) que cubre.
+    "2023" -> [2023-01-01, 2024-01-01); "2023-05" -> [2023-05-01, 2023-06-01);
+    "2023-05-14" -> [2023-05-14, 2023-05-15). Devuelve None si no es una fecha válida.
+    """
+    texto = texto.strip()
+    coincidencia = _FECHA_ISO.match(texto)
+    if coincidencia:
+        anio, mes, dia = coincidencia.groups()
+    else:
+        coincidencia = _FECHA_LOCAL.match(texto)
+        if not coincidencia:
+            return None
+        dia, mes, anio = coincidencia.groups()
+    try:
+        anio = int(anio)
+        if mes is None:
+            return date(anio, 1, 1), date(anio + 1, 1, 1)
+        mes = int(mes)
+        if dia is None:
+            return date(anio, mes, 1), _siguiente_mes(anio, mes)
+        desde = date(anio, mes, int(dia))
+        return desde, date.fromordinal(desde.toordinal() + 1)
+    except ValueError:
+        return None
+
+
+def parsear_rango_fechas(valor):
+    """
+    Interpreta el texto de un filtro de fecha como intervalo semiabierto (desde, hasta).
+
+    Acepta una fecha parcial ("2023", "2023-05", "2023-05-14") o un rango
+    "inicio..fin" con extremos parciales ("2023-01..2023-06" cubre de enero a
+    junio completos). Un extremo vacío deja el rango abierto ("2023..").
+    Cualquiera de los dos límites puede ser None. Devuelve None si el texto no
+    es una fecha (no se filtra).
+    """
+    if '..' not in valor:
+        return parsear_fecha_parcial(valor)
+    inicio, fin = (parte.strip() for parte in valor.split('..', 1))
+    desde = hasta = None
+    if inicio:
+        intervalo = parsear_fecha_parcial(inicio)
+        if intervalo is None:
+            return None
+        desde = intervalo[0]
+    if fin:
+        intervalo = parsear_fecha_parcial(fin)
+        if intervalo is None:
+            return None
+        hasta = intervalo[1]
+    if desde is None and hasta is None:
+        return None
+    return desde, hasta
+
+
+def longitud_maxima():
+    """Máximo de filas por página; también se usa cuando DataTables pide "Todos" (length=-1)."""
+    return getattr(settings, 'DATATABLES_LONGITUD_MAXIMA', 1000)
+
+
+class CursorInvalido(ValueError):
+    """El parámetro ``cursor`` no corresponde a una clave de orden válida."""
+
+
+def _codificar(objeto):
+    return base64.urlsafe_b64encode(json.dumps(objeto).encode()).decode()
+
+
+def _decodificar(cursor):
+    try:
+        return json.loads(base64.urlsafe_b64decode(cursor.encode()))
+    except (ValueError, TypeError) as e:
+        raise CursorInvalido(str(e))
+
+
+def codificar_cursor(valores):
+    """Serializa los valores de la clave de orden en un token opaco para la URL."""
+    return _codificar([
+        valor.isoformat() if hasattr(valor, 'isoformat') else valor
+        for valor in valores
+    ])
+
+
+def decodificar_cursor(cursor, cantidad):
+    valores = _decodificar(cursor)
+    if not isinstance(valores, list) or len(valores) != cantidad:
+        raise CursorInvalido("El cursor no corresponde al orden de la tabla.")
+    return valores
+
+
+def codificar_posicion(posicion):
+    """Cursor por posición, para órdenes que no admiten búsqueda por clave."""
+    return _codificar({'posicion': posicion})
+
+
+def decodificar_posicion(cursor):
+    valor = _decodificar(cursor)
+    posicion = valor.get('posicion') if isinstance(valor, dict) else None
+    if not isinstance(posicion, int) or posicion < 0:
+        raise CursorInvalido("El cursor no corresponde al orden de la tabla.")
+    return posicion
+
+
+class Columna:
+    """
+    Describe una columna de DataTables.
+
+    - nombre: clave en ``columns[i][data]`` y en cada fila de la respuesta.
+    - campo: ruta ORM del valor (por ejemplo ``codigo_serie__nombre``).
+    - lookup: tipo de búsqueda aplicado al filtrar (``icontains``, ``exact``...).
+    - parser: función que convierte el texto del filtro; si devuelve None no se filtra.
+    - por_defecto: valor enviado cuando el campo (o la relación) es nulo.
+    - buscable: si la columna acepta búsqueda por columna.
+    - ordenable: si se puede ordenar por la columna en el servidor; reservado a
+      campos con índice para que ordenar no obligue a recorrer la tabla.
+    - titulo: encabezado usado en las exportaciones.
+    """
+
+    def __init__(self, nombre, campo=None, lookup='icontains', parser=None,
+                 por_defecto=None, buscable=True, ordenable=False, titulo=None):
+        self.nombre = nombre
+        self.campo = campo or nombre
+        self.lookup = lookup
+        self.parser = parser
+        self.por_defecto = por_defecto
+        self.buscable = buscable
+        self.ordenable = ordenable
+        self.titulo = titulo or nombre
+
+    def filtrar(self, queryset, valor):
+        if self.parser is not None:
+            valor = self.parser(valor)
+            if valor is None:
+                return queryset
+        return queryset.filter(**{f'{self.campo}__{self.lookup}': valor})
+
+
+class ColumnaFecha(Columna):
+    """
+    Columna de fecha filtrada por rangos: la búsqueda se traduce en
+    ``campo >= desde AND campo < hasta`` sobre la columna original, que puede
+    usar un índice (en lugar de convertir cada fecha a texto con icontains).
+    ``con_hora`` indica que el campo es DateTimeField.
+    """
+
+    def __init__(self, nombre, campo=None, con_hora=False, **kwargs):
+        kwargs.setdefault('parser', parsear_rango_fechas)
+        super().__init__(nombre, campo, **kwargs)
+        self.con_hora = con_hora
+
+    def _limite(self, dia):
+        if not self.con_hora:
+            return dia
+        return timezone.make_aware(datetime.combine(dia, time.min))
+
+    def filtrar(self, queryset, valor):
+        rango = self.parser(valor)
+        if rango is None:
+            return queryset
+        desde, hasta = rango
+        condiciones = {}
+        if desde is not None:
+            condiciones[f'{self.campo}__gte'] = self._limite(desde)
+        if hasta is not None:
+            condiciones[f'{self.campo}__lt'] = self._limite(hasta)
+        return queryset.filter(**condiciones)
+
+
+class TablaDataTables:
+    """
+    Convierte una petición de DataTables en una consulta paginada.
+
+    Por página se ejecutan como máximo tres consultas: total sin filtros,
+    total filtrado y la página (una sola consulta ``values_list`` con las
+    relaciones unidas por JOIN y sólo los campos de las columnas pedidas). Los
+    dos conteos pasan por ``conteos.contar``, así que normalmente salen de la caché.
+
+    ``orden`` es la clave de orden por defecto de la tabla; debe terminar en un
+    campo único para que tanto la paginación por OFFSET como la de cursor sean
+    estables. Ese último campo es también el desempate de los órdenes pedidos
+    por DataTables (ver ``ordenada``).
+
+    ``busqueda_global`` es una función (queryset, texto) -> queryset que resuelve
+    el cuadro de búsqueda general de DataTables (``search[value]``).
+
+    ``anotaciones`` son expresiones (nombre -> expresión) que sólo se calculan en
+    la consulta de la página, no en los conteos; una columna las usa poniendo
+    el nombre de la anotación como campo.
+
+    Con ``cachear=True`` las respuestas pasan por ``cache_respuestas``;
+    ``dependencias`` son los modelos cuyas escrituras las invalidan (por
+    defecto sólo ``modelo``).
+
+    ``permisos`` (bandera -> permiso por objeto, p. ej. ``{'can_edit':
+    'edit_own_registro'}``) añade a cada fila de la página esas banderas para
+    el usuario de la petición. Se calculan para toda la página de una vez
+    (``PermisosObjeto.banderas``) con los campos de ``campos_para_permisos``,
+    que viajan en la misma consulta de la página.
+    """
+
+    def __init__(self, modelo, columnas, orden=('pk',), busqueda_global=None,
+                 anotaciones=None, cachear=False, dependencias=None, permisos=None):
+        self.modelo = modelo
+        self.columnas = list(columnas)
+        self.columnas_por_nombre = {columna.nombre: columna for columna in self.columnas}
+        self.orden = tuple(orden)
+        self.busqueda_global = busqueda_global
+        self.anotaciones = dict(anotaciones or {})
+        self.cachear = cachear
+        self.dependencias = tuple(dependencias or (modelo,))
+        self.permisos = dict(permisos or {})
+
+    def get_queryset(self, request):
+        return self.modelo.objects.all()
+
+    def filtrar(self, queryset, params):
+        """Aplica las búsquedas por columna y la búsqueda general enviadas por DataTables."""
+        i = 0
+        while True:
+            nombre = params.get(f'columns[{i}][data]')
+            if nombre is None:
+                break  # no hay más columnas en el request
+            valor = params.get(f'columns[{i}][search][value]', '').strip()
+            columna = self.columnas_por_nombre.get(nombre)
+            if valor and columna is not None and columna.buscable:
+                queryset = columna.filtrar(queryset, valor)
+            i += 1
+
+        valor = params.get('search[value]', '').strip()
+        if valor and self.busqueda_global is not None:
+            queryset = self.busqueda_global(queryset, valor)
+        return queryset
+
+    def ordenada(self, params):
+        """
+        Devuelve la tabla con el orden pedido en ``order[i][column]`` / ``order[i][dir]``.
+
+        Sólo se aceptan columnas ``ordenable``; las demás se ignoran. Al final se
+        añade el campo único de ``orden`` en la dirección de la última columna,
+        así el orden es total (paginación estable) y el índice se puede recorrer
+        en un solo sentido. Sin orden válido se devuelve la tabla tal cual.
+        """
+        desempate = self.orden[-1].lstrip('-')
+        orden = []
+        i = 0
+        while True:
+            indice = params.get(f'order[{i}][column]')
+            if indice is None:
+                break
+            columna = self.columnas_por_nombre.get(params.get(f'columns[{indice}][data]'))
+            i += 1
+            if columna is None or not columna.ordenable:
+                continue
+            if any(campo.lstrip('-') == columna.campo for campo in orden):
+                continue
+            prefijo = '-' if params.get(f'order[{i - 1}][dir]') == 'desc' else ''
+            orden.append(f'{prefijo}{columna.campo}')
+            if columna.campo in (desempate, 'pk'):
+                break  # ya es único: el resto no cambia el orden
+        if not orden:
+            return self
+        if orden[-1].lstrip('-') not in (desempate, 'pk'):
+            orden.append(('-' if orden[-1].startswith('-') else '') + desempate)
+        tabla = copy.copy(self)
+        tabla.orden = tuple(orden)
+        return tabla
+
+    def admite_seek(self):
+        """
+        La paginación por clave compara con > y <, que no funciona con NULL (y
+        cada motor los ordena en un extremo distinto). Si algún campo del orden
+        admite nulos, o no es un campo del modelo (una anotación, una
+        relación), el cursor pasa a ser una posición (OFFSET).
+        """
+        for campo, _ in self.clave_orden():
+            if '__' in campo or campo in self.anotaciones:
+                return False
+            try:
+                if self.modelo._meta.get_field(campo).null:
+                    return False
+            except FieldDoesNotExist:
+                return False
+        return True
+
+    def clave_orden(self):
+        """Devuelve la clave de orden como lista de (campo, descendente)."""
+        clave = []
+        for campo in self.orden:
+            descendente = campo.startswith('-')
+            campo = campo.lstrip('-')
+            clave.append((self.modelo._meta.pk.name if campo == 'pk' else campo, descendente))
+        return clave
+
+    def columnas_pedidas(self, params):
+        """
+        Columnas que pidió DataTables (``columns[i][data]``), en el orden de la tabla.
+        La columna de la clave primaria se envía siempre (la usan los enlaces de
+        acciones); sin parámetros ``columns`` se devuelven todas.
+        """
+        pedidas = set()
+        i = 0
+        while True:
+            nombre = params.get(f'columns[{i}][data]')
+            if nombre is None:
+                break
+            pedidas.add(nombre)
+            i += 1
+        if not pedidas:
+            return self.columnas
+        pk = self.modelo._meta.pk.name
+        return [c for c in self.columnas if c.nombre in pedidas or c.campo in (pk, 'pk')]
+
+    def proyectar(self, queryset, columnas=None, extra=()):
+        """
+        Ordena por la clave de orden y proyecta con ``values_list``: los campos de
+        las columnas, los de ``extra`` y los de la clave de orden. Las relaciones
+        (``codigo_serie__nombre``...) se resuelven con JOIN en la misma consulta
+        y no se construyen instancias del modelo.
+        """
+        columnas = self.columnas if columnas is None else columnas
+        campos = [c.campo for c in columnas] + list(extra) + [campo for campo, _ in self.clave_orden()]
+        anotaciones = {nombre: e for nombre, e in self.anotaciones.items() if nombre in campos}
+        if anotaciones:
+            queryset = queryset.annotate(**anotaciones)
+        return queryset.order_by(*self.orden).values_list(*campos)
+
+    def serializar(self, fila, columnas=None):
+        """Convierte una tupla de ``proyectar`` en el diccionario de la fila."""
+        columnas = self.columnas if columnas is None else columnas
+        return {
+            columna.nombre: columna.por_defecto if valor is None else valor
+            for columna, valor in zip(columnas, fila)
+        }
+
+    def longitud(self, params):
+        """
+        Tamaño de página pedido, limitado a ``longitud_maxima()``.
+        ``length=-1`` ("Todos" en DataTables) se trata como el máximo permitido.
+        """
+        length = parsear_entero(params.get('length'), 10)
+        maximo = longitud_maxima()
+        if length < 0:
+            return maximo
+        return min(length or 10, maximo)
+
+    def valores_cursor(self, cursor):
+        """Valores de la clave de orden del cursor, convertidos al tipo de cada campo."""
+        clave = self.clave_orden()
+        valores = decodificar_cursor(cursor, len(clave))
+        try:
+            return [self.modelo._meta.get_field(campo).to_python(valor) for (campo, _), valor in zip(clave, valores)]
+        except ValidationError as e:
+            raise CursorInvalido('; '.join(e.messages))
+
+    def condicion_seek(self, valores):
+        """
+        Condición "fila posterior al cursor" sobre la clave de orden:
+        (a > x) OR (a = x AND b > y) OR ... respetando la dirección de cada campo.
+        """
+        condicion = Q()
+        iguales = {}
+        for (campo, descendente), valor in zip(self.clave_orden(), valores):
+            lookup = 'lt' if descendente else 'gt'
+            condicion |= Q(**iguales, **{f'{campo}__{lookup}': valor})
+            iguales[campo] = valor
+        return condicion
+
+    def valores_orden(self, fila):
+        # La clave de orden va al final de cada tupla de ``proyectar``
+        return list(fila[-len(self.orden):])
+
+    def pagina_cursor(self, queryset, cursor, length):
+        """Obtiene la página que sigue al cursor y el cursor de la página siguiente."""
+        if not self.admite_seek():
+            inicio = decodificar_posicion(cursor) if cursor else 0
+            filas = list(queryset[inicio:inicio + length + 1])
+            siguiente = codificar_posicion(inicio + length) if len(filas) > length else None
+            return filas[:length], siguiente
+        if cursor:
+            queryset = queryset.filter(self.condicion_seek(self.valores_cursor(cursor)))
+        # Se pide una fila de más para saber si hay una página siguiente
+        filas = list(queryset[:length + 1])
+        siguiente = None
+        if len(filas) > length:
+            filas = filas[:length]
+            siguiente = codificar_cursor(self.valores_orden(filas[-1]))
+        return filas, siguiente
+
+    def datos(self, request, queryset=None):
+        """
+        Cuerpo de la respuesta para la petición, sin ``draw``.
+        Lanza ``CursorInvalido`` si el cursor no corresponde al orden.
+        """
+        params = request.GET
+        start = max(parsear_entero(params.get('start'), 0), 0)
+        length = self.longitud(params)
+        cursor = params.get('cursor')
+
+        if queryset is None:
+            queryset = self.get_queryset(request)
+        total = contar(queryset)
+        filtrado = self.filtrar(queryset, params)
+        filtrados = contar(filtrado)
+
+        datos = {
+            "recordsTotal": total.valor,
+            "recordsFiltered": filtrados.valor,
+            # Los conteos pueden ser estimaciones en tablas muy grandes
+            "recordsTotalExact": total.exacto,
+            "recordsFilteredExact": filtrados.exacto,
+        }
+        columnas = self.columnas_pedidas(params)
+        extra = campos_para_permisos(self.modelo) if self.permisos else ()
+        tabla = self.ordenada(params)
+        pagina = tabla.proyectar(filtrado, columnas, extra)
+        if cursor is not None:
+            filas, siguiente = tabla.pagina_cursor(pagina, cursor, length)
+            datos["nextCursor"] = siguiente
+        else:
+            filas = pagina[start:start + length]
+
+        datos["data"] = [self.serializar(fila, columnas) for fila in filas]
+        if self.permisos:
+            self.marcar_permisos(request, datos["data"], filas, len(columnas), extra)
+        return datos
+
+    def marcar_permisos(self, request, filas_json, filas, inicio, campos):
+        """Añade a cada fila las banderas de ``permisos`` (``campos`` van en la tupla desde ``inicio``)."""
+        objetos = [self.modelo(**dict(zip(campos, fila[inicio:inicio + len(campos)]))) for fila in filas]
+        for fila_json, banderas in zip(filas_json, permisos_de(request).banderas(objetos, self.permisos)):
+            fila_json.update(banderas)
+
+    def _datos_cacheados(self, request, queryset=None):
+        def calcular():
+            return self.datos(request, queryset)
+
+        if self.cachear:
+            return cache_respuestas.obtener(request, self.dependencias, calcular)
+        return calcular()
+
+    def responder(self, request, queryset=None):
+        try:
+            datos = self._datos_cacheados(request, queryset)
+        except CursorInvalido as e:
+            return respuesta_json({"error": f"Cursor inválido: {e}"}, status=400)
+        return respuesta_json({"draw": parsear_entero(request.GET.get('draw'), 1), **datos})
+
+    def primera_pagina(self, request, length, queryset=None):
+        """
+        Datos de la primera página (orden por defecto, sin filtros y en modo
+        cursor), para incrustarlos en la página HTML con ``json_script`` y
+        ahorrar la primera petición de DataTables.
+        """
+        peticion = copy.copy(request)
+        peticion.GET = QueryDict(mutable=True)
+        peticion.GET.update({'cursor': '', 'length': str(length)})
+        return self._datos_cacheados(peticion, queryset)
@@ -0,0 +1,154 @@
+"""
+Exportación en streaming de listados filtrados (CSV, NDJSON, XLSX).
+
+Las filas se leen con ``.iterator(chunk_size=...)`` y se escriben a medida que
+llegan, así la memoria no depende del número de filas exportadas:
+
+- CSV y NDJSON se envían con ``StreamingHttpResponse`` línea a línea.
+- XLSX se genera con openpyxl en modo ``write_only`` sobre un archivo temporal
+  que luego se envía con ``FileResponse`` (y se borra al cerrarse).
+
+``escribir_exportacion`` escribe cualquiera de los formatos en un archivo; lo
+usan las exportaciones en segundo plano (``trabajos.py``).
+
+Los textos que una hoja de cálculo tomaría por fórmulas (empiezan por "=",
+"+", "-" o "@") no se ejecutan al abrir el archivo: en CSV se les antepone un
+apóstrofo (que la importación quita, ver ``importacion.py``) y en XLSX se
+guardan como celdas de texto.
+"""
+import csv
+import json
+import tempfile
+from datetime import date, datetime
+
+from django.core.serializers.json import DjangoJSONEncoder
+from django.http import FileResponse, StreamingHttpResponse
+from django.utils import timezone
+
+import openpyxl
+from openpyxl.cell import WriteOnlyCell
+
+TAMANO_LOTE = 2000
+
+FORMATOS = {
+    'csv': 'text/csv; charset=utf-8',
+    'ndjson': 'application/x-ndjson; charset=utf-8',
+    'xlsx': 'application/vnd.openxmlformats-officedocument.spreadsheetml.sheet',
+}
+
+
+# Comienzos con los que Excel y LibreOffice interpretan una celda como fórmula
+INICIO_FORMULA = ('=', '+', '-', '@', '\t', '\r')
+
+
+class _Eco:
+    """Pseudo-archivo para csv.writer: devuelve la línea en lugar de guardarla."""
+
+    def write(self, valor):
+        return valor
+
+
+def _texto(valor):
+    """Representación de un valor para CSV/XLSX."""
+    if valor is None:
+        return ""
+    if isinstance(valor, bool):
+        return "Sí" if valor else "No"
+    if isinstance(valor, datetime):
+        if timezone.is_aware(valor):
+            valor = timezone.localtime(valor)
+        return valor.strftime('%Y-%m-%d %H:%M')
+    if isinstance(valor, date):
+        return valor.strftime('%Y-%m-%d')
+    return valor
+
+
+def _valor_csv(valor):
+    valor = _texto(valor)
+    if isinstance(valor, str) and valor.startswith(INICIO_FORMULA):
+        return "'" + valor
+    return valor
+
+
+def _celda_xlsx(ws, valor):
+    valor = _texto(valor)
+    if isinstance(valor, str) and valor.startswith('='):
+        # openpyxl guarda como fórmula cualquier texto que empiece por "="
+        celda = WriteOnlyCell(ws, value=valor)
+        celda.data_type = 's'
+        return celda
+    return valor
+
+
+def filas(tabla, queryset, chunk_size=TAMANO_LOTE, progreso=None):
+    """
+    Recorre el queryset proyectado por la tabla en lotes y devuelve cada fila
+    serializada. ``progreso(procesadas)``, si se indica, se llama al completar cada lote.
+    """
+    procesadas = 0
+    for fila in tabla.proyectar(queryset).iterator(chunk_size=chunk_size):
+        yield tabla.serializar(fila)
+        procesadas += 1
+        if progreso is not None and procesadas % chunk_size == 0:
+            progreso(procesadas)
+    if progreso is not None:
+        progreso(procesadas)
+
+
+def _csv(tabla, queryset, progreso=None):
+    escritor = csv.writer(_Eco())
+    # BOM para que Excel reconozca el archivo como UTF-8
+    yield '\ufeff' + escritor.writerow([columna.titulo for columna in tabla.columnas])
+    for fila in filas(tabla, queryset, progreso=progreso):
+        yield escritor.writerow([_valor_csv(valor) for valor in fila.values()])
+
+
+def _ndjson(tabla, queryset, progreso=None):
+    for fila in filas(tabla, queryset, progreso=progreso):
+        yield json.dumps(fila, cls=DjangoJSONEncoder, ensure_ascii=False) + '\n'
+
+
+def _escribir_xlsx(tabla, queryset, titulo, archivo, progreso=None):
+    wb = openpyxl.Workbook(write_only=True)
+    ws = wb.create_sheet(title=titulo[:31])
+    ws.append([columna.titulo for columna in tabla.columnas])
+    for fila in filas(tabla, queryset, progreso=progreso):
+        ws.append([_celda_xlsx(ws, valor) for valor in fila.values()])
+    wb.save(archivo)
+
+
+def _xlsx(tabla, queryset, titulo):
+    archivo = tempfile.TemporaryFile()
+    _escribir_xlsx(tabla, queryset, titulo, archivo)
+    archivo.seek(0)
+    return archivo
+
+
+def escribir_exportacion(tabla, queryset, formato, archivo, nombre, progreso=None):
+    """
+    Escribe en ``archivo`` (binario) la exportación en ``formato``.
+    ``progreso(procesadas)`` se llama cada ``TAMANO_LOTE`` filas.
+    """
+    if formato == 'xlsx':
+        _escribir_xlsx(tabla, queryset, nombre, archivo, progreso)
+        return
+    generador = _csv(tabla, queryset, progreso) if formato == 'csv' else _ndjson(tabla, queryset, progreso)
+    for linea in generador:
+        archivo.write(linea.encode('utf-8'))
+
+
+def respuesta_exportacion(tabla, queryset, formato, nombre):
+    """
+    Construye la respuesta de descarga para ``formato`` ('csv', 'ndjson' o 'xlsx').
+    ``queryset`` debe venir ya filtrado; la tabla aporta columnas, orden y proyección.
+    """
+    nombre_archivo = f'{nombre}_{timezone.localdate():%Y%m%d}.{formato}'
+    if formato == 'xlsx':
+        return FileResponse(
+            _xlsx(tabla, queryset, nombre), as_attachment=True,
+            filename=nombre_archivo, content_type=FORMATOS['xlsx'],
+        )
+    generador = _csv(tabla, queryset) if formato == 'csv' else _ndjson(tabla, queryset)
+    respuesta = StreamingHttpResponse(generador, content_type=FORMATOS[formato])
+    respuesta['Content-Disposition'] = f'attachment; filename="{nombre_archivo}"'
+    return respuesta
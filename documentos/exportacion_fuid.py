@@ -0,0 +1,361 @@
+"""
+Formato FUID en Excel (``export_fuid_to_excel``) generado en streaming.
+
+- El libro se escribe con openpyxl en modo ``write_only``: cada fila va al
+  archivo en cuanto se genera y la hoja nunca está completa en memoria.
+- Los registros salen de una sola consulta ``values_list`` con JOIN a serie,
+  subserie y creador, recorrida en lotes con ``iterator``.
+- En modo ``write_only`` los anchos de columna se escriben al principio de la
+  hoja, antes que las filas. Por eso los registros se pasan primero, por
+  lotes, a un archivo temporal mientras se lleva el ancho máximo de cada
+  columna, y después se vuelcan al libro. Así no hace falta recorrer otra vez
+  todas las celdas para calcular los anchos.
+- Las partes fijas del encabezado (logo, rango combinado A1:V6 y los 21
+  encabezados combinados de los registros) se preparan una vez por proceso
+  (``bloque_encabezado``).
+- ``cache_fuid`` guarda los libros generados en disco por versión del FUID.
+"""
+import hashlib
+import pickle
+from copy import copy
+import tempfile
+from functools import lru_cache
+from io import BytesIO
+
+from django.conf import settings
+
+import openpyxl
+from openpyxl.cell import WriteOnlyCell
+from openpyxl.drawing.image import Image
+from openpyxl.styles import Alignment, Border, PatternFill, Side
+from openpyxl.utils import get_column_letter
+
+from .models import RegistroDeArchivo
+
+TAMANO_LOTE = 2000
+
+CONTENT_TYPE = 'application/vnd.openxmlformats-officedocument.spreadsheetml.sheet'
+
+# Columnas ocupadas por el logo (A1:V6); fijan también el número de columnas con ancho
+COLUMNAS_LOGO = 22
+FILAS_LOGO = 6
+# Filas que ocupa cada encabezado de la tabla de registros (celdas combinadas)
+ALTO_ENCABEZADOS = 4
+# Datos generales (título y 4 filas) y filas en blanco antes de los registros
+FILAS_DATOS_GENERALES = 5
+FILAS_SEPARACION = 3
+FILA_ENCABEZADOS = FILAS_LOGO + FILAS_DATOS_GENERALES + FILAS_SEPARACION + 1
+
+# Se incrementa al cambiar la disposición del formato: invalida los libros en caché (cache_fuid)
+VERSION_FORMATO = 1
+
+ENCABEZADOS_REGISTROS = [
+    "N° Orden", "Código", "Código Serie", "Código Subserie", "Unidad Documental",
+    "Fecha Inicial", "Fecha Final", "Soporte Físico", "Soporte Electrónico",
+    "Caja", "Carpeta", "Tomo/Legajo/Libro", "N° Folios", "Tipo", "Cantidad",
+    "Ubicación", "Cantidad Electrónicos", "Tamaño Electrónico", "Notas", "Creado Por", "Fecha Creación",
+]
+
+# Campos de la consulta de registros, en el orden de ENCABEZADOS_REGISTROS
+CAMPOS_REGISTROS = (
+    'numero_orden', 'codigo', 'codigo_serie__nombre', 'codigo_subserie__nombre', 'unidad_documental',
+    'fecha_inicial', 'fecha_final', 'soporte_fisico', 'soporte_electronico',
+    'caja', 'carpeta', 'tomo_legajo_libro', 'numero_folios', 'tipo', 'cantidad',
+    'ubicacion', 'cantidad_documentos_electronicos', 'tamano_documentos_electronicos', 'notas',
+    'creado_por__username', 'fecha_creacion',
+)
+
+BORDE = Border(
+    left=Side(border_style="thin"),
+    right=Side(border_style="thin"),
+    top=Side(border_style="thin"),
+    bottom=Side(border_style="thin"),
+)
+RELLENO_ENCABEZADO = PatternFill(start_color="EEECE1", end_color="EEECE1", fill_type="solid")
+CENTRADO = Alignment(horizontal="center", vertical="center")
+
+
+def truncar(valor, longitud_maxima=30):
+    """Texto de la celda recortado a ``longitud_maxima`` caracteres; "N/A" si está vacío."""
+    if not valor:
+        return "N/A"
+    valor = str(valor)
+    return valor if len(valor) <= longitud_maxima else valor[:longitud_maxima - 3] + "..."
+
+
+def _fecha(valor, formato='%Y-%m-%d'):
+    return valor.strftime(formato) if valor else "N/A"
+
+
+def fila_registro(valores):
+    """Convierte una tupla de ``CAMPOS_REGISTROS`` en los valores de la fila del formato."""
+    (numero_orden, codigo, serie, subserie, unidad_documental, fecha_inicial, fecha_final,
+     soporte_fisico, soporte_electronico, caja, carpeta, tomo_legajo_libro, numero_folios, tipo,
+     cantidad, ubicacion, cantidad_electronicos, tamano_electronicos, notas, creado_por,
+     fecha_creacion) = valores
+    return [
+        numero_orden,
+        truncar(codigo),
+        truncar(serie),
+        truncar(subserie),
+        truncar(unidad_documental),
+        _fecha(fecha_inicial),
+        _fecha(fecha_final),
+        "Sí" if soporte_fisico else "No",
+        "Sí" if soporte_electronico else "No",
+        truncar(caja),
+        truncar(carpeta),
+        truncar(tomo_legajo_libro),
+        numero_folios or "N/A",
+        truncar(tipo),
+        cantidad or "N/A",
+        truncar(ubicacion),
+        cantidad_electronicos or "N/A",
+        truncar(tamano_electronicos),
+        truncar(notas),
+        creado_por or "N/A",
+        fecha_creacion.strftime('%Y-%m-%d %H:%M'),
+    ]
+
+
+def registros_del_fuid(fuid):
+    """Consulta única (con JOIN) de los registros del FUID, ya proyectada para el formato."""
+    return (
+        RegistroDeArchivo.objects.filter(fuids=fuid)
+        .order_by('id')
+        .values_list(*CAMPOS_REGISTROS)
+    )
+
+
+class AnchoColumnas:
+    """Ancho máximo del texto de cada columna, actualizado fila a fila."""
+
+    def __init__(self, columnas):
+        self.anchos = [0] * columnas
+
+    def medir(self, valores):
+        for indice, valor in enumerate(valores):
+            if valor:
+                if indice >= len(self.anchos):
+                    self.anchos.extend([0] * (indice + 1 - len(self.anchos)))
+                self.anchos[indice] = max(self.anchos[indice], len(str(valor)))
+
+    def aplicar(self, ws):
+        for indice, ancho in enumerate(self.anchos, start=1):
+            ws.column_dimensions[get_column_letter(indice)].width = ancho + 2
+
+
+@lru_cache(maxsize=1)
+def _bytes_logo():
+    ruta = getattr(settings, 'FUID_LOGO', None)
+    if not ruta:
+        return None
+    try:
+        with open(ruta, 'rb') as archivo:
+            return archivo.read()
+    except OSError:
+        return None
+
+
+def _celda(ws, valor, borde=None, relleno=None, alineacion=None):
+    celda = WriteOnlyCell(ws, value=valor)
+    if borde is not None:
+        celda.border = borde
+    if relleno is not None:
+        celda.fill = relleno
+    if alineacion is not None:
+        celda.alignment = alineacion
+    return celda
+
+
+class BloqueEncabezado:
+    """
+    Partes fijas del encabezado del formato, preparadas una vez por proceso:
+    los rangos combinados (logo en A1:V6 y cada encabezado de registros en
+    ALTO_ENCABEZADOS filas) y el logo. Las celdas con estilo se crean en cada
+    libro, porque openpyxl registra los estilos en la tabla del libro: se
+    estiliza la primera y las demás copian su índice.
+    """
+
+    def __init__(self):
+        fin = FILA_ENCABEZADOS + ALTO_ENCABEZADOS - 1
+        self.rangos = (f"A1:{get_column_letter(COLUMNAS_LOGO)}{FILAS_LOGO}",) + tuple(
+            f"{letra}{FILA_ENCABEZADOS}:{letra}{fin}"
+            for letra in map(get_column_letter, range(1, len(ENCABEZADOS_REGISTROS) + 1))
+        )
+        self.logo = _bytes_logo()
+        # Huella del logo para la clave de los libros en caché (cache_fuid)
+        self.huella_logo = hashlib.sha1(self.logo).hexdigest() if self.logo is not None else ''
+
+    def aplicar(self, ws):
+        """Combina los rangos del encabezado y coloca el logo en ``ws``."""
+        for rango in self.rangos:
+            ws.merged_cells.add(rango)
+        if self.logo is not None:
+            # Una imagen nueva por libro (openpyxl la ancla a la hoja), sin volver a leer el disco
+            imagen = Image(BytesIO(self.logo))
+            imagen.width = 1000
+            imagen.height = 120
+            ws.add_image(imagen, "A1")
+
+    def fila_encabezados(self, ws):
+        primera = _celda(ws, ENCABEZADOS_REGISTROS[0], BORDE, RELLENO_ENCABEZADO, CENTRADO)
+        fila = [primera]
+        for titulo in ENCABEZADOS_REGISTROS[1:]:
+            celda = WriteOnlyCell(ws, value=titulo)
+            celda._style = copy(primera._style)
+            fila.append(celda)
+        return fila
+
+
+@lru_cache(maxsize=1)
+def bloque_encabezado():
+    return BloqueEncabezado()
+
+
+class FilasConBorde:
+    """
+    Construye filas con borde en las celdas con contenido (en todas con
+    ``siempre``). Asignar ``celda.border`` busca el estilo en el libro en cada
+    celda; aquí se resuelve una vez y se copia el índice de estilos ya calculado.
+    """
+
+    def __init__(self, ws):
+        self.ws = ws
+        self.estilo = _celda(ws, None, BORDE)._style
+
+    def __call__(self, valores, siempre=False):
+        fila = []
+        for valor in valores:
+            celda = WriteOnlyCell(self.ws, value=valor)
+            if siempre or valor:
+                celda._style = copy(self.estilo)
+            fila.append(celda)
+        return fila
+
+
+def _datos_generales(fuid):
+    fecha = fuid.fecha_creacion
+    datos = [
+        ("Entidad Productora", fuid.entidad_productora, fecha.year, fecha.month, fecha.day, ""),
+        ("Unidad Administrativa", fuid.unidad_administrativa, "", "", "", ""),
+        ("Oficina Productora", fuid.oficina_productora, "", "", "", ""),
+        ("Objeto", fuid.objeto, "", "", "", ""),
+    ]
+    # Campo y Valor en las columnas A y B; AÑO, MES, DÍA y N.T. en Q a T
+    filas = [["Campo", "Valor"] + [None] * 14 + ["AÑO", "MES", "DÍA", "N.T."]]
+    for campo, relacion, *fecha_nt in datos:
+        filas.append([campo, relacion.nombre if relacion else "N/A"] + [None] * 14 + fecha_nt)
+    return filas
+
+
+def _roles(fuid):
+    return [
+        ["Elaborado Por (Nombre)", truncar(fuid.elaborado_por_nombre),
+         "Entregado Por (Nombre)", truncar(fuid.entregado_por_nombre),
+         "Recibido Por (Nombre)", truncar(fuid.recibido_por_nombre)],
+        ["Elaborado Por (Cargo)", truncar(fuid.elaborado_por_cargo),
+         "Entregado Por (Cargo)", truncar(fuid.entregado_por_cargo),
+         "Recibido Por (Cargo)", truncar(fuid.recibido_por_cargo)],
+        ["Elaborado Por (Lugar)", truncar(fuid.elaborado_por_lugar),
+         "Entregado Por (Lugar)", truncar(fuid.entregado_por_lugar),
+         "Recibido Por (Lugar)", truncar(fuid.recibido_por_lugar)],
+        ["Firma", "", "Firma", "", "Firma", ""],
+        ["Lugar", "", "Lugar", "", "Lugar", ""],
+        ["Elaborado Por (Fecha)", _fecha(fuid.elaborado_por_fecha),
+         "Entregado Por (Fecha)", _fecha(fuid.entregado_por_fecha),
+         "Recibido Por (Fecha)", _fecha(fuid.recibido_por_fecha)],
+    ]
+
+
+def _volcar_registros(fuid, anchos, chunk_size):
+    """
+    Recorre la consulta de registros en lotes, mide sus anchos y guarda las
+    filas en un archivo temporal (un ``pickle`` por lote). Devuelve el archivo,
+    ya rebobinado, y el número de registros.
+    """
+    temporal = tempfile.TemporaryFile()
+    lote, total = [], 0
+    for valores in registros_del_fuid(fuid).iterator(chunk_size=chunk_size):
+        fila = fila_registro(valores)
+        anchos.medir(fila)
+        lote.append(fila)
+        if len(lote) >= chunk_size:
+            pickle.dump(lote, temporal, pickle.HIGHEST_PROTOCOL)
+            total += len(lote)
+            lote = []
+    if lote:
+        pickle.dump(lote, temporal, pickle.HIGHEST_PROTOCOL)
+        total += len(lote)
+    temporal.seek(0)
+    return temporal, total
+
+
+def _lotes_volcados(temporal):
+    while True:
+        try:
+            yield pickle.load(temporal)
+        except EOFError:
+            return
+
+
+def escribir_fuid(fuid, destino, chunk_size=TAMANO_LOTE, progreso=None):
+    """
+    Escribe en ``destino`` (ruta o archivo binario) el libro del formato FUID.
+    ``fuid`` debería traer sus relaciones (entidad, unidad, oficina, objeto)
+    con ``select_related``. ``progreso(escritos, total)``, si se indica, se
+    llama tras escribir cada lote de registros. Devuelve el número de registros.
+    """
+    generales = _datos_generales(fuid)
+    roles = _roles(fuid)
+
+    anchos = AnchoColumnas(COLUMNAS_LOGO)
+    for fila in generales:
+        anchos.medir(fila)
+    anchos.medir(ENCABEZADOS_REGISTROS)
+    for fila in roles:
+        anchos.medir(fila)
+
+    temporal, total = _volcar_registros(fuid, anchos, chunk_size)
+    with temporal:
+        wb = openpyxl.Workbook(write_only=True)
+        ws = wb.create_sheet(title=f"FUID #{fuid.id}")
+        anchos.aplicar(ws)
+        con_borde = FilasConBorde(ws)
+        encabezado = bloque_encabezado()
+
+        # Logo en las primeras filas (A1:V6) y encabezados de registros combinados
+        encabezado.aplicar(ws)
+        for _ in range(FILAS_LOGO):
+            ws.append([])
+
+        for fila in generales:
+            ws.append(con_borde(fila))
+
+        # Espacio antes de la sección de registros
+        for _ in range(FILAS_SEPARACION):
+            ws.append([])
+
+        # Encabezados de los registros (fila FILA_ENCABEZADOS), cada uno en ALTO_ENCABEZADOS filas
+        ws.append(encabezado.fila_encabezados(ws))
+        for _ in range(ALTO_ENCABEZADOS - 1):
+            ws.append([])
+
+        if total:
+            escritos = 0
+            for lote in _lotes_volcados(temporal):
+                for fila in lote:
+                    ws.append(con_borde(fila))
+                escritos += len(lote)
+                if progreso is not None:
+                    progreso(escritos, total)
+        else:
+            ws.append(["Sin registros asociados"])
+
+        # Espacio antes de la sección de roles
+        ws.append([])
+        for fila in roles:
+            ws.append(con_borde(fila, siempre=True))
+
+        wb.save(destino)
+    return total
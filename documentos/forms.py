@@ -3,9 +3,14 @@ from .models import RegistroDeArchivo, SerieDocumental, SubserieDocumental
 from django.utils.timezone import now
 from django.forms import DateInput
 from django import forms
-from .models import FUID, RegistroDeArchivo
+from .models import FUID, OficinaProductora, RegistroDeArchivo
 from django.utils.timezone import now, timedelta
 from django.contrib.auth.models import User  # IMPORTAR User
+from django.core.validators import FileExtensionValidator
+from django.db.models import Q
+from .datatables import ColumnaFecha, parsear_rango_fechas
+from .permisos_serie import series_permitidas
+from . import oficinas
 # from .forms import FichaPacienteForm
 
 
@@ -43,11 +48,20 @@ class RegistroDeArchivoForm(forms.ModelForm):
             'fecha_final': forms.DateInput(attrs={'type': 'date', 'class': 'form-control'}),
         }
 
-    def __init__(self, *args, **kwargs):
+    def __init__(self, *args, usuario=None, **kwargs):
         super().__init__(*args, **kwargs)
         if not self.instance.pk:  # Si es un nuevo registro
             self.fields['fecha_archivo'].initial = now().date()
 
+        # Con permisos por serie sólo se ofrecen las series en que puede crear (o editar)
+        if usuario is not None:
+            series = series_permitidas(usuario, 'editar' if self.instance.pk else 'crear')
+            if series is not None:
+                # Quien edita por ser el creador (o por guardian) conserva la serie actual
+                if self.instance.pk and self.instance.codigo_serie_id:
+                    series = series | {self.instance.codigo_serie_id}
+                self.fields['codigo_serie'].queryset = SerieDocumental.objects.filter(pk__in=sorted(series))
+
         # Configuración dinámica del queryset de subseries
         if 'codigo_serie' in self.data:
             try:
@@ -82,6 +96,63 @@ class RegistroDeArchivoForm(forms.ModelForm):
 
         return cleaned_data
 
+def registros_seleccionables(usuario=None, fuid=None):
+    """
+    Registros que se pueden asociar a un FUID: los que aún no tienen FUID
+    (si se indica ``usuario``, sólo los creados por él) y, al editar, también
+    los que ya pertenecen al FUID.
+    """
+    if fuid is not None and fuid.pk:
+        return RegistroDeArchivo.objects.filter(Q(fuids__isnull=True) | Q(fuids=fuid))
+    registros = RegistroDeArchivo.objects.filter(fuids__isnull=True)
+    if usuario is not None:
+        registros = registros.filter(creado_por=usuario)
+    return registros
+
+
+class RegistrosPorIdField(forms.Field):
+    """
+    Selección de registros enviada como lista de ids (campos ocultos que llena el
+    selector paginado del formulario). No carga ni renderiza las opciones: al
+    validar comprueba por lotes que cada id exista en ``queryset`` y devuelve
+    la lista de ids, que se puede pasar tal cual a ``fuid.registros.set()``.
+    """
+    widget = forms.MultipleHiddenInput
+    default_error_messages = {
+        'invalido': "Identificadores de registro inválidos.",
+        'no_disponibles': "Estos registros no existen o ya no están disponibles: %(ids)s.",
+    }
+    # Por debajo del límite de parámetros de SQL Server (2100 por consulta)
+    tamano_lote = 1000
+
+    def __init__(self, *args, queryset=None, **kwargs):
+        super().__init__(*args, **kwargs)
+        self.queryset = queryset if queryset is not None else RegistroDeArchivo.objects.none()
+
+    def to_python(self, value):
+        if not value:
+            return []
+        if not isinstance(value, (list, tuple)):
+            value = [value]
+        try:
+            return list(dict.fromkeys(int(v) for v in value))  # sin repetidos, en orden
+        except (TypeError, ValueError):
+            raise forms.ValidationError(self.error_messages['invalido'], code='invalido')
+
+    def validate(self, value):
+        super().validate(value)
+        encontrados = set()
+        for i in range(0, len(value), self.tamano_lote):
+            lote = value[i:i + self.tamano_lote]
+            encontrados.update(self.queryset.filter(pk__in=lote).values_list('pk', flat=True))
+        faltan = [pk for pk in value if pk not in encontrados]
+        if faltan:
+            ids = ', '.join(str(pk) for pk in faltan[:20]) + ('...' if len(faltan) > 20 else '')
+            raise forms.ValidationError(
+                self.error_messages['no_disponibles'], code='no_disponibles', params={'ids': ids},
+            )
+
+
 class FUIDForm(forms.ModelForm):
     # Campos y configuración del formulario
     usuario = forms.ModelChoiceField(
@@ -101,9 +172,9 @@ class FUIDForm(forms.ModelForm):
         widget=forms.DateInput(attrs={'type': 'date', 'class': 'form-control'})
     )
 
-    registros = forms.ModelMultipleChoiceField(
-        queryset=RegistroDeArchivo.objects.none(),  
-        widget=forms.CheckboxSelectMultiple,
+    # Se elige con el selector paginado (registros_disponibles_api); la vista
+    # fija el queryset de registros permitidos
+    registros = RegistrosPorIdField(
         required=False,
         label="Registros Asociados"
     )
@@ -184,7 +255,6 @@ class FUIDForm(forms.ModelForm):
         model = FUID
         fields = [
             'entidad_productora', 'unidad_administrativa', 'oficina_productora', 'objeto',
-            'registros',
             'elaborado_por_nombre', 'elaborado_por_cargo', 'elaborado_por_lugar', 'elaborado_por_fecha',
             'entregado_por_nombre', 'entregado_por_cargo', 'entregado_por_lugar', 'entregado_por_fecha',
             'recibido_por_nombre', 'recibido_por_cargo', 'recibido_por_lugar', 'recibido_por_fecha'
@@ -201,14 +271,96 @@ class FUIDForm(forms.ModelForm):
         # No es necesario asignar self.instance aquí, ModelForm ya lo hace
         super().__init__(*args, **kwargs)
 
-        # Configura el queryset de registros
+        # 'registros' no está en Meta.fields: sólo se cargan los ids de los registros actuales
+        self.fields['registros'].queryset = registros_seleccionables(fuid=self.instance)
+
+        # Con perfil, los FUIDs y sus registros son de la oficina del usuario (oficinas.py)
+        oficina = oficinas.oficina_de(self.user) if self.user is not None else None
+        if oficina is not None:
+            self.fields['oficina_productora'].queryset = OficinaProductora.objects.filter(pk=oficina)
+            self.fields['oficina_productora'].initial = oficina
+            self.fields['registros'].queryset = oficinas.filtrar_registros(self.fields['registros'].queryset, self.user)
         if self.instance and self.instance.pk:
-            registros_actuales = self.instance.registros.all()
-            registros_disponibles = RegistroDeArchivo.objects.filter(fuids__isnull=True)
-            self.fields['registros'].queryset = registros_actuales | registros_disponibles
-        else:
-            self.fields['registros'].queryset = RegistroDeArchivo.objects.filter(fuids__isnull=True)
-  
+            self.initial.setdefault('registros', list(self.instance.registros.values_list('pk', flat=True)))
+
+
+class AsignacionRegistrosForm(forms.Form):
+    """
+    Filtro de la asignación masiva de registros a un FUID (ver asignacion.py).
+    Las fechas aceptan la misma sintaxis que los filtros de las tablas:
+    "2024", "2024-03", "2024-01..2024-06".
+    """
+    creado_por = forms.ModelChoiceField(
+        queryset=User.objects.all(), to_field_name='username', required=False, label="Creado por",
+    )
+    fecha_creacion = forms.CharField(required=False, label="Fecha de creación")
+    fecha_archivo = forms.CharField(required=False, label="Fecha de archivo")
+    # Por id: el código de la serie no es único
+    serie = forms.ModelChoiceField(queryset=SerieDocumental.objects.all(), required=False, label="Serie")
+    caja = forms.CharField(required=False, label="Caja")
+
+    def _clean_rango(self, nombre):
+        valor = self.cleaned_data[nombre].strip()
+        if valor and parsear_rango_fechas(valor) is None:
+            raise forms.ValidationError("Fecha o rango de fechas inválido.")
+        return valor
+
+    def clean_fecha_creacion(self):
+        return self._clean_rango('fecha_creacion')
+
+    def clean_fecha_archivo(self):
+        return self._clean_rango('fecha_archivo')
+
+    def clean(self):
+        cleaned_data = super().clean()
+        # Sin ningún filtro se asignarían todos los registros libres
+        if not self.errors and not any(cleaned_data.values()):
+            raise forms.ValidationError("Indica al menos un filtro.")
+        return cleaned_data
+
+    def filtrar(self, registros):
+        datos = self.cleaned_data
+        if datos['creado_por']:
+            registros = registros.filter(creado_por=datos['creado_por'])
+        if datos['fecha_creacion']:
+            registros = ColumnaFecha('fecha_creacion', con_hora=True).filtrar(registros, datos['fecha_creacion'])
+        if datos['fecha_archivo']:
+            registros = ColumnaFecha('fecha_archivo').filtrar(registros, datos['fecha_archivo'])
+        if datos['serie']:
+            registros = registros.filter(codigo_serie=datos['serie'])
+        if datos['caja']:
+            registros = registros.filter(caja=datos['caja'])
+        return registros
+
+
+class ImportacionRegistrosForm(forms.Form):
+    """Carga masiva de registros desde un archivo (ver importacion.py)."""
+    archivo = forms.FileField(
+        label="Archivo (.csv o .xlsx)",
+        validators=[FileExtensionValidator(['csv', 'xlsx'])],
+    )
+    # Número de FUID en lugar de un desplegable: puede haber miles
+    fuid = forms.ModelChoiceField(
+        queryset=FUID.objects.all(), required=False, widget=forms.NumberInput, label="Asociar al FUID N°",
+        error_messages={'invalid_choice': "El FUID no existe o no es de tu oficina."},
+    )
+    omitir_errores = forms.BooleanField(
+        required=False, label="Importar las filas válidas aunque otras tengan errores",
+    )
+
+    def __init__(self, *args, usuario=None, **kwargs):
+        super().__init__(*args, **kwargs)
+        self.usuario = usuario
+        if usuario is not None:
+            self.fields['fuid'].queryset = oficinas.filtrar_fuids(FUID.objects.all(), usuario)
+
+    def clean_fuid(self):
+        fuid = self.cleaned_data['fuid']
+        # Como al editar el FUID: ser de la oficina no basta para añadirle registros
+        if fuid and self.usuario is not None and not self.usuario.has_perm('documentos.edit_own_fuid', fuid):
+            raise forms.ValidationError("No tienes permiso para editar este FUID.")
+        return fuid
+
 
 from django import forms
 from .models import FichaPaciente
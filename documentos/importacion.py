@@ -0,0 +1,362 @@
+"""
+Importación masiva de registros desde CSV o XLSX.
+
+Crear los registros uno a uno (``crear_registro``) cuesta por fila un INSERT,
+las consultas de serie y subserie que hace ``RegistroDeArchivo.save`` para el
+código y la fila del índice de búsqueda. Aquí:
+
+- El archivo se lee en streaming (``csv.reader`` o openpyxl en modo
+  ``read_only``); nunca está completo en memoria.
+- Las series y subseries se cargan una vez (sólo las series en que el usuario
+  puede crear registros, ver ``permisos_serie``) y cada fila se valida contra
+  ellas en memoria; el ``codigo`` se calcula con ``calcular_codigo``.
+- Las filas válidas se insertan por lotes con ``bulk_create``, junto con sus
+  filas del índice de búsqueda y, si se indica, su asociación a un FUID. Si el
+  motor no devuelve los ids insertados, se vuelven a leer (``insertar_sin_ids``).
+- Todo ocurre en una transacción. Por defecto, si alguna fila tiene errores no
+  se importa nada (y desde el primer error sólo se valida); con
+  ``omitir_errores`` se importan las válidas. El resultado lista los errores
+  por número de fila.
+
+Como ``bulk_create`` no emite señales, las generaciones de ``conteos`` y la
+versión del FUID (``cache_fuid``) se actualizan aquí. Los permisos de ver y
+editar los tiene el creador por serlo (``backends.PropietarioBackend``), así
+que no hay filas de guardian que crear.
+
+Los encabezados aceptan el nombre del campo o el título de las exportaciones
+de registros, de modo que un archivo exportado se puede volver a importar; las
+columnas desconocidas (ID, Código, Creado Por...) se ignoran.
+"""
+import csv
+import io
+import unicodedata
+from datetime import date, datetime
+
+import openpyxl
+from django.db import connection, transaction
+from django.db.models import Max
+
+from . import busqueda, cache_fuid, conteos
+from .datatables import parsear_booleano, parsear_fecha_parcial
+from .exportacion import INICIO_FORMULA
+from .models import FUID, RegistroDeArchivo, SerieDocumental, SubserieDocumental
+from .permisos_serie import series_permitidas
+
+TAMANO_LOTE = 1000
+
+# Errores que se guardan en el resultado; los demás sólo se cuentan
+MAXIMO_ERRORES = 1000
+
+# Campos importables y los títulos con que también se aceptan como encabezado
+COLUMNAS = {
+    'numero_orden': ("N° Orden", "Número de Orden"),
+    'codigo_serie': ("Código Serie", "Serie"),
+    'codigo_subserie': ("Código Subserie", "Subserie"),
+    'unidad_documental': ("Unidad Documental",),
+    'fecha_archivo': ("Fecha Archivo",),
+    'fecha_inicial': ("Fecha Inicial",),
+    'fecha_final': ("Fecha Final",),
+    'soporte_fisico': ("Soporte Físico",),
+    'soporte_electronico': ("Soporte Electrónico",),
+    'caja': ("Caja",),
+    'carpeta': ("Carpeta",),
+    'tomo_legajo_libro': ("Tomo/Legajo/Libro",),
+    'numero_folios': ("N° Folios",),
+    'tipo': ("Tipo",),
+    'cantidad': ("Cantidad",),
+    'ubicacion': ("Ubicación",),
+    'cantidad_documentos_electronicos': ("Cantidad Electrónicos",),
+    'tamano_documentos_electronicos': ("Tamaño Electrónico",),
+    'notas': ("Notas",),
+}
+
+
+class ArchivoInvalido(Exception):
+    """El archivo no se puede importar (formato o encabezados)."""
+
+
+class ErrorFila(Exception):
+    pass
+
+
+def _normalizar(texto):
+    """Encabezado sin tildes, mayúsculas ni espacios sobrantes, para compararlo."""
+    texto = unicodedata.normalize('NFKD', str(texto or '')).encode('ascii', 'ignore').decode()
+    return ' '.join(texto.lower().replace('_', ' ').split())
+
+
+ENCABEZADOS = {
+    _normalizar(nombre): campo
+    for campo, titulos in COLUMNAS.items()
+    for nombre in (campo, *titulos)
+}
+
+
+# Lectura en streaming: cada función devuelve un iterador de filas (la primera, los encabezados)
+
+def filas_csv(archivo, codificacion='utf-8-sig'):
+    """Filas de un CSV (archivo binario); el separador (coma, punto y coma o tabulador) se detecta."""
+    texto = io.TextIOWrapper(archivo, encoding=codificacion, newline='')
+    try:
+        muestra = texto.read(64 * 1024)
+        texto.seek(0)
+        try:
+            dialecto = csv.Sniffer().sniff(muestra, delimiters=',;\t')
+        except csv.Error:
+            dialecto = csv.excel
+        yield from csv.reader(texto, dialecto)
+    except UnicodeDecodeError:
+        raise ArchivoInvalido(f"El archivo no está en la codificación {codificacion}.")
+    finally:
+        texto.detach()
+
+
+def filas_xlsx(archivo):
+    """Filas de la primera hoja de un libro XLSX, leído en modo ``read_only``."""
+    try:
+        wb = openpyxl.load_workbook(archivo, read_only=True, data_only=True)
+    except Exception:
+        raise ArchivoInvalido("El archivo no es un libro de Excel (.xlsx) válido.")
+    try:
+        yield from wb.active.iter_rows(values_only=True)
+    finally:
+        wb.close()
+
+
+def filas_archivo(archivo, nombre, codificacion='utf-8-sig'):
+    """Filas de ``archivo`` según la extensión de ``nombre`` (.csv o .xlsx)."""
+    nombre = nombre.lower()
+    if nombre.endswith('.csv'):
+        return filas_csv(archivo, codificacion)
+    if nombre.endswith('.xlsx'):
+        return filas_xlsx(archivo)
+    raise ArchivoInvalido("Formato no soportado: el archivo debe ser .csv o .xlsx.")
+
+
+class Catalogos:
+    """Series (las permitidas para crear) y subseries, cargadas una vez por importación."""
+
+    def __init__(self, usuario):
+        series = SerieDocumental.objects.all()
+        permitidas = series_permitidas(usuario, 'crear')
+        if permitidas is not None:
+            series = series.filter(pk__in=sorted(permitidas))
+        self.series = {}
+        for serie in series:
+            # Se aceptan el código y el nombre (las exportaciones muestran el nombre)
+            self.series.setdefault(_normalizar(serie.codigo), serie)
+            self.series.setdefault(_normalizar(serie.nombre), serie)
+        self.subseries = {}
+        for subserie in SubserieDocumental.objects.filter(serie__in=list(self.series.values())):
+            self.subseries.setdefault((subserie.serie_id, _normalizar(subserie.codigo)), subserie)
+            self.subseries.setdefault((subserie.serie_id, _normalizar(subserie.nombre)), subserie)
+
+    def serie(self, valor):
+        serie = self.series.get(_normalizar(valor))
+        if serie is None:
+            raise ErrorFila(f"La serie «{valor}» no existe o no puedes crear registros en ella.")
+        return serie
+
+    def subserie(self, serie, valor):
+        subserie = self.subseries.get((serie.pk, _normalizar(valor)))
+        if subserie is None:
+            raise ErrorFila(f"La subserie «{valor}» no existe en la serie «{serie.nombre}».")
+        return subserie
+
+
+def _texto(valor):
+    if valor is None:
+        return ''
+    if isinstance(valor, float) and valor.is_integer():
+        valor = int(valor)  # Excel guarda los números enteros como float
+    texto = str(valor).strip()
+    if texto[:1] == "'" and texto[1:].startswith(INICIO_FORMULA):
+        return texto[1:]  # Apóstrofo que la exportación antepone a lo que parece una fórmula
+    return texto
+
+
+def _convertir(campo, valor):
+    """Valor de la celda convertido al tipo de ``campo`` (None si está vacía)."""
+    titulo = COLUMNAS[campo.name][0]
+    if isinstance(valor, datetime):
+        valor = valor.date()
+    if isinstance(valor, date) and campo.get_internal_type() == 'DateField':
+        return valor
+    texto = _texto(valor)
+    tipo = campo.get_internal_type()
+    if tipo == 'BooleanField':
+        if not texto:
+            return False
+        booleano = parsear_booleano(texto)
+        if booleano is None:
+            raise ErrorFila(f"{titulo}: «{texto}» no es Sí/No.")
+        return booleano
+    if not texto:
+        return None
+    if tipo == 'DateField':
+        # Sólo fechas completas: AAAA-MM-DD o DD/MM/AAAA
+        rango = parsear_fecha_parcial(texto)
+        if rango is None or (rango[1] - rango[0]).days != 1:
+            raise ErrorFila(f"{titulo}: «{texto}» no es una fecha (AAAA-MM-DD o DD/MM/AAAA).")
+        return rango[0]
+    if tipo == 'IntegerField':
+        try:
+            return int(texto)
+        except ValueError:
+            raise ErrorFila(f"{titulo}: «{texto}» no es un número entero.")
+    if campo.max_length and len(texto) > campo.max_length:
+        raise ErrorFila(f"{titulo}: supera los {campo.max_length} caracteres.")
+    return texto
+
+
+class ResultadoImportacion:
+    """Resumen de una importación: filas leídas, registros creados y errores por fila."""
+
+    def __init__(self):
+        self.filas = 0
+        self.creados = 0
+        self.errores = []  # (número de fila, mensaje), como máximo MAXIMO_ERRORES
+        self.total_errores = 0
+        self.revertida = False
+
+    def error(self, fila, mensaje):
+        self.total_errores += 1
+        if len(self.errores) < MAXIMO_ERRORES:
+            self.errores.append((fila, mensaje))
+
+
+class Importacion:
+    """
+    Convierte las filas de un archivo en registros de ``usuario`` y los inserta
+    por lotes (ver el docstring del módulo). Se usa con ``importar_registros``.
+    """
+
+    def __init__(self, usuario, fuid=None, omitir_errores=False, tamano_lote=TAMANO_LOTE):
+        self.usuario = usuario
+        self.fuid = fuid
+        self.omitir_errores = omitir_errores
+        self.tamano_lote = tamano_lote
+        self.catalogos = Catalogos(usuario)
+        self.campos = {campo: RegistroDeArchivo._meta.get_field(campo) for campo in COLUMNAS}
+        # Obligatorios: los que el modelo no deja en blanco ni tienen valor por defecto
+        self.obligatorios = {
+            nombre for nombre, campo in self.campos.items() if not campo.blank and not campo.has_default()
+        }
+        self.resultado = ResultadoImportacion()
+
+    def columnas(self, encabezados):
+        """Índice de cada columna del archivo en el campo que le corresponde."""
+        columnas = {}
+        for indice, encabezado in enumerate(encabezados or ()):
+            campo = ENCABEZADOS.get(_normalizar(encabezado))
+            if campo is not None and campo not in columnas.values():
+                columnas[indice] = campo
+        faltantes = [COLUMNAS[nombre][0] for nombre in self.campos if nombre in self.obligatorios and nombre not in columnas.values()]
+        if faltantes:
+            raise ArchivoInvalido(f"Faltan las columnas obligatorias: {', '.join(faltantes)}.")
+        return columnas
+
+    def registro(self, columnas, valores):
+        datos = {campo: valores[indice] if indice < len(valores) else None for indice, campo in columnas.items()}
+        serie_texto = _texto(datos.pop('codigo_serie', None))
+        subserie_texto = _texto(datos.pop('codigo_subserie', None))
+        if not serie_texto:
+            raise ErrorFila("La serie es obligatoria.")
+        serie = self.catalogos.serie(serie_texto)
+        subserie = self.catalogos.subserie(serie, subserie_texto) if subserie_texto else None
+
+        errores = []
+        campos = {}
+        for nombre, valor in datos.items():
+            try:
+                campos[nombre] = _convertir(self.campos[nombre], valor)
+            except ErrorFila as e:
+                errores.append(str(e))
+                continue
+            if campos[nombre] is None and nombre in self.obligatorios:
+                errores.append(f"{COLUMNAS[nombre][0]}: es obligatorio.")
+        if errores:
+            raise ErrorFila(' '.join(errores))
+
+        # Serie y subserie como objetos: el código y el índice de búsqueda no consultan la base
+        return RegistroDeArchivo(
+            codigo_serie=serie, codigo_subserie=subserie, codigo=RegistroDeArchivo.calcular_codigo(serie, subserie),
+            creado_por=self.usuario, **campos,
+        )
+
+    def guardar(self, lote):
+        if connection.features.can_return_rows_from_bulk_insert:
+            creados = RegistroDeArchivo.objects.bulk_create(lote)
+        else:
+            creados = self.insertar_sin_ids(lote)
+        busqueda.indexar_registros(creados)
+        if self.fuid is not None:
+            intermedia = FUID.registros.through
+            intermedia.objects.bulk_create([
+                intermedia(fuid_id=self.fuid.pk, registrodearchivo_id=registro.pk) for registro in creados
+            ])
+        self.resultado.creados += len(lote)
+
+    def insertar_sin_ids(self, lote):
+        """
+        Inserta el lote cuando el motor no devuelve los ids del INSERT (mssql-django
+        sin la opción ``return_rows_bulk_insert``) y devuelve los registros
+        insertados leídos de nuevo: los del usuario, con esos números de orden y
+        posteriores al último que tenía.
+        """
+        propios = RegistroDeArchivo.objects.filter(creado_por=self.usuario)
+        ultimo = propios.aggregate(ultimo=Max('pk'))['ultimo'] or 0
+        RegistroDeArchivo.objects.bulk_create(lote)
+        numeros = {registro.numero_orden for registro in lote}
+        return list(propios.filter(pk__gt=ultimo, numero_orden__in=numeros).select_related('codigo_serie', 'codigo_subserie'))
+
+    @property
+    def solo_validar(self):
+        # Sin omitir errores, desde el primero ya no se insertará nada
+        return self.resultado.total_errores > 0 and not self.omitir_errores
+
+    def ejecutar(self, filas):
+        filas = iter(filas)
+        columnas = self.columnas(next(filas, None))
+        resultado = self.resultado
+        with transaction.atomic():
+            lote = []
+            for numero, valores in enumerate(filas, start=2):
+                if not any(_texto(valor) for valor in valores):
+                    continue  # Filas en blanco (frecuentes al final de las hojas)
+                resultado.filas += 1
+                try:
+                    registro = self.registro(columnas, valores)
+                except ErrorFila as e:
+                    resultado.error(numero, str(e))
+                    continue
+                if self.solo_validar:
+                    continue
+                lote.append(registro)
+                if len(lote) >= self.tamano_lote:
+                    self.guardar(lote)
+                    lote = []
+            if self.solo_validar:
+                transaction.set_rollback(True)
+                resultado.creados = 0
+                resultado.revertida = True
+            elif lote:
+                self.guardar(lote)
+
+        if resultado.creados:
+            # Mismo efecto que las señales de post_save y m2m_changed (signals.py)
+            conteos.invalidar(RegistroDeArchivo)
+            if self.fuid is not None:
+                conteos.invalidar(FUID)
+                cache_fuid.tocar(FUID.objects.filter(pk=self.fuid.pk))
+        return resultado
+
+
+def importar_registros(filas, usuario, fuid=None, omitir_errores=False, tamano_lote=TAMANO_LOTE):
+    """
+    Importa como registros de ``usuario`` las filas de un archivo (ver
+    ``filas_archivo``), opcionalmente asociados a ``fuid``. Devuelve un
+    ``ResultadoImportacion``; lanza ``ArchivoInvalido`` si el archivo no se
+    puede leer o le faltan columnas obligatorias.
+    """
+    return Importacion(usuario, fuid, omitir_errores, tamano_lote).ejecutar(filas)
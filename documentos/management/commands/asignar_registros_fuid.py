@@ -0,0 +1,40 @@
+from django.core.management.base import BaseCommand, CommandError
+
+from documentos import reservas
+from documentos.asignacion import asignar_registros
+from documentos.forms import AsignacionRegistrosForm
+from documentos.models import FUID, RegistroDeArchivo
+
+
+class Command(BaseCommand):
+    help = (
+        "Asocia a un FUID, con una sola sentencia INSERT ... SELECT, todos los registros "
+        "sin FUID que cumplan el filtro indicado."
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument('fuid', type=int, help="Id del FUID destino.")
+        parser.add_argument('--creado-por', help="Nombre de usuario del creador de los registros.")
+        parser.add_argument('--fecha-creacion', help='Fecha o rango de creación ("2024", "2024-01..2024-06").')
+        parser.add_argument('--fecha-archivo', help='Fecha o rango de archivo ("2024", "2024-01..2024-06").')
+        parser.add_argument('--serie', type=int, help="Id de la serie documental.")
+        parser.add_argument('--caja', help="Número de caja.")
+
+    def handle(self, *args, **options):
+        try:
+            fuid = FUID.objects.get(pk=options['fuid'])
+        except FUID.DoesNotExist:
+            raise CommandError(f"No existe el FUID {options['fuid']}.")
+
+        form = AsignacionRegistrosForm({
+            nombre: options[nombre] or ''
+            for nombre in ('creado_por', 'fecha_creacion', 'fecha_archivo', 'serie', 'caja')
+        })
+        if not form.is_valid():
+            errores = '; '.join(f"{campo}: {' '.join(mensajes)}" for campo, mensajes in form.errors.items())
+            raise CommandError(errores)
+
+        # Los registros reservados por alguien que está armando otro FUID se respetan
+        registros = reservas.sin_reservas_ajenas(RegistroDeArchivo.objects.all())
+        asignados = asignar_registros(fuid, form.filtrar(registros))
+        self.stdout.write(self.style.SUCCESS(f"{asignados} registros asignados al FUID {fuid.pk}."))
@@ -0,0 +1,59 @@
+from django.contrib.auth.models import User
+from django.core.management.base import BaseCommand, CommandError
+
+from documentos import importacion
+from documentos.models import FUID
+
+
+class Command(BaseCommand):
+    help = (
+        "Importa registros desde un CSV o XLSX con inserciones por lotes (ver documentos/importacion.py). "
+        "Si alguna fila tiene errores no se importa nada, salvo con --omitir-errores."
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument('archivo', help="Ruta del archivo .csv o .xlsx.")
+        parser.add_argument('--usuario', required=True, help="Nombre de usuario que figurará como creador.")
+        parser.add_argument('--fuid', type=int, help="Id del FUID al que se asocian los registros importados.")
+        parser.add_argument('--omitir-errores', action='store_true', help="Importa las filas válidas aunque otras fallen.")
+        parser.add_argument('--tamano-lote', type=int, default=importacion.TAMANO_LOTE, help="Registros por INSERT.")
+        parser.add_argument('--codificacion', default='utf-8-sig', help="Codificación del CSV (p. ej. cp1252).")
+
+    def handle(self, *args, **options):
+        try:
+            usuario = User.objects.get(username=options['usuario'])
+        except User.DoesNotExist:
+            raise CommandError(f"No existe el usuario {options['usuario']}.")
+        fuid = None
+        if options['fuid'] is not None:
+            try:
+                fuid = FUID.objects.get(pk=options['fuid'])
+            except FUID.DoesNotExist:
+                raise CommandError(f"No existe el FUID {options['fuid']}.")
+            if not usuario.has_perm('documentos.edit_own_fuid', fuid):
+                raise CommandError(f"El usuario {usuario.username} no tiene permiso para editar el FUID {fuid.pk}.")
+
+        try:
+            with open(options['archivo'], 'rb') as archivo:
+                resultado = importacion.importar_registros(
+                    importacion.filas_archivo(archivo, options['archivo'], options['codificacion']), usuario,
+                    fuid=fuid, omitir_errores=options['omitir_errores'], tamano_lote=options['tamano_lote'],
+                )
+        except OSError as e:
+            raise CommandError(f"No se pudo leer el archivo: {e}")
+        except importacion.ArchivoInvalido as e:
+            raise CommandError(str(e))
+
+        for fila, mensaje in resultado.errores:
+            self.stderr.write(f"Fila {fila}: {mensaje}")
+        if resultado.total_errores > len(resultado.errores):
+            self.stderr.write(f"... y {resultado.total_errores - len(resultado.errores)} errores más.")
+        if resultado.revertida:
+            raise CommandError(
+                f"{resultado.total_errores} filas con errores: no se importó nada (use --omitir-errores para "
+                "importar las válidas)."
+            )
+        self.stdout.write(self.style.SUCCESS(
+            f"{resultado.creados} registros importados de {resultado.filas} filas"
+            + (f" y asociados al FUID {fuid.pk}." if fuid else ".")
+        ))
@@ -0,0 +1,88 @@
+"""
+Benchmark de la comprobación de permisos por objeto sobre registros.
+
+Compara, para los mismos registros de un usuario:
+
+1. guardian por objeto: como antes, una fila de guardian por registro y
+   permiso y ``get_perms`` con un checker nuevo en cada comprobación.
+2. has_perm (backends): ``usuario.has_perm`` sin filas de guardian; lo
+   resuelve PropietarioBackend a partir de ``creado_por``.
+3. permisos_de (por petición): ``PermisosObjeto.tiene`` con precarga, como
+   en las vistas.
+
+Uso:
+    python manage.py medir_permisos --objetos 500 --repeticiones 5
+
+Los datos de prueba se crean dentro de una transacción que se revierte al final.
+"""
+import time
+
+from django.core.management.base import BaseCommand
+from django.db import connection
+from django.test import RequestFactory
+from django.test.utils import CaptureQueriesContext
+from guardian.models import UserObjectPermission
+from guardian.shortcuts import assign_perm, get_perms
+
+from documentos.management.mediciones import sembrar_registros, transaccion_revertida
+from documentos.models import RegistroDeArchivo
+from documentos.permisos import permisos_de
+
+
+class Command(BaseCommand):
+    help = "Mide la latencia de comprobar permisos por objeto con guardian y con el backend de propietario."
+
+    def add_arguments(self, parser):
+        parser.add_argument('--objetos', type=int, default=500, help="Registros comprobados.")
+        parser.add_argument('--repeticiones', type=int, default=5, help="Veces que se comprueba la lista.")
+
+    def handle(self, *args, **options):
+        with transaccion_revertida():
+            self._medir(options['objetos'], options['repeticiones'])
+
+    def _tiempo(self, nombre, comprobar, registros, repeticiones):
+        with CaptureQueriesContext(connection) as consultas:
+            comprobar()
+        inicio = time.perf_counter()
+        for _ in range(repeticiones):
+            comprobar()
+        segundos = (time.perf_counter() - inicio) / repeticiones
+        self.stdout.write(
+            f"{nombre:30} {segundos / len(registros) * 1e6:12.1f} {len(consultas) / len(registros):14.2f}"
+        )
+
+    def _medir(self, cantidad, repeticiones):
+        usuario = sembrar_registros(cantidad, 'benchmark_permisos')
+        registros = list(RegistroDeArchivo.objects.filter(creado_por=usuario))
+        self.stdout.write(f"{len(registros)} registros, {repeticiones} repeticiones\n")
+        self.stdout.write(f"{'ruta':30} {'µs/comprobación':>12} {'consultas/objeto':>14}")
+
+        # Antes: filas de guardian por objeto (como hacían las vistas al crear)
+        for registro in registros:
+            assign_perm('documentos.view_own_registro', usuario, registro)
+            assign_perm('documentos.edit_own_registro', usuario, registro)
+
+        def antes():
+            return [('edit_own_registro' in get_perms(usuario, registro)) for registro in registros]
+
+        self._tiempo("guardian por objeto", antes, registros, repeticiones)
+        filas = UserObjectPermission.objects.filter(user=usuario)
+        self.stdout.write(f"  filas de guardian: {filas.count()}")
+
+        # Después: sin filas, el permiso sale de creado_por
+        filas.delete()
+
+        def backends():
+            return [usuario.has_perm('documentos.edit_own_registro', registro) for registro in registros]
+
+        def por_peticion():
+            request = RequestFactory().get('/')
+            request.user = usuario
+            permisos = permisos_de(request)
+            permisos.precargar(registros)
+            return [permisos.tiene('edit_own_registro', registro) for registro in registros]
+
+        self._tiempo("has_perm (backends)", backends, registros, repeticiones)
+        self._tiempo("permisos_de (por petición)", por_peticion, registros, repeticiones)
+        if not all(backends()) or not all(por_peticion()):
+            self.stdout.write(self.style.ERROR("El creador no obtuvo el permiso sin filas de guardian."))
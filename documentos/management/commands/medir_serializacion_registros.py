@@ -0,0 +1,110 @@
+"""
+Benchmark del costo por fila de las APIs de registros.
+
+Compara tres formas de construir la misma página de registros_api_con_id:
+
+1. instancias: como lo hacían las vistas antes de TablaDataTables, una
+   instancia por fila y acceso perezoso a serie/subserie/creador (N+1),
+   codificado con DjangoJSONEncoder.
+2. select_related: instancias con select_related/only, DjangoJSONEncoder.
+3. values_list: ruta rápida actual (TablaDataTables.proyectar + respuesta_json).
+
+Uso:
+    python manage.py medir_serializacion_registros --filas 500 --repeticiones 20
+
+Si la base tiene menos filas que ``--filas`` se pueden generar registros de
+prueba con ``--sembrar``; se crean dentro de una transacción que se revierte al final.
+"""
+import json
+import time
+
+from django.core.management.base import BaseCommand
+from django.core.serializers.json import DjangoJSONEncoder
+from django.db import connection, reset_queries
+from django.test.utils import CaptureQueriesContext
+
+from documentos.datatables import respuesta_json
+from documentos.management.mediciones import sembrar_registros, transaccion_revertida
+from documentos.models import RegistroDeArchivo
+from documentos.views import TABLA_REGISTROS_CON_ID
+
+
+def fila_instancia(registro):
+    """Fila como la construían las vistas antes de TablaDataTables (referencia de los tests)."""
+    return {
+        "id": registro.id,
+        "numero_orden": registro.numero_orden,
+        "codigo": registro.codigo,
+        "codigo_serie": registro.codigo_serie.nombre if registro.codigo_serie else "",
+        "codigo_subserie": registro.codigo_subserie.nombre if registro.codigo_subserie else "",
+        "unidad_documental": registro.unidad_documental,
+        "fecha_archivo": registro.fecha_archivo,
+        "fecha_inicial": registro.fecha_inicial,
+        "fecha_final": registro.fecha_final,
+        "soporte_fisico": registro.soporte_fisico,
+        "soporte_electronico": registro.soporte_electronico,
+        "caja": registro.caja,
+        "carpeta": registro.carpeta,
+        "tomo_legajo_libro": registro.tomo_legajo_libro,
+        "numero_folios": registro.numero_folios,
+        "tipo": registro.tipo,
+        "cantidad": registro.cantidad,
+        "ubicacion": registro.ubicacion,
+        "cantidad_documentos_electronicos": registro.cantidad_documentos_electronicos,
+        "tamano_documentos_electronicos": registro.tamano_documentos_electronicos,
+        "notas": registro.notas,
+        "creado_por": registro.creado_por.username if registro.creado_por else "",
+        "fecha_creacion": registro.fecha_creacion,
+    }
+
+
+class Command(BaseCommand):
+    help = "Mide el costo por fila (tiempo y consultas) de serializar una página de registros."
+
+    def add_arguments(self, parser):
+        parser.add_argument('--filas', type=int, default=500, help="Filas por página.")
+        parser.add_argument('--repeticiones', type=int, default=20, help="Veces que se construye cada página.")
+        parser.add_argument('--sembrar', action='store_true',
+                            help="Crea registros de prueba (en una transacción revertida) si faltan filas.")
+
+    def handle(self, *args, **options):
+        with transaccion_revertida():
+            faltan = options['filas'] - RegistroDeArchivo.objects.count()
+            if options['sembrar'] and faltan > 0:
+                sembrar_registros(faltan, 'benchmark_serializacion', con_subserie=True)
+            self._medir(options['filas'], options['repeticiones'])
+
+    def _medir(self, filas, repeticiones):
+        tabla = TABLA_REGISTROS_CON_ID
+        base = RegistroDeArchivo.objects.order_by('fecha_creacion', 'id')
+        relacionados = ['codigo_serie', 'codigo_subserie', 'creado_por']
+        campos = [c.campo for c in tabla.columnas]
+
+        rutas = [
+            ("instancias (N+1)", lambda: json.dumps(
+                [fila_instancia(r) for r in base[:filas]], cls=DjangoJSONEncoder)),
+            ("select_related + only", lambda: json.dumps(
+                [fila_instancia(r) for r in base.select_related(*relacionados).only(*campos)[:filas]],
+                cls=DjangoJSONEncoder)),
+            ("values_list + respuesta_json", lambda: respuesta_json(
+                [tabla.serializar(f) for f in tabla.proyectar(RegistroDeArchivo.objects.all())[:filas]]).content),
+        ]
+
+        medidas = min(filas, RegistroDeArchivo.objects.count())
+        if not medidas:
+            self.stdout.write(self.style.WARNING("No hay registros; use --sembrar."))
+            return
+        self.stdout.write(f"Página de {medidas} filas, {repeticiones} repeticiones\n")
+        self.stdout.write(f"{'ruta':32} {'µs/fila':>10} {'ms/página':>10} {'consultas':>10}")
+        for nombre, construir in rutas:
+            construir()  # calentamiento
+            reset_queries()  # Con el registro de consultas lleno, CaptureQueriesContext cuenta mal
+            with CaptureQueriesContext(connection) as consultas:
+                construir()
+            inicio = time.perf_counter()
+            for _ in range(repeticiones):
+                construir()
+            segundos = (time.perf_counter() - inicio) / repeticiones
+            self.stdout.write(
+                f"{nombre:32} {segundos / medidas * 1e6:10.1f} {segundos * 1e3:10.2f} {len(consultas):10d}"
+            )
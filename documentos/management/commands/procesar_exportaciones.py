@@ -0,0 +1,118 @@
+"""
+Worker de las exportaciones en segundo plano (ver documentos/trabajos.py).
+
+Uso:
+    python manage.py procesar_exportaciones                 # un proceso por núcleo, sin terminar
+    python manage.py procesar_exportaciones --procesos 4
+    python manage.py procesar_exportaciones --una-vez       # procesa lo pendiente y termina
+    python manage.py procesar_exportaciones --procesos 0    # en este mismo proceso (depuración)
+
+Debe haber un único worker por servidor: al arrancar devuelve a la cola los
+trabajos que quedaron en proceso.
+"""
+import time
+from concurrent.futures import FIRST_COMPLETED, ProcessPoolExecutor, wait
+from concurrent.futures.process import BrokenProcessPool
+
+from django.core.management.base import BaseCommand
+from django.db import connections
+
+from documentos import trabajos
+from documentos.procesos import ejecutar_trabajo, inicializar
+
+# Segundos entre limpiezas de exportaciones vencidas
+INTERVALO_LIMPIEZA = 60
+
+
+class Command(BaseCommand):
+    help = "Genera las exportaciones pendientes (TrabajoExportacion) en un pool de procesos."
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            '--procesos', type=int, default=None,
+            help="Procesos del pool (por defecto EXPORTACIONES_PROCESOS o uno por núcleo); 0 ejecuta aquí mismo.",
+        )
+        parser.add_argument('--intervalo', type=float, default=2.0, help="Segundos entre consultas a la cola vacía.")
+        parser.add_argument('--una-vez', action='store_true', help="Procesa los trabajos pendientes y termina.")
+
+    def handle(self, *args, **options):
+        procesos = options['procesos']
+        if procesos is None:
+            procesos = trabajos.procesos_por_defecto()
+        reanudados = trabajos.reanudar_interrumpidos()
+        if reanudados:
+            self.stdout.write(f"{reanudados} trabajos interrumpidos devueltos a la cola.")
+        if procesos == 0:
+            self._en_este_proceso(options)
+        else:
+            self._con_pool(procesos, options)
+
+    def _limpiar(self):
+        borrados = trabajos.limpiar_vencidos()
+        if borrados:
+            self.stdout.write(f"{borrados} exportaciones vencidas eliminadas.")
+
+    def _en_este_proceso(self, options):
+        proxima_limpieza = 0
+        while True:
+            if time.monotonic() >= proxima_limpieza:
+                self._limpiar()
+                proxima_limpieza = time.monotonic() + INTERVALO_LIMPIEZA
+            tomados = trabajos.tomar_pendientes(1)
+            for pk in tomados:
+                self._informar(pk, trabajos.ejecutar(pk))
+            if not tomados:
+                if options['una_vez']:
+                    return
+                time.sleep(options['intervalo'])
+
+    def _nuevo_pool(self, procesos):
+        return ProcessPoolExecutor(max_workers=procesos, initializer=inicializar)
+
+    def _con_pool(self, procesos, options):
+        pool = self._nuevo_pool(procesos)
+        en_curso = {}
+        proxima_limpieza = 0
+        try:
+            while True:
+                if time.monotonic() >= proxima_limpieza:
+                    self._limpiar()
+                    proxima_limpieza = time.monotonic() + INTERVALO_LIMPIEZA
+
+                tomados = trabajos.tomar_pendientes(procesos - len(en_curso))
+                if tomados:
+                    # Con fork, los procesos nuevos del pool no deben heredar conexiones abiertas
+                    connections.close_all()
+                    for pk in tomados:
+                        en_curso[pool.submit(ejecutar_trabajo, pk)] = pk
+
+                if not en_curso:
+                    if options['una_vez']:
+                        return
+                    time.sleep(options['intervalo'])
+                    continue
+
+                terminados, _ = wait(en_curso, timeout=options['intervalo'], return_when=FIRST_COMPLETED)
+                roto = False
+                for futuro in terminados:
+                    pk = en_curso.pop(futuro)
+                    try:
+                        self._informar(pk, futuro.result())
+                    except BrokenProcessPool:
+                        roto = True
+                        trabajos.marcar_error(pk, "El proceso que generaba la exportación terminó inesperadamente.")
+                    except Exception as e:
+                        trabajos.marcar_error(pk, str(e) or e.__class__.__name__)
+                if roto:
+                    # Un proceso murió: el pool ya no acepta trabajos y hay que crear otro
+                    self.stderr.write("Un proceso del pool terminó inesperadamente; se reinicia el pool.")
+                    pool.shutdown(wait=False, cancel_futures=True)
+                    pool = self._nuevo_pool(procesos)
+        finally:
+            pool.shutdown(wait=True)
+
+    def _informar(self, pk, ok):
+        if ok:
+            self.stdout.write(self.style.SUCCESS(f"Exportación {pk} generada."))
+        else:
+            self.stdout.write(self.style.ERROR(f"Exportación {pk} con error."))
@@ -0,0 +1,20 @@
+from django.core.management.base import BaseCommand
+
+from documentos import busqueda
+
+
+class Command(BaseCommand):
+    help = "Crea (si hace falta) y vuelve a poblar el índice de texto completo de los registros de archivo."
+
+    def add_arguments(self, parser):
+        parser.add_argument('--database', default='default', help="Alias de la base de datos.")
+        parser.add_argument('--chunk-size', type=int, default=2000, help="Registros por lote.")
+
+    def handle(self, *args, **options):
+        total = busqueda.reconstruir(
+            using=options['database'],
+            chunk_size=options['chunk_size'],
+            salida=lambda n: self.stdout.write(f"  {n} registros indexados..."),
+        )
+        motor = busqueda.motor(options['database']) or 'sin índice de texto completo (icontains)'
+        self.stdout.write(self.style.SUCCESS(f"Índice reconstruido: {total} registros. Motor: {motor}."))
@@ -0,0 +1,41 @@
+"""
+Utilidades compartidas por los comandos de benchmark (``medir_*``).
+
+Los datos de prueba se crean dentro de ``transaccion_revertida`` para que la
+medición no deje nada en la base de datos.
+"""
+from contextlib import contextmanager
+
+from django.contrib.auth.models import User
+from django.db import transaction
+
+from documentos.models import RegistroDeArchivo, SerieDocumental, SubserieDocumental
+
+
+@contextmanager
+def transaccion_revertida():
+    """Ejecuta el bloque en una transacción que siempre se revierte al salir."""
+    with transaction.atomic():
+        yield
+        transaction.set_rollback(True)
+
+
+def sembrar_registros(cantidad, nombre_usuario, con_subserie=False):
+    """
+    Crea ``cantidad`` registros de prueba (números BENCH-000000…) en la serie
+    '99' a nombre de un usuario nuevo. Devuelve el usuario.
+    """
+    usuario = User.objects.create(username=nombre_usuario)
+    serie = SerieDocumental.objects.create(codigo='99', nombre='Serie de prueba')
+    subserie = None
+    if con_subserie:
+        subserie = SubserieDocumental.objects.create(codigo='01', nombre='Subserie de prueba', serie=serie)
+    codigo = RegistroDeArchivo.calcular_codigo(serie, subserie)
+    RegistroDeArchivo.objects.bulk_create([
+        RegistroDeArchivo(
+            numero_orden=f'BENCH-{i:06d}', codigo=codigo, codigo_serie=serie, codigo_subserie=subserie,
+            unidad_documental=f'Unidad {i}', ubicacion='N/A', creado_por=usuario,
+        )
+        for i in range(cantidad)
+    ], batch_size=1000)
+    return usuario
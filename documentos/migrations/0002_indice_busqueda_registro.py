@@ -0,0 +1,62 @@
+"""
+Tabla de búsqueda de texto completo de los registros (ver documentos/busqueda.py).
+
+Se llena con los registros existentes; el índice del motor (FTS5 o catálogo
+FULLTEXT) lo crea después la señal post_migrate a partir de esta tabla.
+"""
+import django.db.models.deletion
+from django.db import migrations, models
+
+# Copia de busqueda.COLUMNAS_INDICE al momento de la migración
+COLUMNAS_INDICE = {
+    'numero_orden': 'numero_orden',
+    'unidad_documental': 'unidad_documental',
+    'ubicacion': 'ubicacion',
+    'caja': 'caja',
+    'carpeta': 'carpeta',
+    'serie': 'codigo_serie__nombre',
+    'subserie': 'codigo_subserie__nombre',
+    'notas': 'notas',
+}
+
+
+def indexar_registros_existentes(apps, schema_editor):
+    RegistroDeArchivo = apps.get_model('documentos', 'RegistroDeArchivo')
+    IndiceBusquedaRegistro = apps.get_model('documentos', 'IndiceBusquedaRegistro')
+    alias = schema_editor.connection.alias
+
+    filas = RegistroDeArchivo.objects.using(alias).values_list('pk', *COLUMNAS_INDICE.values())
+    lote = []
+    for pk, *valores in filas.iterator(chunk_size=2000):
+        lote.append(IndiceBusquedaRegistro(
+            registro_id=pk, **{c: v or '' for c, v in zip(COLUMNAS_INDICE, valores)}
+        ))
+        if len(lote) >= 2000:
+            IndiceBusquedaRegistro.objects.using(alias).bulk_create(lote)
+            lote = []
+    IndiceBusquedaRegistro.objects.using(alias).bulk_create(lote)
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('documentos', '0001_initial'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='IndiceBusquedaRegistro',
+            fields=[
+                ('registro', models.OneToOneField(on_delete=django.db.models.deletion.CASCADE, primary_key=True, related_name='indice_busqueda', serialize=False, to='documentos.registrodearchivo')),
+                ('numero_orden', models.CharField(default='', max_length=50)),
+                ('unidad_documental', models.CharField(default='', max_length=255)),
+                ('ubicacion', models.CharField(default='', max_length=255)),
+                ('caja', models.CharField(default='', max_length=50)),
+                ('carpeta', models.CharField(default='', max_length=50)),
+                ('serie', models.CharField(default='', max_length=255)),
+                ('subserie', models.CharField(default='', max_length=255)),
+                ('notas', models.TextField(default='')),
+            ],
+        ),
+        migrations.RunPython(indexar_registros_existentes, migrations.RunPython.noop),
+    ]
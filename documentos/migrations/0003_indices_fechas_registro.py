@@ -0,0 +1,25 @@
+# Generated by Django 5.2.18 on 2026-10-17 13:17
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('documentos', '0002_indice_busqueda_registro'),
+    ]
+
+    operations = [
+        migrations.AddIndex(
+            model_name='registrodearchivo',
+            index=models.Index(fields=['fecha_archivo'], name='registro_fecha_archivo_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='registrodearchivo',
+            index=models.Index(fields=['fecha_inicial'], name='registro_fecha_inicial_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='registrodearchivo',
+            index=models.Index(fields=['fecha_final'], name='registro_fecha_final_idx'),
+        ),
+    ]
@@ -0,0 +1,51 @@
+# Generated by Django 5.2.18 on 2026-10-17 13:17
+
+from django.conf import settings
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('documentos', '0003_indices_fechas_registro'),
+        migrations.swappable_dependency(settings.AUTH_USER_MODEL),
+    ]
+
+    operations = [
+        migrations.AddIndex(
+            model_name='fichapaciente',
+            index=models.Index(fields=['primer_nombre', 'consecutivo'], name='ficha_primer_nombre_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='fichapaciente',
+            index=models.Index(fields=['tipo_identificacion', 'consecutivo'], name='ficha_tipo_ident_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='fichapaciente',
+            index=models.Index(fields=['sexo', 'consecutivo'], name='ficha_sexo_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='fichapaciente',
+            index=models.Index(fields=['activo', 'consecutivo'], name='ficha_activo_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='fichapaciente',
+            index=models.Index(fields=['fecha_nacimiento', 'consecutivo'], name='ficha_fecha_nacimiento_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='registrodearchivo',
+            index=models.Index(fields=['fecha_creacion', 'id'], name='registro_creacion_id_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='registrodearchivo',
+            index=models.Index(fields=['creado_por', 'fecha_creacion'], name='registro_creador_fecha_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='registrodearchivo',
+            index=models.Index(fields=['numero_orden'], name='registro_numero_orden_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='registrodearchivo',
+            index=models.Index(fields=['soporte_fisico', 'soporte_electronico', 'fecha_creacion'], name='registro_soportes_idx'),
+        ),
+    ]
@@ -0,0 +1,19 @@
+# Generated by Django 5.2.18 on 2026-10-17 13:23
+
+from django.conf import settings
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('documentos', '0004_indices_filtros_orden'),
+        migrations.swappable_dependency(settings.AUTH_USER_MODEL),
+    ]
+
+    operations = [
+        migrations.AddIndex(
+            model_name='fuid',
+            index=models.Index(fields=['fecha_creacion', 'id'], name='fuid_creacion_id_idx'),
+        ),
+    ]
@@ -0,0 +1,27 @@
+# Generated by Django 5.2.18 on 2026-10-17 13:29
+
+import django.db.models.deletion
+from django.conf import settings
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('documentos', '0005_indice_fuid_fecha_creacion'),
+        migrations.swappable_dependency(settings.AUTH_USER_MODEL),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='ReservaRegistro',
+            fields=[
+                ('registro', models.OneToOneField(on_delete=django.db.models.deletion.CASCADE, primary_key=True, related_name='reserva', serialize=False, to='documentos.registrodearchivo')),
+                ('expira', models.DateTimeField()),
+                ('usuario', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='reservas_registros', to=settings.AUTH_USER_MODEL)),
+            ],
+            options={
+                'indexes': [models.Index(fields=['usuario', 'expira'], name='reserva_usuario_expira_idx')],
+            },
+        ),
+    ]
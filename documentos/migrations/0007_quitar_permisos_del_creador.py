@@ -0,0 +1,48 @@
+"""
+Borra las filas de guardian que sólo repetían los permisos del creador sobre
+sus propios registros y FUIDs: ahora los otorga documentos.backends.PropietarioBackend
+a partir de ``creado_por``. Las filas que comparten objetos con otros usuarios,
+y los permisos que el creador no tiene por defecto, se conservan.
+"""
+from django.db import migrations, models
+from django.db.models import Exists, OuterRef
+from django.db.models.functions import Cast
+
+# Copia de backends.PERMISOS_DEL_CREADOR al momento de la migración
+PERMISOS_DEL_CREADOR = {
+    'registrodearchivo': ['view_own_registro', 'edit_own_registro'],
+    'fuid': ['view_own_fuid', 'edit_own_fuid', 'delete_own_fuid'],
+}
+
+
+def quitar_permisos_del_creador(apps, schema_editor):
+    ContentType = apps.get_model('contenttypes', 'ContentType')
+    UserObjectPermission = apps.get_model('guardian', 'UserObjectPermission')
+    alias = schema_editor.connection.alias
+
+    for nombre_modelo, codenames in PERMISOS_DEL_CREADOR.items():
+        tipo = ContentType.objects.using(alias).filter(app_label='documentos', model=nombre_modelo).first()
+        if tipo is None:
+            continue  # base nueva: aún no hay permisos asignados
+        modelo = apps.get_model('documentos', nombre_modelo)
+        # object_pk es texto: se compara con la clave del objeto convertida a texto
+        propios = modelo.objects.using(alias).filter(creado_por_id=OuterRef('user_id')).annotate(
+            pk_texto=Cast('pk', models.CharField(max_length=255)),
+        ).filter(pk_texto=OuterRef('object_pk'))
+        UserObjectPermission.objects.using(alias).filter(
+            content_type=tipo, permission__content_type=tipo, permission__codename__in=codenames,
+        ).filter(Exists(propios)).delete()
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('documentos', '0006_reservas_registros'),
+        ('contenttypes', '0002_remove_content_type_name'),
+        ('guardian', '0001_initial'),
+    ]
+
+    operations = [
+        # Sin reversa: los permisos borrados siguen vigentes a través del backend
+        migrations.RunPython(quitar_permisos_del_creador, migrations.RunPython.noop),
+    ]
@@ -0,0 +1,23 @@
+# Generated by Django 5.2.18 on 2026-10-17 13:39
+
+from django.conf import settings
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('documentos', '0007_quitar_permisos_del_creador'),
+        migrations.swappable_dependency(settings.AUTH_USER_MODEL),
+    ]
+
+    operations = [
+        migrations.AddIndex(
+            model_name='fuid',
+            index=models.Index(fields=['oficina_productora', 'id'], name='fuid_oficina_id_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='perfilusuario',
+            index=models.Index(fields=['oficina', 'user'], name='perfil_oficina_usuario_idx'),
+        ),
+    ]
@@ -0,0 +1,24 @@
+# Generated by Django 5.2.18 on 2026-10-17 13:57
+
+import django.utils.timezone
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('documentos', '0009_trabajos_exportacion'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='fuid',
+            name='fecha_modificacion',
+            field=models.DateTimeField(default=django.utils.timezone.now, editable=False),
+        ),
+        migrations.AddField(
+            model_name='fuid',
+            name='version_contenido',
+            field=models.PositiveIntegerField(default=1, editable=False),
+        ),
+    ]
@@ -1,5 +1,6 @@
 from django.db import models
 from django.contrib.auth.models import User
+from django.utils import timezone
 
 class SerieDocumental(models.Model):
     codigo = models.CharField(max_length=50)
@@ -76,12 +77,24 @@ class FUID(models.Model):
     recibido_por_lugar = models.CharField(max_length=255, null=True, blank=True)    # Lugar
     recibido_por_fecha = models.DateField(null=True, blank=True)                    # Fecha
 
+    # Versión del contenido del formato FUID (el FUID, sus registros y los catálogos
+    # que muestra); la incrementa cache_fuid.tocar y con ella cambia la clave del
+    # libro en caché. fecha_modificacion es la del último cambio (Last-Modified).
+    version_contenido = models.PositiveIntegerField(default=1, editable=False)
+    fecha_modificacion = models.DateTimeField(default=timezone.now, editable=False)
+
     class Meta:
         permissions = [
             ("view_own_fuid", "Puede ver sus propios FUIDs"),
             ("edit_own_fuid", "Puede editar sus propios FUIDs"),
             ("delete_own_fuid", "Puede eliminar sus propios FUIDs"),
         ]
+        indexes = [
+            # Filtro por rango de fechas y orden de la API de FUIDs
+            models.Index(fields=['fecha_creacion', 'id'], name='fuid_creacion_id_idx'),
+            # Alcance por oficina (oficinas.py) con el orden por id de la API
+            models.Index(fields=['oficina_productora', 'id'], name='fuid_oficina_id_idx'),
+        ]
     
 
     def __str__(self):
@@ -119,16 +132,34 @@ class RegistroDeArchivo(models.Model):
             ("edit_own_registro", "Puede editar sus propios registros"),
             ("delete_own_registro", "Puede eliminar sus propios registros"),
         ]
+        indexes = [
+            # Los filtros de fecha de las APIs se traducen en rangos sobre estas columnas
+            models.Index(fields=['fecha_archivo'], name='registro_fecha_archivo_idx'),
+            models.Index(fields=['fecha_inicial'], name='registro_fecha_inicial_idx'),
+            models.Index(fields=['fecha_final'], name='registro_fecha_final_idx'),
+            # Orden por defecto de las APIs (y clave de la paginación por cursor)
+            models.Index(fields=['fecha_creacion', 'id'], name='registro_creacion_id_idx'),
+            # Formulario de FUID: registros propios filtrados por fecha de creación
+            models.Index(fields=['creado_por', 'fecha_creacion'], name='registro_creador_fecha_idx'),
+            models.Index(fields=['numero_orden'], name='registro_numero_orden_idx'),
+            # Filtros de soporte de las APIs, ya en el orden de la paginación
+            models.Index(fields=['soporte_fisico', 'soporte_electronico', 'fecha_creacion'],
+                         name='registro_soportes_idx'),
+        ]
     
-    def save(self, *args, **kwargs):
+    @staticmethod
+    def calcular_codigo(serie, subserie=None):
+        """Código del registro a partir de la entidad, la serie y la subserie ("301.02.00")."""
         # Valor constante para la entidad
         entidad_codigo = "301"
+        serie_codigo = serie.codigo.zfill(2)  # Asegurar dos dígitos en el código de la serie
+        subserie_codigo = subserie.codigo.zfill(2) if subserie else "00"  # Subserie o "00"
+        return f"{entidad_codigo}.{serie_codigo}.{subserie_codigo}"
 
-        # Generar el valor del código
+    def save(self, *args, **kwargs):
+        # Generar el valor del código (la importación masiva usa calcular_codigo sin pasar por save)
         if self.codigo_serie:
-            serie_codigo = self.codigo_serie.codigo.zfill(2)  # Asegurar dos dígitos en el código de la serie
-            subserie_codigo = self.codigo_subserie.codigo.zfill(2) if self.codigo_subserie else "00"  # Subserie o "00"
-            self.codigo = f"{entidad_codigo}.{serie_codigo}.{subserie_codigo}"
+            self.codigo = self.calcular_codigo(self.codigo_serie, self.codigo_subserie)
 
         super().save(*args, **kwargs)   
 
@@ -139,6 +170,97 @@ class RegistroDeArchivo(models.Model):
     
 
 
+class IndiceBusquedaRegistro(models.Model):
+    """
+    Copia desnormalizada de los campos de texto buscables de un RegistroDeArchivo.
+    Sobre esta tabla se monta el índice de texto completo (catálogo full-text en
+    SQL Server, FTS5 en SQLite); ver documentos/busqueda.py.
+    """
+    registro = models.OneToOneField(RegistroDeArchivo, on_delete=models.CASCADE, primary_key=True, related_name='indice_busqueda')
+    numero_orden = models.CharField(max_length=50, default='')
+    unidad_documental = models.CharField(max_length=255, default='')
+    ubicacion = models.CharField(max_length=255, default='')
+    caja = models.CharField(max_length=50, default='')
+    carpeta = models.CharField(max_length=50, default='')
+    serie = models.CharField(max_length=255, default='')
+    subserie = models.CharField(max_length=255, default='')
+    notas = models.TextField(default='')
+
+    def __str__(self):
+        return f"Índice de búsqueda del registro {self.registro_id}"
+
+
+class ReservaRegistro(models.Model):
+    """
+    Reserva temporal de un registro por el usuario que está armando un FUID con
+    él. Mientras no venza, el registro no se ofrece ni se asigna a otros
+    usuarios; ver documentos/reservas.py. Una reserva vencida no bloquea nada
+    y se reemplaza en la siguiente reserva del registro.
+    """
+    registro = models.OneToOneField(RegistroDeArchivo, on_delete=models.CASCADE, primary_key=True, related_name='reserva')
+    usuario = models.ForeignKey(User, on_delete=models.CASCADE, related_name='reservas_registros')
+    expira = models.DateTimeField()
+
+    class Meta:
+        indexes = [
+            models.Index(fields=['usuario', 'expira'], name='reserva_usuario_expira_idx'),
+        ]
+
+    def __str__(self):
+        return f"Registro {self.registro_id} reservado por {self.usuario_id} hasta {self.expira}"
+
+
+class TrabajoExportacion(models.Model):
+    """
+    Exportación pedida por un usuario y generada en segundo plano por el
+    comando ``procesar_exportaciones``; ver documentos/trabajos.py. El archivo
+    generado se guarda en ``EXPORTACIONES_DIR`` hasta ``expira``.
+    """
+    PENDIENTE = 'pendiente'
+    EN_PROCESO = 'en_proceso'
+    TERMINADO = 'terminado'
+    ERROR = 'error'
+    ESTADOS = [
+        (PENDIENTE, 'Pendiente'),
+        (EN_PROCESO, 'En proceso'),
+        (TERMINADO, 'Terminado'),
+        (ERROR, 'Error'),
+    ]
+
+    usuario = models.ForeignKey(User, on_delete=models.CASCADE, related_name='exportaciones')
+    tipo = models.CharField(max_length=20)
+    parametros = models.JSONField(default=dict)
+    estado = models.CharField(max_length=20, choices=ESTADOS, default=PENDIENTE)
+    procesados = models.PositiveIntegerField(default=0)
+    total = models.PositiveIntegerField(null=True, blank=True)
+    archivo = models.CharField(max_length=255, blank=True)  # Ruta relativa a EXPORTACIONES_DIR
+    nombre_archivo = models.CharField(max_length=255, blank=True)
+    error = models.TextField(blank=True)
+    creado = models.DateTimeField(auto_now_add=True)
+    iniciado = models.DateTimeField(null=True, blank=True)
+    terminado = models.DateTimeField(null=True, blank=True)
+    expira = models.DateTimeField(null=True, blank=True)
+
+    class Meta:
+        indexes = [
+            # Cola del worker (pendientes por orden de llegada) y limpieza de vencidos
+            models.Index(fields=['estado', 'creado'], name='exportacion_estado_idx'),
+            models.Index(fields=['expira'], name='exportacion_expira_idx'),
+        ]
+
+    @property
+    def progreso(self):
+        """Porcentaje completado, o None mientras no se conoce el total."""
+        if self.estado == self.TERMINADO:
+            return 100
+        if not self.total:
+            return None
+        return min(99, self.procesados * 100 // self.total)
+
+    def __str__(self):
+        return f"Exportación {self.pk} ({self.tipo}) de {self.usuario_id}: {self.estado}"
+
+
 class PermisoUsuarioSerie(models.Model):
     usuario = models.ForeignKey(User, on_delete=models.CASCADE)
     serie = models.ForeignKey(SerieDocumental, on_delete=models.CASCADE)
@@ -170,7 +292,16 @@ class FichaPaciente (models.Model):
     sexo = models.CharField(max_length=10, default='Masculino')
     activo = models.BooleanField(default=True)
 
-        
+    class Meta:
+        # Columnas ordenables de ListaFichasAPIView; consecutivo desempata el orden.
+        # num_identificacion y Numero_historia_clinica ya tienen índice por ser únicos.
+        indexes = [
+            models.Index(fields=['primer_nombre', 'consecutivo'], name='ficha_primer_nombre_idx'),
+            models.Index(fields=['tipo_identificacion', 'consecutivo'], name='ficha_tipo_ident_idx'),
+            models.Index(fields=['sexo', 'consecutivo'], name='ficha_sexo_idx'),
+            models.Index(fields=['activo', 'consecutivo'], name='ficha_activo_idx'),
+            models.Index(fields=['fecha_nacimiento', 'consecutivo'], name='ficha_fecha_nacimiento_idx'),
+        ]
 
     
 
@@ -187,6 +318,12 @@ class PerfilUsuario(models.Model):
     user = models.OneToOneField(User, on_delete=models.CASCADE, related_name='perfil')
     oficina = models.ForeignKey(OficinaProductora, on_delete=models.CASCADE)
 
+    class Meta:
+        indexes = [
+            # Usuarios de una oficina, sin leer la tabla (filtro de registros por creador en oficinas.py)
+            models.Index(fields=['oficina', 'user'], name='perfil_oficina_usuario_idx'),
+        ]
+
     def __str__(self):
         return f"{self.user.username} - {self.oficina.nombre}"
 
@@ -0,0 +1,61 @@
+"""
+Alcance por oficina productora (``PerfilUsuario.oficina``).
+
+Los usuarios con perfil sólo ven los datos de su oficina:
+
+- FUIDs: los de ``oficina_productora`` igual a su oficina.
+- Registros: los que están en un FUID de su oficina o los creó alguien de su
+  oficina (incluido él mismo).
+
+Los superusuarios y los usuarios sin perfil no tienen restricción (como hasta
+ahora); los usuarios anónimos no ven nada. Los filtros son semijoins en SQL (``IN (SELECT ...)``) apoyados en los
+índices ``fuid_oficina_id_idx``, ``perfil_oficina_usuario_idx`` y
+``registro_creador_fecha_idx``, de modo que cada consulta recorre sólo la
+parte de la oficina.
+
+La oficina del usuario se consulta una vez por petición (se memoriza en el
+objeto usuario); cambiar un perfil invalida las respuestas cacheadas de las
+APIs (``signals.py``).
+"""
+from django.db.models import Q
+
+from .models import FUID, PerfilUsuario
+
+
+def oficina_de(usuario):
+    """Id de la oficina del perfil de ``usuario``, o None si no tiene restricción por oficina."""
+    if not usuario.is_authenticated or usuario.is_superuser:
+        return None
+    memo = getattr(usuario, '_oficina_perfil', None)
+    if memo is not None:
+        return memo[0]
+    oficina = PerfilUsuario.objects.filter(user=usuario).values_list('oficina_id', flat=True).first()
+    usuario._oficina_perfil = (oficina,)
+    return oficina
+
+
+def filtrar_fuids(fuids, usuario):
+    """Restringe un queryset de FUIDs a la oficina de ``usuario``."""
+    if not usuario.is_authenticated:
+        return fuids.none()
+    oficina = oficina_de(usuario)
+    if oficina is None:
+        return fuids
+    return fuids.filter(oficina_productora_id=oficina)
+
+
+def filtrar_registros(registros, usuario):
+    """
+    Restringe un queryset de registros a los de la oficina de ``usuario``:
+    en algún FUID de la oficina o creados por alguien de ella.
+    """
+    if not usuario.is_authenticated:
+        return registros.none()
+    oficina = oficina_de(usuario)
+    if oficina is None:
+        return registros
+    en_fuids = FUID.registros.through.objects.filter(
+        fuid__oficina_productora_id=oficina,
+    ).values('registrodearchivo_id')
+    creadores = PerfilUsuario.objects.filter(oficina_id=oficina).values('user_id')
+    return registros.filter(Q(pk__in=en_fuids) | Q(creado_por__in=creadores))
@@ -0,0 +1,74 @@
+"""
+Comprobación de permisos por objeto (django-guardian) memorizada por petición.
+
+``get_perms(usuario, obj)`` y ``usuario.has_perm(perm, obj)`` crean cada vez un
+``ObjectPermissionChecker`` nuevo y consultan las tablas de guardian (permisos
+del usuario y de sus grupos). Aquí se usa un único checker por petición
+(``permisos_de(request)``): cada objeto se consulta una sola vez, y para
+listas ``precargar`` trae los permisos de todos los objetos con dos consultas
+(``prefetch_perms``), de modo que comprobar N filas no cuesta N consultas.
+
+Las comprobaciones son de sólo lectura. Los permisos del creador sobre sus
+propios registros y FUIDs no se guardan en guardian: salen de ``creado_por``
+(ver ``backends.py``) y se resuelven sin consultas.
+"""
+from guardian.core import ObjectPermissionChecker
+
+from .backends import otorga_el_creador, otorga_la_serie
+
+# Campos de los que dependen los permisos implícitos (creador y serie), si el modelo los tiene
+CAMPOS_PERMISOS = ('creado_por_id', 'codigo_serie_id')
+
+
+def campos_para_permisos(modelo):
+    """
+    Campos con los que se comprueban los permisos sobre un objeto de ``modelo``
+    (clave primaria, creador y serie): bastan para construir una instancia
+    parcial y pasarla a ``PermisosObjeto`` sin leer la fila entera.
+    """
+    nombres = {campo.attname for campo in modelo._meta.concrete_fields}
+    return [modelo._meta.pk.attname] + [campo for campo in CAMPOS_PERMISOS if campo in nombres]
+
+
+class PermisosObjeto:
+    def __init__(self, usuario):
+        self.usuario = usuario
+        self.checker = ObjectPermissionChecker(usuario)
+
+    def tiene(self, permiso, obj):
+        """
+        Igual que ``usuario.has_perm(permiso, obj)`` con los backends del
+        proyecto: los superusuarios lo tienen todo, el creador tiene los
+        permisos propios, las series de ``PermisoUsuarioSerie`` conceden los
+        suyos y ``permiso`` puede llevar o no el prefijo de la app
+        ('documentos.edit_own_fuid' o 'edit_own_fuid').
+        """
+        if not self.usuario.is_authenticated:
+            return False
+        if otorga_el_creador(self.usuario, permiso, obj) or otorga_la_serie(self.usuario, permiso, obj):
+            return True
+        return self.checker.has_perm(permiso, obj)
+
+    def precargar(self, objetos):
+        """Trae de una vez los permisos de todos los ``objetos`` (del mismo modelo)."""
+        objetos = list(objetos)
+        if objetos and self.usuario.is_authenticated and not self.usuario.is_superuser:
+            self.checker.prefetch_perms(objetos)
+        return objetos
+
+    def banderas(self, objetos, permisos):
+        """
+        Para cada objeto, ``{bandera: tiene(permiso, objeto)}`` según ``permisos``
+        (bandera -> permiso). Los permisos de guardian de todos los objetos se
+        precargan juntos, así que una página entera cuesta dos consultas.
+        """
+        objetos = self.precargar(objetos)
+        return [{bandera: self.tiene(permiso, obj) for bandera, permiso in permisos.items()} for obj in objetos]
+
+
+def permisos_de(request):
+    """Comprobador de permisos por objeto de la petición; se crea la primera vez que se pide."""
+    permisos = getattr(request, '_permisos_objeto', None)
+    if permisos is None:
+        permisos = request._permisos_objeto = PermisosObjeto(request.user)
+    return permisos
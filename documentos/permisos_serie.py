@@ -0,0 +1,119 @@
+"""
+Permisos por serie documental (``PermisoUsuarioSerie``).
+
+Una fila da a un usuario las acciones marcadas (crear, editar, consultar,
+eliminar) sobre todos los registros de una serie, en lugar de una fila de
+guardian por registro.
+
+- Los usuarios sin ninguna fila no tienen restricción por serie (como hasta
+  ahora); los superusuarios tampoco.
+- Con filas, las listas y APIs sólo muestran los registros de las series que
+  puede consultar más los que creó él mismo, y sólo puede crear registros en
+  las series con ``permiso_crear``.
+- ``backends.SeriePermisoBackend`` traduce editar/consultar/eliminar en los
+  permisos ``*_own_registro`` sobre los registros de esas series.
+
+La matriz de cada usuario (acción -> ids de serie) se carga de una vez y se
+guarda en memoria del proceso y en la caché, bajo la generación de
+``PermisoUsuarioSerie`` (ver ``conteos.generacion``); cualquier cambio en la
+tabla la invalida (``signals.py``). Además la copia en caché expira a los
+``PERMISOS_SERIE_TTL`` segundos y la memoria del proceso guarda a lo sumo
+``MAXIMO_EN_MEMORIA`` usuarios.
+"""
+import threading
+
+from django.conf import settings
+from django.core.cache import cache
+from django.db.models import Q
+
+from .conteos import generacion
+from .models import PermisoUsuarioSerie
+
+ACCIONES = ('crear', 'editar', 'consultar', 'eliminar')
+
+# Permiso por objeto sobre registros que concede cada acción
+PERMISOS_REGISTRO = {
+    'view_own_registro': 'consultar',
+    'edit_own_registro': 'editar',
+    'delete_own_registro': 'eliminar',
+}
+
+MAXIMO_EN_MEMORIA = 1000
+
+# user_pk -> (generación, matriz); válido mientras la generación no cambie
+_matrices = {}
+# Los hilos de las peticiones leen y desalojan _matrices a la vez
+_mutex = threading.Lock()
+
+
+def _cargar(usuario):
+    filas = PermisoUsuarioSerie.objects.filter(usuario=usuario).values_list(
+        'serie_id', *(f'permiso_{accion}' for accion in ACCIONES),
+    )
+    matriz = {accion: set() for accion in ACCIONES}
+    restringido = False
+    for serie_id, *permitidas in filas:
+        restringido = True
+        for accion, permitida in zip(ACCIONES, permitidas):
+            if permitida:
+                matriz[accion].add(serie_id)
+    if not restringido:
+        return None
+    return {accion: frozenset(series) for accion, series in matriz.items()}
+
+
+def matriz(usuario):
+    """
+    Series permitidas por acción para ``usuario``, o None si no tiene
+    restricción por serie. Dentro de una petición se memoriza en el propio
+    objeto usuario.
+    """
+    if not usuario.is_authenticated or usuario.is_superuser:
+        return None
+    memo = getattr(usuario, '_matriz_series', None)
+    if memo is not None:
+        return memo[0]
+
+    version = generacion(PermisoUsuarioSerie)
+    with _mutex:
+        en_memoria = _matrices.get(usuario.pk)
+    if en_memoria is not None and en_memoria[0] == version:
+        resultado = en_memoria[1]
+    else:
+        clave = f'permisos_serie:{usuario.pk}:{version}'
+        guardada = cache.get(clave)
+        if guardada is not None:
+            resultado = guardada[0]
+        else:
+            resultado = _cargar(usuario)
+            cache.set(clave, (resultado,), getattr(settings, 'PERMISOS_SERIE_TTL', 5 * 60))
+        with _mutex:
+            _matrices.pop(usuario.pk, None)
+            if len(_matrices) >= MAXIMO_EN_MEMORIA:
+                # Se descarta el usuario que lleva más tiempo sin recargarse
+                del _matrices[next(iter(_matrices))]
+            _matrices[usuario.pk] = (version, resultado)
+    usuario._matriz_series = (resultado,)
+    return resultado
+
+
+def series_permitidas(usuario, accion):
+    """Ids de las series en que ``usuario`` puede hacer ``accion``; None si puede en todas."""
+    permisos = matriz(usuario)
+    return None if permisos is None else permisos[accion]
+
+
+def permite(usuario, accion, serie_id):
+    series = series_permitidas(usuario, accion)
+    return series is None or serie_id in series
+
+
+def filtrar_registros(registros, usuario, accion='consultar'):
+    """
+    Restringe un queryset de registros a las series permitidas, en SQL
+    (``codigo_serie__in``); los registros creados por el usuario se mantienen.
+    """
+    series = series_permitidas(usuario, accion)
+    if series is None:
+        return registros
+    return registros.filter(Q(codigo_serie__in=sorted(series)) | Q(creado_por=usuario))
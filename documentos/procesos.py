@@ -0,0 +1,17 @@
+"""
+Puntos de entrada de los procesos del pool de ``procesar_exportaciones``.
+
+Este módulo no importa nada de Django al cargarse: con el arranque ``spawn``
+(Windows) el proceso hijo lo importa antes de que Django esté configurado, y
+``inicializar`` hace el ``django.setup()``. Con ``fork`` (Linux) no cambia nada.
+"""
+
+
+def inicializar():
+    import django
+    django.setup()
+
+
+def ejecutar_trabajo(pk):
+    from .trabajos import ejecutar
+    return ejecutar(pk)
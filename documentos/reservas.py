@@ -0,0 +1,118 @@
+"""
+Reservas de registros para armar FUIDs en paralelo.
+
+Cuando un usuario marca registros en el selector del formulario de FUID se
+reservan a su nombre por ``RESERVAS_DURACION`` segundos (``ReservaRegistro``).
+Mientras la reserva no venza, esos registros no se ofrecen a otros usuarios
+(``sin_reservas_ajenas``) ni se pueden reservar o asignar por ellos; al
+guardar el FUID se vuelven a reservar (lo que renueva el plazo y detecta si
+alguno se perdió) y después se liberan.
+
+Para reservar se bloquean las filas candidatas con
+``SELECT ... FOR UPDATE SKIP LOCKED`` (en SQL Server ``WITH (ROWLOCK, UPDLOCK,
+READPAST)``): si dos usuarios piden a la vez los mismos registros, el segundo
+no espera al primero, simplemente no los obtiene. En motores sin SKIP LOCKED
+(SQLite en local) las reservas y la asignación de registros a FUIDs de un
+proceso se serializan con un candado (``escritura_exclusiva``).
+"""
+import threading
+from contextlib import nullcontext
+from datetime import timedelta
+
+from django.conf import settings
+from django.db import connections, router, transaction
+from django.db.models import Exists, OuterRef
+from django.utils import timezone
+
+from . import conteos
+from .models import FUID, RegistroDeArchivo, ReservaRegistro
+
+# Por debajo del límite de parámetros de SQL Server (2100 por consulta)
+TAMANO_LOTE = 1000
+
+_candado_local = threading.RLock()
+
+
+def duracion():
+    return timedelta(seconds=getattr(settings, 'RESERVAS_DURACION', 15 * 60))
+
+
+def _lotes(ids):
+    ids = list(ids)
+    for i in range(0, len(ids), TAMANO_LOTE):
+        yield ids[i:i + TAMANO_LOTE]
+
+
+def escritura_exclusiva(using='default'):
+    """
+    Contexto para escribir reservas o asignaciones de registros. Con SKIP LOCKED
+    no hace nada (los bloqueos de fila bastan); sin él, serializa a los
+    escritores del proceso.
+    """
+    if connections[using].features.has_select_for_update_skip_locked:
+        return nullcontext()
+    return _candado_local
+
+
+def reservas_activas(usuario=None):
+    """Reservas vigentes; con ``usuario``, sólo las de los demás usuarios."""
+    reservas = ReservaRegistro.objects.filter(expira__gt=timezone.now())
+    if usuario is not None:
+        reservas = reservas.exclude(usuario=usuario)
+    return reservas
+
+
+def sin_reservas_ajenas(registros, usuario=None):
+    """Quita de ``registros`` los reservados por otros usuarios (por cualquiera si no se indica ``usuario``)."""
+    return registros.exclude(Exists(reservas_activas(usuario).filter(registro=OuterRef('pk'))))
+
+
+def _libres(registros, fuid=None):
+    # Exists en lugar de fuids__isnull: sin LEFT JOIN, que FOR UPDATE no admite en todos los motores
+    asignados = FUID.registros.through.objects.filter(registrodearchivo_id=OuterRef('pk'))
+    if fuid is not None and fuid.pk:
+        asignados = asignados.exclude(fuid_id=fuid.pk)
+    return registros.exclude(Exists(asignados))
+
+
+def reservar(usuario, ids, fuid=None):
+    """
+    Reserva para ``usuario`` los registros de ``ids`` que sigan libres: sin
+    FUID (o ya en ``fuid``, al editar) y sin reserva vigente de otro usuario.
+    Renueva el plazo de las reservas que ya tenía. Devuelve los ids obtenidos.
+    """
+    using = router.db_for_write(ReservaRegistro)
+    conexion = connections[using]
+    saltar_bloqueados = conexion.features.has_select_for_update_skip_locked
+    obtenidos = []
+    with escritura_exclusiva(using), transaction.atomic(using=using):
+        expira = timezone.now() + duracion()
+        for lote in _lotes(ids):
+            candidatos = sin_reservas_ajenas(_libres(RegistroDeArchivo.objects.filter(pk__in=lote), fuid), usuario)
+            if saltar_bloqueados:
+                candidatos = candidatos.select_for_update(skip_locked=True)
+            pks = list(candidatos.values_list('pk', flat=True))
+            # Las filas están bloqueadas por esta transacción: se reemplazan las reservas
+            # propias o vencidas que tuvieran sin competir con nadie
+            ReservaRegistro.objects.filter(registro_id__in=pks).delete()
+            ReservaRegistro.objects.bulk_create(
+                [ReservaRegistro(registro_id=pk, usuario=usuario, expira=expira) for pk in pks]
+            )
+            obtenidos.extend(pks)
+    if obtenidos:
+        conteos.invalidar(ReservaRegistro)
+    return obtenidos
+
+
+def liberar(usuario, ids=None):
+    """Elimina las reservas de ``usuario`` (sólo las de ``ids`` si se indican)."""
+    reservas = ReservaRegistro.objects.filter(usuario=usuario)
+    if ids is None:
+        borradas, _ = reservas.delete()
+    else:
+        borradas = 0
+        for lote in _lotes(ids):
+            borradas += reservas.filter(registro_id__in=lote).delete()[0]
+    if borradas:
+        conteos.invalidar(ReservaRegistro)
+    return borradas
@@ -0,0 +1,161 @@
+"""
+Señales de la aplicación documentos.
+"""
+from django.contrib.auth.models import Group, Permission, User
+from django.db.models.signals import m2m_changed, post_delete, post_init, post_save, pre_delete
+from django.dispatch import receiver
+from guardian.models import GroupObjectPermission, UserObjectPermission
+
+from . import busqueda, cache_fuid, conteos
+from .models import (
+    FUID, EntidadProductora, FichaPaciente, IndiceBusquedaRegistro, Objeto, OficinaProductora, PerfilUsuario, PermisoUsuarioSerie,
+    RegistroDeArchivo, SerieDocumental, SubserieDocumental, UnidadAdministrativa,
+)
+
+
+@receiver(post_save, sender=RegistroDeArchivo)
+@receiver(post_delete, sender=RegistroDeArchivo)
+@receiver(post_save, sender=SerieDocumental)
+@receiver(post_delete, sender=SerieDocumental)
+@receiver(post_save, sender=SubserieDocumental)
+@receiver(post_delete, sender=SubserieDocumental)
+@receiver(post_save, sender=UnidadAdministrativa)
+@receiver(post_delete, sender=UnidadAdministrativa)
+@receiver(post_save, sender=OficinaProductora)
+@receiver(post_delete, sender=OficinaProductora)
+@receiver(post_save, sender=Objeto)
+@receiver(post_delete, sender=Objeto)
+@receiver(post_save, sender=FUID)
+@receiver(post_delete, sender=FUID)
+@receiver(post_save, sender=FichaPaciente)
+@receiver(post_delete, sender=FichaPaciente)
+@receiver(post_save, sender=PermisoUsuarioSerie)
+@receiver(post_delete, sender=PermisoUsuarioSerie)
+def invalidar_conteos(sender, **kwargs):
+    # Cualquier escritura cambia la generación del modelo y con ella los conteos cacheados
+    conteos.invalidar(sender)
+
+
+@receiver(m2m_changed, sender=FUID.registros.through)
+def invalidar_conteos_fuid_registros(sender, action, **kwargs):
+    # Asignar registros a un FUID cambia los filtros del tipo fuids__isnull
+    if action in ('post_add', 'post_remove', 'post_clear'):
+        conteos.invalidar(RegistroDeArchivo)
+        conteos.invalidar(FUID)
+
+
+@receiver(m2m_changed, sender=User.user_permissions.through)
+@receiver(m2m_changed, sender=User.groups.through)
+@receiver(m2m_changed, sender=Group.permissions.through)
+@receiver(post_save, sender=UserObjectPermission)
+@receiver(post_delete, sender=UserObjectPermission)
+@receiver(post_save, sender=GroupObjectPermission)
+@receiver(post_delete, sender=GroupObjectPermission)
+@receiver(post_save, sender=PermisoUsuarioSerie)
+@receiver(post_delete, sender=PermisoUsuarioSerie)
+@receiver(post_save, sender=PerfilUsuario)
+@receiver(post_delete, sender=PerfilUsuario)
+def invalidar_permisos(sender, action=None, **kwargs):
+    # Las respuestas cacheadas son por usuario y dependen de sus permisos y de
+    # las oficinas de los perfiles (ver cache_respuestas.py y oficinas.py);
+    # cualquier cambio en ellos las invalida
+    if action is None or action in ('post_add', 'post_remove', 'post_clear'):
+        conteos.invalidar(Permission)
+
+
+@receiver(post_init, sender=RegistroDeArchivo)
+def recordar_huella_indice(sender, instance, **kwargs):
+    instance._huella_indice = busqueda.huella_indice(instance)
+
+
+@receiver(post_save, sender=RegistroDeArchivo)
+def indexar_registro(sender, instance, created, raw=False, **kwargs):
+    # Mantiene al día la fila del índice de texto completo, sólo si cambió algo
+    # que se indexa (al borrar el registro, su fila se elimina en cascada)
+    if raw:
+        return
+    huella = busqueda.huella_indice(instance)
+    if created or huella != getattr(instance, '_huella_indice', None):
+        busqueda.indexar_registro(instance, creado=created)
+    instance._huella_indice = huella
+
+
+@receiver(post_save, sender=SerieDocumental)
+def reindexar_serie(sender, instance, created, raw=False, **kwargs):
+    if not created and not raw:
+        IndiceBusquedaRegistro.objects.filter(registro__codigo_serie=instance).update(serie=instance.nombre)
+
+
+@receiver(post_save, sender=SubserieDocumental)
+def reindexar_subserie(sender, instance, created, raw=False, **kwargs):
+    if not created and not raw:
+        IndiceBusquedaRegistro.objects.filter(registro__codigo_subserie=instance).update(subserie=instance.nombre)
+
+
+@receiver(post_save, sender=RegistroDeArchivo)
+@receiver(pre_delete, sender=RegistroDeArchivo)
+@receiver(post_save, sender=SerieDocumental)
+@receiver(pre_delete, sender=SerieDocumental)
+@receiver(post_save, sender=SubserieDocumental)
+@receiver(pre_delete, sender=SubserieDocumental)
+@receiver(pre_delete, sender=User)
+@receiver(post_save, sender=EntidadProductora)
+@receiver(pre_delete, sender=EntidadProductora)
+@receiver(post_save, sender=UnidadAdministrativa)
+@receiver(pre_delete, sender=UnidadAdministrativa)
+@receiver(post_save, sender=OficinaProductora)
+@receiver(pre_delete, sender=OficinaProductora)
+@receiver(post_save, sender=Objeto)
+@receiver(pre_delete, sender=Objeto)
+def tocar_fuids_que_lo_muestran(sender, instance, raw=False, created=False, update_fields=None, **kwargs):
+    # Un cambio en algo que muestra el formato FUID cambia la versión de los FUIDs
+    # afectados y con ella la clave de sus libros en caché (cache_fuid.py). Se usa
+    # pre_delete porque después de borrar ya no están las filas que los unen. Al
+    # crear no hay FUIDs que lo muestren.
+    if raw or created:
+        return
+    cache_fuid.tocar_los_que_muestran(instance)
+
+
+# Campos del usuario que muestra el formato FUID (el creador de cada registro)
+CAMPOS_USUARIO_FUID = ('username',)
+
+
+def _campos_mostrados(usuario):
+    # __dict__ y no getattr: un campo diferido no se consulta sólo para esto
+    return {campo: usuario.__dict__.get(campo) for campo in CAMPOS_USUARIO_FUID}
+
+
+@receiver(post_init, sender=User)
+def recordar_campos_mostrados(sender, instance, **kwargs):
+    instance._campos_mostrados = _campos_mostrados(instance)
+
+
+@receiver(post_save, sender=User)
+def tocar_fuids_del_usuario(sender, instance, raw=False, created=False, update_fields=None, **kwargs):
+    # Guardar un usuario (inicio de sesión, contraseña, permisos...) sólo cambia
+    # los FUIDs si cambió algo que el formato muestra
+    if raw or created or (update_fields is not None and not set(update_fields) & set(CAMPOS_USUARIO_FUID)):
+        return
+    actuales = _campos_mostrados(instance)
+    if actuales != getattr(instance, '_campos_mostrados', None):
+        cache_fuid.tocar_los_que_muestran(instance)
+    instance._campos_mostrados = actuales
+
+
+@receiver(post_save, sender=FUID)
+def tocar_fuid(sender, instance, raw=False, created=False, **kwargs):
+    if not raw and not created:
+        cache_fuid.tocar(FUID.objects.filter(pk=instance.pk))
+
+
+@receiver(m2m_changed, sender=FUID.registros.through)
+def tocar_fuids_por_registros(sender, instance, action, reverse, pk_set, **kwargs):
+    # Cambiar los registros de un FUID cambia su formato
+    if not reverse:
+        if action in ('post_add', 'post_remove', 'post_clear'):
+            cache_fuid.tocar(FUID.objects.filter(pk=instance.pk))
+    elif action in ('post_add', 'post_remove') and pk_set:
+        cache_fuid.tocar(FUID.objects.filter(pk__in=pk_set))
+    elif action == 'pre_clear':
+        cache_fuid.tocar(FUID.objects.filter(registros=instance))
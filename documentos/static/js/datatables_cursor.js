@@ -0,0 +1,69 @@
+// Paginación por cursor (keyset) para las tablas server-side de registros.
+// Cuando el usuario avanza a la página siguiente se envía el cursor que
+// devolvió el servidor en la página anterior (nextCursor), así la consulta
+// busca desde esa fila en lugar de recorrer todas las anteriores (OFFSET).
+// Los saltos a páginas arbitrarias siguen usando start/length.
+function paginacionCursor() {
+  let cursores = {};
+  let claveActual = null;
+  let startPedido = 0;
+  let lengthPedido = 0;
+
+  return {
+    data: function (d) {
+      // Si cambian filtros, orden o tamaño de página los cursores dejan de valer
+      const clave = JSON.stringify({
+        b: d.columns.map(function (c) { return c.search.value; }),
+        o: d.order,
+        l: d.length
+      });
+      if (clave !== claveActual) {
+        cursores = {};
+        claveActual = clave;
+      }
+      startPedido = d.start;
+      lengthPedido = d.length;
+      if (d.start === 0) {
+        d.cursor = '';
+      } else if (cursores[d.start] !== undefined) {
+        d.cursor = cursores[d.start];
+      }
+      return d;
+    },
+    dataSrc: function (json) {
+      if (json.nextCursor && lengthPedido > 0) {
+        cursores[startPedido + lengthPedido] = json.nextCursor;
+      }
+      return json.data;
+    }
+  };
+}
+
+// Fuente de datos para DataTables (opción ajax) que usa la primera página
+// incrustada en el HTML con json_script para el dibujo inicial, así la página
+// se muestra sin una segunda petición; los dibujos siguientes (paginar,
+// filtrar, ordenar) consultan la API. ``cursor`` es un paginacionCursor().
+function ajaxConPrimeraPagina(url, idScript, cursor) {
+  const elemento = document.getElementById(idScript);
+  let inicial = elemento ? JSON.parse(elemento.textContent) : null;
+
+  return function (data, callback) {
+    cursor.data(data);
+    if (inicial !== null) {
+      const json = Object.assign({}, inicial, { draw: data.draw });
+      inicial = null;
+      callback(Object.assign(json, { data: cursor.dataSrc(json) }));
+      return;
+    }
+    $.ajax({ url: url, type: 'GET', data: data, dataType: 'json' })
+      .done(function (json) {
+        callback(Object.assign(json, { data: cursor.dataSrc(json) }));
+      })
+      .fail(function () {
+        callback({
+          draw: data.draw, recordsTotal: 0, recordsFiltered: 0, data: [],
+          error: 'No se pudieron cargar los registros.'
+        });
+      });
+  };
+}
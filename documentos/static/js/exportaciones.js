@@ -0,0 +1,63 @@
+// Exportaciones en segundo plano (documentos/trabajos.py).
+// Encola la exportación, consulta su avance cada pocos segundos y, cuando el
+// archivo está listo, lo descarga. `alCambiar` recibe el estado de cada
+// consulta ({estado, procesados, total, progreso, error}) para mostrar el avance.
+function exportarEnSegundoPlano(url, datos, alCambiar) {
+  const csrf = document.querySelector('input[name="csrfmiddlewaretoken"]').value;
+  const cuerpo = new FormData();
+  Object.keys(datos).forEach(function (clave) {
+    [].concat(datos[clave]).forEach(function (valor) { cuerpo.append(clave, valor); });
+  });
+
+  function consultar(urlEstado) {
+    fetch(urlEstado)
+      .then(function (respuesta) { return respuesta.json(); })
+      .then(function (estado) {
+        alCambiar(estado);
+        if (estado.estado === 'terminado') {
+          window.location = estado.url_descarga;
+        } else if (estado.estado !== 'error') {
+          setTimeout(function () { consultar(urlEstado); }, 2000);
+        }
+      });
+  }
+
+  return fetch(url, { method: 'POST', headers: { 'X-CSRFToken': csrf }, body: cuerpo })
+    .then(function (respuesta) { return respuesta.json(); })
+    .then(function (estado) {
+      if (!estado.ok) {
+        alCambiar({ estado: 'error', error: estado.message });
+        return;
+      }
+      alCambiar(estado);
+      consultar(estado.url_estado);
+    });
+}
+
+// Texto para mostrar en el botón mientras avanza la exportación.
+function textoProgresoExportacion(estado) {
+  if (estado.estado === 'error') {
+    return 'Error: ' + (estado.error || 'no se pudo exportar');
+  }
+  if (estado.estado === 'terminado') {
+    return 'Descargando…';
+  }
+  if (estado.progreso !== null && estado.progreso !== undefined) {
+    return 'Generando… ' + estado.progreso + '%';
+  }
+  return estado.estado === 'pendiente' ? 'En cola…' : 'Generando…';
+}
+
+// Parámetros de la última petición de una tabla server-side de DataTables,
+// con los mismos nombres planos que recibe la API (columns[0][search][value], ...),
+// para exportar con los filtros y el orden que el usuario tiene en pantalla.
+function parametrosDeTabla(tabla) {
+  const params = tabla.ajax.params();
+  delete params.cursor;
+  const datos = {};
+  $.param(params).split('&').forEach(function (par) {
+    const [clave, valor] = par.split('=').map(function (p) { return decodeURIComponent(p.replace(/\+/g, ' ')); });
+    (datos[clave] = datos[clave] || []).push(valor);
+  });
+  return datos;
+}
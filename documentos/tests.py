@@ -1,3 +1,1747 @@
-from django.test import TestCase
+import base64
+import csv
+import json
+import re
+import tempfile
+import threading
+import time
+import unittest
+import zipfile
+from datetime import date, datetime, timedelta
+from io import BytesIO, StringIO
+from pathlib import Path
+from unittest import mock
 
-# Create your tests here.
+from django.conf import settings
+from django import forms
+from django.contrib.auth.models import AnonymousUser, Permission, User
+from django.core.files.uploadedfile import SimpleUploadedFile
+from django.core.cache import cache
+from django.core.management import CommandError, call_command
+from django.core.serializers.json import DjangoJSONEncoder
+from django.db import connection, connections
+from django.db.models import F
+from django.db.models.functions import Length
+from django.test import TestCase, TransactionTestCase, override_settings
+from django.test.utils import CaptureQueriesContext
+from django.test import RequestFactory
+from django.urls import reverse
+from django.utils import timezone
+from django.utils.timezone import now
+from guardian.shortcuts import assign_perm
+import openpyxl
+
+from . import busqueda, cache_fuid, cache_respuestas, conteos, oficinas, permisos_serie, reservas, trabajos, views
+from .permisos import permisos_de
+from .asignacion import asignar_registros
+from .datatables import (
+    Columna, ColumnaFecha, TablaDataTables, codificar_cursor, parsear_booleano, parsear_fecha_parcial,
+    parsear_rango_fechas, respuesta_json,
+)
+from .exportacion import FORMATOS as FORMATOS_EXPORTACION
+from .exportacion_fuid import escribir_fuid
+from .forms import RegistroDeArchivoForm, RegistrosPorIdField, registros_seleccionables
+from .importacion import ArchivoInvalido, filas_archivo, importar_registros
+from .management.commands import medir_serializacion_registros
+from .models import (
+    FUID, EntidadProductora, FichaPaciente, IndiceBusquedaRegistro, OficinaProductora, PerfilUsuario, PermisoUsuarioSerie, RegistroDeArchivo,
+    ReservaRegistro, SerieDocumental, SubserieDocumental, TrabajoExportacion, UnidadAdministrativa,
+)
+
+CACHE_LOCAL = {'default': {'BACKEND': 'django.core.cache.backends.locmem.LocMemCache'}}
+
+# Tablas que crecen con el uso; sobre ellas no se admiten recorridos completos
+TABLAS_GRANDES = (
+    RegistroDeArchivo._meta.db_table,
+    FichaPaciente._meta.db_table,
+    RegistroDeArchivo.fuids.through._meta.db_table,
+    FUID._meta.db_table,
+)
+
+
+def planes_con_recorrido_completo(consultas):
+    """
+    Ejecuta EXPLAIN QUERY PLAN (SQLite) sobre cada SELECT capturado y devuelve
+    los pasos que recorren completa una tabla grande.
+
+    Un ``SCAN tabla`` sin índice se acepta sólo si la consulta es una página
+    (LIMIT) y no ordena en memoria: es el recorrido de la clave primaria en
+    orden, que se detiene al completar la página.
+    """
+    problemas = []
+    with connection.cursor() as cursor:
+        for consulta in consultas:
+            sql = consulta['sql']
+            if not sql.startswith('SELECT') or not any(t in sql for t in TABLAS_GRANDES):
+                continue
+            cursor.execute(f'EXPLAIN QUERY PLAN {sql}')
+            detalles = [detalle for *_, detalle in cursor.fetchall()]
+            pagina_en_orden = ' LIMIT ' in sql and not any('TEMP B-TREE' in d for d in detalles)
+            for detalle in detalles:
+                recorrido = re.match(r'SCAN (\w+)$', detalle)
+                if recorrido and recorrido.group(1) in TABLAS_GRANDES and not pagina_en_orden:
+                    problemas.append(f'{detalle}  <-  {sql}')
+    return problemas
+
+
+def peticion_datatables(columnas=(), busquedas=None, orden=(), **parametros):
+    """GET de DataTables: ``columnas`` por nombre, ``busquedas`` nombre -> texto, ``orden`` [(índice, dir)]."""
+    busquedas = busquedas or {}
+    datos = {}
+    for i, nombre in enumerate(columnas):
+        datos[f'columns[{i}][data]'] = nombre
+        datos[f'columns[{i}][search][value]'] = busquedas.get(nombre, '')
+    for i, (indice, direccion) in enumerate(orden):
+        datos[f'order[{i}][column]'] = indice
+        datos[f'order[{i}][dir]'] = direccion
+    datos.update(parametros)
+    return RequestFactory().get('/', datos)
+
+
+TABLA_PRUEBA = TablaDataTables(
+    RegistroDeArchivo,
+    [
+        Columna('id', buscable=False, ordenable=True),
+        Columna('numero_orden', ordenable=True),
+        Columna('serie', 'codigo_serie__nombre'),
+        Columna('subserie', 'codigo_subserie__nombre', por_defecto=''),
+        Columna('soporte_fisico', lookup='exact', parser=parsear_booleano),
+        Columna('notas', buscable=False),
+        ColumnaFecha('fecha_archivo', ordenable=True),
+    ],
+    orden=('id',),
+    busqueda_global=lambda registros, texto: registros.filter(unidad_documental__icontains=texto),
+)
+
+
+@override_settings(CACHES=CACHE_LOCAL)
+class MotorDataTablesTests(TestCase):
+    """TablaDataTables traduce los parámetros de DataTables en una consulta proyectada."""
+
+    @classmethod
+    def setUpTestData(cls):
+        usuario = User.objects.create_user('autor')
+        historias = SerieDocumental.objects.create(codigo='1', nombre='Historias')
+        contratos = SerieDocumental.objects.create(codigo='2', nombre='Contratos')
+        urgencias = SubserieDocumental.objects.create(codigo='3', nombre='Urgencias', serie=historias)
+
+        def registro(numero, serie, subserie=None, **campos):
+            return RegistroDeArchivo.objects.create(
+                numero_orden=numero, codigo_serie=serie, codigo_subserie=subserie, ubicacion='Estante',
+                creado_por=usuario, **campos,
+            )
+
+        cls.a = registro('A-1', historias, urgencias, unidad_documental='Historia', soporte_fisico=True, notas='x')
+        cls.b = registro('B-2', contratos, unidad_documental='Contrato de aseo')
+        cls.c = registro('C-3', historias, unidad_documental='Historia', soporte_fisico=True)
+
+    def filtrados(self, busquedas=None, **parametros):
+        params = peticion_datatables(TABLA_PRUEBA.columnas_por_nombre, busquedas, **parametros).GET
+        return set(TABLA_PRUEBA.filtrar(RegistroDeArchivo.objects.all(), params))
+
+    def test_filtros_por_columna_y_globales(self):
+        todos = {self.a, self.b, self.c}
+        self.assertEqual(self.filtrados({'numero_orden': 'a-'}), {self.a})
+        self.assertEqual(self.filtrados({'serie': 'histo', 'numero_orden': '3'}), {self.c})
+        self.assertEqual(self.filtrados({'soporte_fisico': 'Sí'}), {self.a, self.c})
+        self.assertEqual(self.filtrados({'soporte_fisico': '✖'}), {self.b})
+        # Texto no reconocido por el parser y columnas no buscables: no se filtra
+        self.assertEqual(self.filtrados({'soporte_fisico': 'quizá'}), todos)
+        self.assertEqual(self.filtrados({'notas': 'x'}), todos)
+        self.assertEqual(self.filtrados({'numero_orden': '   '}), todos)
+        self.assertEqual(self.filtrados(**{'search[value]': 'aseo'}), {self.b})
+        # Columnas que la tabla no declara se ignoran
+        params = peticion_datatables(['inexistente'], {'inexistente': 'x'}).GET
+        self.assertEqual(set(TABLA_PRUEBA.filtrar(RegistroDeArchivo.objects.all(), params)), todos)
+
+    def test_orden_del_servidor(self):
+        columnas = list(TABLA_PRUEBA.columnas_por_nombre)
+
+        def ordenar(*orden):
+            return TABLA_PRUEBA.ordenada(peticion_datatables(columnas, orden=orden).GET)
+
+        self.assertEqual(ordenar((1, 'desc')).orden, ('-numero_orden', '-id'))
+        self.assertEqual(ordenar((6, 'asc'), (1, 'desc')).orden, ('fecha_archivo', '-numero_orden', '-id'))
+        # La clave única corta el orden; las columnas no ordenables se ignoran
+        self.assertEqual(ordenar((0, 'desc'), (1, 'asc')).orden, ('-id',))
+        self.assertIs(ordenar((2, 'asc')), TABLA_PRUEBA)
+        self.assertIs(ordenar(('99', 'asc')), TABLA_PRUEBA)
+
+        datos = TABLA_PRUEBA.datos(peticion_datatables(['id', 'numero_orden'], orden=[(1, 'desc')]))
+        self.assertEqual([fila['numero_orden'] for fila in datos['data']], ['C-3', 'B-2', 'A-1'])
+
+    def test_serializa_solo_las_columnas_pedidas(self):
+        datos = TABLA_PRUEBA.datos(peticion_datatables(['subserie'], {'serie': 'histo'}))
+        self.assertEqual((datos['recordsTotal'], datos['recordsFiltered']), (3, 3))
+        # El id viaja siempre; la relación nula se envía con su valor por defecto
+        self.assertEqual(datos['data'], [
+            {'id': self.a.pk, 'subserie': 'Urgencias'},
+            {'id': self.b.pk, 'subserie': ''},
+            {'id': self.c.pk, 'subserie': ''},
+        ])
+        completa = TABLA_PRUEBA.datos(peticion_datatables(length=1, start=2))
+        self.assertEqual(completa['data'], [{
+            'id': self.c.pk, 'numero_orden': 'C-3', 'serie': 'Historias', 'subserie': '',
+            'soporte_fisico': True, 'notas': None, 'fecha_archivo': None,
+        }])
+        # Una sola consulta para la página, con las relaciones por JOIN
+        with CaptureQueriesContext(connection) as consultas:
+            TABLA_PRUEBA.datos(peticion_datatables(['serie', 'subserie'], length=50))
+        paginas = [c['sql'] for c in consultas if 'COUNT' not in c['sql']]
+        self.assertEqual(len(paginas), 1)
+
+    def test_responder(self):
+        respuesta = TABLA_PRUEBA.responder(peticion_datatables(['numero_orden'], draw='7', length=2))
+        cuerpo = json.loads(respuesta.content)
+        self.assertEqual(respuesta['Content-Type'], 'application/json')
+        self.assertEqual(cuerpo['draw'], 7)
+        self.assertEqual(cuerpo['recordsFiltered'], 3)
+        self.assertEqual(len(cuerpo['data']), 2)
+        self.assertNotIn('nextCursor', cuerpo)
+        self.assertEqual(json.loads(TABLA_PRUEBA.responder(peticion_datatables(draw='x')).content)['draw'], 1)
+
+
+@override_settings(CACHES=CACHE_LOCAL)
+class PaginacionCursorTests(TestCase):
+    """Recorrer la tabla con ``cursor`` devuelve cada fila una vez, en el orden pedido."""
+
+    @classmethod
+    def setUpTestData(cls):
+        usuario = User.objects.create_user('autor')
+        serie = SerieDocumental.objects.create(codigo='1', nombre='Historias')
+        # Tres valores de numero_orden con tres registros cada uno: empates en la columna ordenada
+        for i in range(9):
+            RegistroDeArchivo.objects.create(
+                numero_orden=f'N-{i % 3}', codigo_serie=serie, unidad_documental='Unidad', ubicacion='Estante',
+                creado_por=usuario, fecha_archivo=date(2023, 1, 1 + i % 2) if i % 4 else None,
+            )
+
+    def recorrer(self, tabla, orden=(), length=2):
+        """Ids de todas las páginas siguiendo ``nextCursor``."""
+        columnas = list(tabla.columnas_por_nombre)
+        ids, cursor, paginas = [], '', 0
+        while cursor is not None:
+            datos = tabla.datos(peticion_datatables(columnas, orden=orden, cursor=cursor, length=length))
+            self.assertLessEqual(len(datos['data']), length)
+            ids += [fila['id'] for fila in datos['data']]
+            cursor = datos['nextCursor']
+            paginas += 1
+            self.assertLess(paginas, 20)
+        return ids
+
+    def esperados(self, *orden):
+        return list(RegistroDeArchivo.objects.order_by(*orden).values_list('id', flat=True))
+
+    def test_empates_en_la_columna_ordenada(self):
+        self.assertTrue(TABLA_PRUEBA.ordenada(peticion_datatables(['id', 'numero_orden'], orden=[(1, 'asc')]).GET).admite_seek())
+        self.assertEqual(self.recorrer(TABLA_PRUEBA, [(1, 'asc')]), self.esperados('numero_orden', 'id'))
+        self.assertEqual(self.recorrer(TABLA_PRUEBA, [(1, 'desc')]), self.esperados('-numero_orden', '-id'))
+        self.assertEqual(self.recorrer(TABLA_PRUEBA, [(0, 'desc')], length=4), self.esperados('-id'))
+        self.assertEqual(self.recorrer(TABLA_PRUEBA), self.esperados('id'))
+
+    def test_columna_con_nulos_usa_posicion(self):
+        tabla = TABLA_PRUEBA.ordenada(peticion_datatables(list(TABLA_PRUEBA.columnas_por_nombre), orden=[(6, 'desc')]).GET)
+        self.assertFalse(tabla.admite_seek())
+        ids = self.recorrer(TABLA_PRUEBA, [(6, 'desc')])
+        self.assertEqual(ids, self.esperados(F('fecha_archivo').desc(), '-id'))
+
+    def test_columna_anotada_ordenable(self):
+        tabla = TablaDataTables(
+            RegistroDeArchivo,
+            [Columna('id', buscable=False, ordenable=True), Columna('largo', buscable=False, ordenable=True)],
+            orden=('id',), anotaciones={'largo': Length('unidad_documental')},
+        )
+        self.assertFalse(tabla.ordenada(peticion_datatables(['id', 'largo'], orden=[(1, 'asc')]).GET).admite_seek())
+        self.assertEqual(sorted(self.recorrer(tabla, [(1, 'asc')])), self.esperados('id'))
+
+    @override_settings(DATATABLES_LONGITUD_MAXIMA=4)
+    def test_longitud_acotada(self):
+        for length, esperada in ((-1, 4), (10_000, 4), (3, 3), (0, 4), ('', 4), ('x', 4)):
+            with self.subTest(length=length):
+                datos = TABLA_PRUEBA.datos(peticion_datatables(['id'], cursor='', length=length))
+                self.assertEqual(len(datos['data']), esperada)
+                self.assertIsNotNone(datos['nextCursor'])
+
+    def test_cursor_malformado(self):
+        columnas = list(TABLA_PRUEBA.columnas_por_nombre)
+        casos = [
+            ('basura', []),
+            ('!!!', []),
+            (base64.urlsafe_b64encode(b'no es json').decode(), []),
+            (codificar_cursor([1, 2]), []),  # la clave por defecto tiene un solo campo
+            (codificar_cursor(['uno']), []),
+            (codificar_cursor(['N-1', 'x']), [(1, 'asc')]),
+            (codificar_cursor([1]), [(6, 'asc')]),  # orden por posición con un cursor por clave
+        ]
+        for cursor, orden in casos:
+            with self.subTest(cursor=cursor, orden=orden):
+                respuesta = TABLA_PRUEBA.responder(peticion_datatables(columnas, orden=orden, cursor=cursor))
+                self.assertEqual(respuesta.status_code, 400)
+                self.assertIn('Cursor inválido', json.loads(respuesta.content)['error'])
+
+
+class FechasParcialesTests(TestCase):
+    """Los filtros de fecha aceptan fechas parciales y rangos, y se traducen en intervalos semiabiertos."""
+
+    def test_fechas_parciales(self):
+        casos = {
+            '2023': (date(2023, 1, 1), date(2024, 1, 1)),
+            '2023-05': (date(2023, 5, 1), date(2023, 6, 1)),
+            '2023/5': (date(2023, 5, 1), date(2023, 6, 1)),
+            '2023-12': (date(2023, 12, 1), date(2024, 1, 1)),
+            '2023-05-14': (date(2023, 5, 14), date(2023, 5, 15)),
+            '2023-12-31': (date(2023, 12, 31), date(2024, 1, 1)),
+            ' 2024-02-29 ': (date(2024, 2, 29), date(2024, 3, 1)),
+            '14/05/2023': (date(2023, 5, 14), date(2023, 5, 15)),
+            '14-5-2023': (date(2023, 5, 14), date(2023, 5, 15)),
+            '05/2023': (date(2023, 5, 1), date(2023, 6, 1)),
+        }
+        for texto, esperado in casos.items():
+            with self.subTest(texto=texto):
+                self.assertEqual(parsear_fecha_parcial(texto), esperado)
+
+    def test_fechas_invalidas(self):
+        for texto in ('', 'abc', '23', '2023-13', '2023-00', '2023-02-30', '2023-02-29', '31/02/2023',
+                      '2023-05-14-01', '0000', '13/2023', '2023-5-14 10:00'):
+            with self.subTest(texto=texto):
+                self.assertIsNone(parsear_fecha_parcial(texto))
+                self.assertIsNone(parsear_rango_fechas(texto))
+
+    def test_rangos(self):
+        self.assertEqual(parsear_rango_fechas('2023-01..2023-06'), (date(2023, 1, 1), date(2023, 7, 1)))
+        self.assertEqual(parsear_rango_fechas('01/03/2023 .. 2023'), (date(2023, 3, 1), date(2024, 1, 1)))
+        self.assertEqual(parsear_rango_fechas('2023..'), (date(2023, 1, 1), None))
+        self.assertEqual(parsear_rango_fechas('..2023-05'), (None, date(2023, 6, 1)))
+        for texto in ('..', ' .. ', '2023..abc', 'abc..2023', '2023..2024-13'):
+            with self.subTest(texto=texto):
+                self.assertIsNone(parsear_rango_fechas(texto))
+
+    def test_filtro_por_rango_sobre_la_columna(self):
+        usuario = User.objects.create_user('autor')
+        serie = SerieDocumental.objects.create(codigo='1', nombre='Historias')
+        registros = {}
+        for dia in (date(2022, 12, 31), date(2023, 5, 31), date(2023, 6, 1)):
+            registros[dia] = RegistroDeArchivo.objects.create(
+                numero_orden='REG', codigo_serie=serie, unidad_documental='Unidad', ubicacion='Estante',
+                creado_por=usuario, fecha_archivo=dia,
+            )
+        # fecha_creacion es DateTimeField: los límites son la medianoche de la zona horaria local
+        hora_local = timezone.make_aware(datetime(2023, 5, 31, 23, 30))
+        RegistroDeArchivo.objects.filter(pk=registros[date(2023, 5, 31)].pk).update(fecha_creacion=hora_local)
+        RegistroDeArchivo.objects.exclude(pk=registros[date(2023, 5, 31)].pk).update(
+            fecha_creacion=hora_local + timedelta(hours=1),
+        )
+
+        def filtrados(columna, texto):
+            return {r.fecha_archivo for r in columna.filtrar(RegistroDeArchivo.objects.all(), texto)}
+
+        fecha_archivo = ColumnaFecha('fecha_archivo')
+        self.assertEqual(filtrados(fecha_archivo, '2023-05'), {date(2023, 5, 31)})
+        self.assertEqual(filtrados(fecha_archivo, '2023-05..2023-06'), {date(2023, 5, 31), date(2023, 6, 1)})
+        self.assertEqual(filtrados(fecha_archivo, '..2022'), {date(2022, 12, 31)})
+        self.assertEqual(filtrados(fecha_archivo, 'mayo'), set(registros))
+
+        fecha_creacion = ColumnaFecha('fecha_creacion', con_hora=True)
+        self.assertEqual(filtrados(fecha_creacion, '31/05/2023'), {date(2023, 5, 31)})
+        self.assertEqual(filtrados(fecha_creacion, '2023-06'), {date(2022, 12, 31), date(2023, 6, 1)})
+
+        # Comparaciones sobre la columna (usan su índice), no LIKE sobre la fecha convertida a texto
+        sql = str(fecha_archivo.filtrar(RegistroDeArchivo.objects.all(), '2023').query)
+        self.assertNotIn('LIKE', sql.upper())
+        self.assertRegex(sql, r'fecha_archivo\W* >= 2023-01-01 AND .*fecha_archivo\W* < 2024-01-01')
+
+
+@unittest.skipUnless(connection.vendor == 'sqlite', "EXPLAIN QUERY PLAN de SQLite")
+@override_settings(CACHES=CACHE_LOCAL)
+class PlanesDeConsultaTests(TestCase):
+    """Las consultas de las APIs de listado deben resolverse con índices."""
+
+    @classmethod
+    def setUpTestData(cls):
+        cls.usuario = User.objects.create_superuser('admin', 'admin@example.com', 'clave')
+        serie = SerieDocumental.objects.create(codigo='1', nombre='Historias')
+        subserie = SubserieDocumental.objects.create(codigo='2', nombre='Clínicas', serie=serie)
+        for i in range(30):
+            RegistroDeArchivo.objects.create(
+                numero_orden=f'REG-{i:04d}', codigo_serie=serie, codigo_subserie=subserie,
+                unidad_documental=f'Unidad {i}', ubicacion='Estante', creado_por=cls.usuario,
+                soporte_fisico=bool(i % 2), fecha_archivo=date(2020 + i % 4, 1 + i % 12, 1 + i % 28),
+            )
+            FichaPaciente.objects.create(
+                primer_nombre=f'Nombre {i}', primer_apellido='Apellido', num_identificacion=str(1000 + i),
+                fecha_nacimiento=date(1990, 1 + i % 12, 1), Numero_historia_clinica=f'HC-{i}',
+                caja='1', carpeta='1',
+            )
+        for registro in RegistroDeArchivo.objects.all()[:10]:
+            FUID.objects.create(creado_por=cls.usuario).registros.add(registro)
+
+    def setUp(self):
+        cache.clear()
+        self.client.force_login(self.usuario)
+
+    def assertSinRecorridos(self, url, params=None):
+        with CaptureQueriesContext(connection) as consultas:
+            respuesta = self.client.get(url, params or {})
+        self.assertEqual(respuesta.status_code, 200)
+        self.assertEqual(planes_con_recorrido_completo(consultas.captured_queries), [])
+
+    def test_apis_de_registros(self):
+        for nombre in ('registros_api', 'registros_api_completo', 'registros_api_con_id'):
+            for params in (
+                {'start': 0, 'length': 10},
+                {'cursor': '', 'length': 10},
+                {'start': 0, 'length': 10, 'columns[0][data]': 'fecha_archivo',
+                 'columns[0][search][value]': '2021'},
+                {'start': 0, 'length': 10, 'search[value]': 'unidad'},
+            ):
+                with self.subTest(api=nombre, params=params):
+                    self.assertSinRecorridos(reverse(nombre), params)
+
+    def test_orden_de_registros(self):
+        columnas = ['id', 'numero_orden', 'fecha_archivo', 'fecha_inicial', 'fecha_final', 'fecha_creacion']
+        params = {f'columns[{i}][data]': nombre for i, nombre in enumerate(columnas)}
+        for i, nombre in enumerate(columnas):
+            for direccion in ('asc', 'desc'):
+                for paginacion in ({'start': 10}, {'cursor': ''}):
+                    with self.subTest(columna=nombre, direccion=direccion, paginacion=paginacion):
+                        self.assertSinRecorridos(reverse('registros_api_con_id'), {
+                            **params, **paginacion, 'length': 10,
+                            'order[0][column]': i, 'order[0][dir]': direccion,
+                        })
+
+    def test_api_de_fuids(self):
+        columnas = ['id', 'unidad_administrativa', 'oficina_productora', 'objeto',
+                    'fecha_creacion', 'creado_por', 'total_registros']
+        params = {f'columns[{i}][data]': nombre for i, nombre in enumerate(columnas)}
+        for extra in (
+            {'start': 0},
+            {'cursor': '', 'order[0][column]': 4, 'order[0][dir]': 'desc'},
+            {'start': 0, 'columns[4][search][value]': '2024..'},
+        ):
+            with self.subTest(params=extra):
+                self.assertSinRecorridos(reverse('fuids_api'), {**params, **extra, 'length': 5})
+
+    def test_filtro_de_soporte(self):
+        self.assertSinRecorridos(reverse('registros_api_completo'), {
+            'start': 0, 'length': 10,
+            'columns[0][data]': 'soporte_fisico', 'columns[0][search][value]': 'true',
+        })
+
+    def test_formulario_de_fuid(self):
+        self.assertSinRecorridos(reverse('crear_fuid'), {'fecha_inicio': '2020-01-01', 'fecha_fin': '2030-01-01'})
+
+    def test_orden_de_fichas(self):
+        for columna in range(8):
+            for direccion in ('asc', 'desc'):
+                with self.subTest(columna=columna, direccion=direccion):
+                    self.assertSinRecorridos(reverse('api_lista_fichas'), {
+                        'start': 0, 'length': 10,
+                        'order[0][column]': columna, 'order[0][dir]': direccion,
+                    })
+
+
+@override_settings(CACHES=CACHE_LOCAL)
+class BusquedaTests(TestCase):
+    """El índice de texto completo sigue a los registros y busca por prefijo de palabra."""
+
+    @classmethod
+    def setUpTestData(cls):
+        cls.usuario = User.objects.create_superuser('admin', 'admin@example.com', 'clave')
+        cls.serie = SerieDocumental.objects.create(codigo='1', nombre='Historias clínicas')
+        cls.subserie = SubserieDocumental.objects.create(codigo='2', nombre='Urgencias', serie=cls.serie)
+        cls.historia = RegistroDeArchivo.objects.create(
+            numero_orden='00123', codigo_serie=cls.serie, codigo_subserie=cls.subserie,
+            unidad_documental='Historia de Pérez', ubicacion='Estante 4', caja='C-7', creado_por=cls.usuario,
+        )
+        cls.contrato = RegistroDeArchivo.objects.create(
+            numero_orden='HC-2023-01', codigo_serie=SerieDocumental.objects.create(codigo='3', nombre='Contratos'),
+            unidad_documental='Contrato de aseo', ubicacion='Bodega', notas='Renovado', creado_por=cls.usuario,
+        )
+
+    def setUp(self):
+        if busqueda.motor() is None:
+            self.skipTest("La base de datos no tiene índice de texto completo")
+
+    def encontrados(self, texto, columna=None):
+        return set(busqueda.buscar(RegistroDeArchivo.objects.all(), texto, columna).values_list('pk', flat=True))
+
+    def test_indice_sigue_a_los_registros(self):
+        fila = IndiceBusquedaRegistro.objects.get(registro=self.historia)
+        self.assertEqual((fila.serie, fila.subserie, fila.caja), ('Historias clínicas', 'Urgencias', 'C-7'))
+
+        self.historia.notas = 'Traslado pendiente'
+        self.historia.save()
+        self.assertEqual(self.encontrados('traslado'), {self.historia.pk})
+        self.serie.nombre = 'Expedientes'
+        self.serie.save()
+        self.assertEqual(self.encontrados('expedien'), {self.historia.pk})
+        self.assertEqual(self.encontrados('historias'), set())
+
+        self.contrato.delete()
+        self.assertFalse(IndiceBusquedaRegistro.objects.filter(registro_id=self.contrato.pk).exists())
+        self.assertEqual(self.encontrados('aseo'), set())
+
+    def test_guardar_sin_cambios_indexados_no_toca_el_indice(self):
+        registro = RegistroDeArchivo.objects.get(pk=self.historia.pk)
+        registro.numero_folios = 40
+        with CaptureQueriesContext(connection) as consultas:
+            registro.save()
+        self.assertFalse([c for c in consultas if IndiceBusquedaRegistro._meta.db_table in c['sql']])
+
+        # Cambiar la subserie sí reindexa
+        registro.codigo_subserie = None
+        registro.save()
+        self.assertEqual(IndiceBusquedaRegistro.objects.get(registro=registro).subserie, '')
+
+    def test_busqueda_por_prefijo_de_palabra(self):
+        self.assertEqual(self.encontrados('hist'), {self.historia.pk})
+        self.assertEqual(self.encontrados('perez estante'), {self.historia.pk})
+        self.assertEqual(self.encontrados('2023'), {self.contrato.pk})
+        self.assertEqual(self.encontrados('00123'), {self.historia.pk})
+        # A diferencia de icontains, no encuentra subcadenas en medio de una palabra
+        self.assertEqual(self.encontrados('123'), set())
+        self.assertEqual(self.encontrados('hist', 'numero_orden'), set())
+        self.assertEqual(self.encontrados('urgencias', 'subserie'), {self.historia.pk})
+        self.assertEqual(self.encontrados('  -  '), {self.historia.pk, self.contrato.pk})
+
+    def test_sin_indice_busca_subcadenas(self):
+        with mock.patch.dict(busqueda._motores, {'default': None}):
+            self.assertEqual(self.encontrados('123'), {self.historia.pk})
+            self.assertEqual(self.encontrados('aseo', 'unidad_documental'), {self.contrato.pk})
+
+    def test_busqueda_del_admin(self):
+        self.client.force_login(self.usuario)
+        respuesta = self.client.get(reverse('admin:documentos_registrodearchivo_changelist'), {'q': 'contra'})
+        self.assertEqual(respuesta.status_code, 200)
+        self.assertEqual(list(respuesta.context['cl'].result_list), [self.contrato])
+
+    def test_reconstruir_indice(self):
+        IndiceBusquedaRegistro.objects.all().delete()
+        self.assertEqual(self.encontrados('hist'), set())
+        salida = StringIO()
+        call_command('reconstruir_indice_busqueda', stdout=salida)
+        self.assertIn('2 registros', salida.getvalue())
+        self.assertEqual(IndiceBusquedaRegistro.objects.count(), 2)
+        self.assertEqual(self.encontrados('hist'), {self.historia.pk})
+
+    def test_indexar_registros_sin_una_consulta_por_registro(self):
+        for i in range(5):
+            RegistroDeArchivo.objects.create(
+                numero_orden=f'N-{i}', codigo_serie=self.serie, codigo_subserie=self.subserie,
+                unidad_documental='Unidad', ubicacion='Estante', creado_por=self.usuario,
+            )
+        IndiceBusquedaRegistro.objects.all().delete()
+        # Una consulta con sus series y subseries y un INSERT
+        with self.assertNumQueries(2):
+            busqueda.indexar_registros(RegistroDeArchivo.objects.all())
+        IndiceBusquedaRegistro.objects.all().delete()
+        # Instancias sin las relaciones cargadas: una consulta por modelo relacionado
+        registros = list(RegistroDeArchivo.objects.all())
+        with self.assertNumQueries(3):
+            busqueda.indexar_registros(registros)
+        self.assertEqual(IndiceBusquedaRegistro.objects.get(registro__numero_orden='N-3').subserie, 'Urgencias')
+
+
+@override_settings(CACHES=CACHE_LOCAL)
+class PaginasDeRegistrosTests(TestCase):
+    """Las páginas de registros sólo cargan su primera página, sea cual sea el tamaño de la tabla."""
+
+    @classmethod
+    def setUpTestData(cls):
+        cls.usuario = User.objects.create_superuser('admin', 'admin@example.com', 'clave')
+        cls.serie = SerieDocumental.objects.create(codigo='1', nombre='Historias')
+        cls.subserie = SubserieDocumental.objects.create(codigo='2', nombre='Clínicas', serie=cls.serie)
+
+    def setUp(self):
+        self.client.force_login(self.usuario)
+
+    def crear_registros(self, cantidad):
+        for _ in range(cantidad):
+            RegistroDeArchivo.objects.create(
+                numero_orden='REG', codigo_serie=self.serie, codigo_subserie=self.subserie,
+                unidad_documental='Unidad', ubicacion='Estante', creado_por=self.usuario,
+            )
+
+    def consultas(self, url):
+        cache.clear()
+        with CaptureQueriesContext(connection) as consultas:
+            respuesta = self.client.get(url)
+        self.assertEqual(respuesta.status_code, 200)
+        return len(consultas)
+
+    def test_presupuesto_de_consultas_constante(self):
+        for nombre in ('lista_registros', 'lista_completa_registros'):
+            with self.subTest(pagina=nombre):
+                url = reverse(nombre)
+                self.crear_registros(5)
+                con_pocos = self.consultas(url)
+                self.crear_registros(45)
+                self.assertEqual(self.consultas(url), con_pocos)
+                # sesión, usuario, dos conteos y la página
+                self.assertLessEqual(con_pocos, 5)
+
+    def test_primera_pagina_incrustada(self):
+        self.crear_registros(25)
+        respuesta = self.client.get(reverse('lista_completa_registros'))
+        primera = respuesta.context['primera_pagina']
+        self.assertEqual(len(primera['data']), 20)
+        self.assertEqual(primera['recordsTotal'], 25)
+        self.assertIsNotNone(primera['nextCursor'])
+        self.assertContains(respuesta, 'id="primera-pagina-registros"')
+
+
+class SerializacionRegistrosTests(TestCase):
+    """La ruta values_list de las tablas produce las mismas filas que la serialización por instancias."""
+
+    @classmethod
+    def setUpTestData(cls):
+        usuario = User.objects.create_user('archivista')
+        serie = SerieDocumental.objects.create(codigo='1', nombre='Historias')
+        subserie = SubserieDocumental.objects.create(codigo='2', nombre='Clínicas', serie=serie)
+        RegistroDeArchivo.objects.create(
+            numero_orden='REG-1', codigo_serie=serie, codigo_subserie=subserie, unidad_documental='Unidad',
+            ubicacion='Estante', creado_por=usuario, fecha_archivo=date(2024, 2, 29),
+            fecha_inicial=date(2023, 1, 1), fecha_final=date(2023, 12, 31), soporte_fisico=True,
+            numero_folios=12, notas='Con "comillas" y tildes: Clínica',
+        )
+        # Sin subserie ni creador (la serie es obligatoria en la tabla), con fechas vacías
+        RegistroDeArchivo.objects.create(
+            numero_orden='REG-2', codigo_serie=serie, unidad_documental='Huérfano', ubicacion='N/A',
+        )
+        RegistroDeArchivo.objects.filter(numero_orden='REG-2').update(fecha_archivo=None)
+        # Microsegundos en la fecha de creación
+        RegistroDeArchivo.objects.filter(numero_orden='REG-1').update(
+            fecha_creacion=datetime(2024, 5, 6, 7, 8, 9, 123456, tzinfo=timezone.get_current_timezone()),
+        )
+
+    def test_mismas_filas_que_las_instancias(self):
+        tabla = views.TABLA_REGISTROS_CON_ID
+        instancias = RegistroDeArchivo.objects.order_by('fecha_creacion', 'id')
+        antes = json.loads(json.dumps([medir_serializacion_registros.fila_instancia(r) for r in instancias],
+                                      cls=DjangoJSONEncoder))
+        with self.assertNumQueries(1):
+            filas = [tabla.serializar(fila) for fila in tabla.proyectar(RegistroDeArchivo.objects.all())]
+        ahora = json.loads(respuesta_json(filas).content)
+        self.assertEqual(len(ahora), 2)
+        self.assertEqual(ahora, antes)
+        huerfano = next(fila for fila in ahora if fila['numero_orden'] == 'REG-2')
+        self.assertEqual(
+            (huerfano['codigo_subserie'], huerfano['creado_por'], huerfano['fecha_archivo'], huerfano['fecha_final']),
+            ('', '', None, None),
+        )
+
+    def test_consultas_acotadas(self):
+        # Una página es una consulta, tenga las filas que tenga
+        tabla = views.TABLA_REGISTROS_CON_ID
+        with self.assertNumQueries(1):
+            [tabla.serializar(fila) for fila in tabla.proyectar(RegistroDeArchivo.objects.all())[:50]]
+        instancias = RegistroDeArchivo.objects.order_by('fecha_creacion', 'id')
+        with CaptureQueriesContext(connection) as consultas:
+            [medir_serializacion_registros.fila_instancia(r) for r in instancias]
+        self.assertGreater(len(consultas), 1)
+
+
+@override_settings(CACHES=CACHE_LOCAL)
+class GeneracionesTests(TestCase):
+    """Lo cacheado bajo una generación no vuelve a ser válido aunque la caché desaloje su clave."""
+
+    @classmethod
+    def setUpTestData(cls):
+        cls.usuario = User.objects.create_user('autor')
+        cls.serie = SerieDocumental.objects.create(codigo='1', nombre='Historias')
+
+    def setUp(self):
+        cache.clear()
+
+    def crear_registro(self):
+        return RegistroDeArchivo.objects.create(
+            numero_orden='REG', codigo_serie=self.serie, unidad_documental='Unidad', ubicacion='Estante',
+            creado_por=self.usuario,
+        )
+
+    def test_invalidar_renueva_la_generacion(self):
+        vistas = {conteos.generacion(RegistroDeArchivo)}
+        for _ in range(5):
+            conteos.invalidar(RegistroDeArchivo)
+            vistas.add(conteos.generacion(RegistroDeArchivo))
+        self.assertEqual(len(vistas), 6)
+        self.assertEqual(conteos.generaciones(RegistroDeArchivo), [conteos.generacion(RegistroDeArchivo)])
+
+    def test_desalojo_no_revive_conteos_viejos(self):
+        clave = conteos._clave_generacion(RegistroDeArchivo)
+        self.crear_registro()
+        primera = conteos.generacion(RegistroDeArchivo)
+        self.assertEqual(conteos.contar_total(RegistroDeArchivo).valor, 1)
+
+        self.crear_registro()
+        segunda = conteos.generacion(RegistroDeArchivo)
+        self.assertEqual(conteos.contar_total(RegistroDeArchivo).valor, 2)
+
+        # La caché desaloja la generación y vuelve a crearse (también tras otra escritura)
+        cache.delete(clave)
+        self.assertNotIn(conteos.generacion(RegistroDeArchivo), (primera, segunda))
+        self.assertEqual(conteos.contar_total(RegistroDeArchivo).valor, 2)
+        cache.delete(clave)
+        self.crear_registro()
+        self.assertNotIn(conteos.generacion(RegistroDeArchivo), (primera, segunda))
+        self.assertEqual(conteos.contar_total(RegistroDeArchivo).valor, 3)
+        filtrados = RegistroDeArchivo.objects.filter(numero_orden='REG')
+        self.assertEqual(conteos.contar(filtrados).valor, 3)
+
+
+@override_settings(CACHES=CACHE_LOCAL, RESPUESTAS_CACHE_ESPERA=2)
+class CacheRespuestasTests(TestCase):
+    """Las peticiones iguales se calculan una vez; las distintas no se esperan entre sí."""
+
+    @classmethod
+    def setUpTestData(cls):
+        cls.usuario = User.objects.create_user('archivista')
+
+    def setUp(self):
+        cache.clear()
+        cache_respuestas._metricas.update(pid=None, ambitos={}, publicar_en=0.0)
+
+    def peticion(self, **parametros):
+        peticion = RequestFactory().get('/registros/api/', parametros)
+        peticion.user = self.usuario
+        return peticion
+
+    def test_peticiones_simultaneas_se_calculan_una_vez(self):
+        llamadas, empezo, seguir = [], threading.Event(), threading.Event()
+
+        def calcular():
+            llamadas.append(1)
+            empezo.set()
+            seguir.wait(5)
+            return {'data': [1, 2]}
+
+        resultados = []
+        hilos = [
+            threading.Thread(target=lambda: resultados.append(
+                cache_respuestas.obtener(self.peticion(start=0), [RegistroDeArchivo], calcular)))
+            for _ in range(3)
+        ]
+        hilos[0].start()
+        self.assertTrue(empezo.wait(5))
+        for hilo in hilos[1:]:
+            hilo.start()
+        time.sleep(0.1)
+        seguir.set()
+        for hilo in hilos:
+            hilo.join(5)
+
+        self.assertEqual(len(llamadas), 1)
+        self.assertEqual(resultados, [{'data': [1, 2]}] * 3)
+        self.assertEqual(cache_respuestas.metricas()['/registros/api/'], {
+            'aciertos': 0, 'coalescidas': 2, 'fallos': 1, 'tasa_aciertos': 0.6667,
+        })
+
+    def test_claves_distintas_no_se_bloquean(self):
+        empezo, seguir = threading.Event(), threading.Event()
+
+        def lento():
+            empezo.set()
+            seguir.wait(5)
+            return {'data': 'lento'}
+
+        hilo = threading.Thread(target=cache_respuestas.obtener, args=(self.peticion(start=0), [RegistroDeArchivo], lento))
+        hilo.start()
+        self.assertTrue(empezo.wait(5))
+        try:
+            inicio = time.monotonic()
+            for pagina in range(1, 70):
+                datos = cache_respuestas.obtener(self.peticion(start=pagina), [RegistroDeArchivo], lambda: {'data': 'otra'})
+                self.assertEqual(datos, {'data': 'otra'})
+            self.assertLess(time.monotonic() - inicio, 1)
+        finally:
+            seguir.set()
+            hilo.join(5)
+
+    def test_candado_de_otro_proceso(self):
+        peticion = self.peticion(start=0)
+        candado = f'{cache_respuestas.clave_respuesta(peticion, [RegistroDeArchivo])}:calculando'
+        cache.add(candado, 'otro proceso', 60)
+        with override_settings(RESPUESTAS_CACHE_ESPERA=0.2):
+            datos = cache_respuestas.obtener(peticion, [RegistroDeArchivo], lambda: {'data': 'propio'})
+        # Tras la espera se calcula igual, pero el candado ajeno no se toca
+        self.assertEqual(datos, {'data': 'propio'})
+        self.assertEqual(cache.get(candado), 'otro proceso')
+
+        # El candado propio sí se libera al terminar
+        otra = self.peticion(start=20)
+        cache_respuestas.obtener(otra, [RegistroDeArchivo], lambda: {'data': []})
+        self.assertIsNone(cache.get(f'{cache_respuestas.clave_respuesta(otra, [RegistroDeArchivo])}:calculando'))
+
+    def test_escrituras_y_permisos_invalidan(self):
+        llamadas = []
+
+        def calcular():
+            llamadas.append(1)
+            return {'data': len(llamadas)}
+
+        def obtener():
+            return cache_respuestas.obtener(self.peticion(start=0, draw=len(llamadas)), [RegistroDeArchivo], calcular)
+
+        self.assertEqual(obtener(), {'data': 1})
+        self.assertEqual(obtener(), {'data': 1})
+        conteos.invalidar(RegistroDeArchivo)
+        self.assertEqual(obtener(), {'data': 2})
+        conteos.invalidar(FUID)
+        self.assertEqual(obtener(), {'data': 2})
+        self.usuario.user_permissions.add(Permission.objects.get(codename='view_registrodearchivo'))
+        self.assertEqual(obtener(), {'data': 3})
+
+
+@override_settings(CACHES=CACHE_LOCAL)
+class SeleccionDeRegistrosTests(TestCase):
+    """El selector del FUID sólo ofrece y acepta registros libres del usuario."""
+
+    @classmethod
+    def setUpTestData(cls):
+        cls.usuario = User.objects.create_user('archivista')
+        cls.otro = User.objects.create_user('otro')
+        serie = SerieDocumental.objects.create(codigo='1', nombre='Historias')
+
+        def registro(numero, autor):
+            return RegistroDeArchivo.objects.create(
+                numero_orden=numero, codigo_serie=serie, unidad_documental='Unidad', ubicacion='Estante',
+                creado_por=autor,
+            )
+
+        cls.libre = registro('L-1', cls.usuario)
+        cls.en_fuid = registro('L-2', cls.usuario)
+        cls.reservado = registro('L-3', cls.usuario)
+        cls.ajeno = registro('O-1', cls.otro)
+        cls.fuid = FUID.objects.create(creado_por=cls.usuario)
+        cls.fuid.registros.add(cls.en_fuid)
+
+    def setUp(self):
+        cache.clear()
+        self.client.force_login(self.usuario)
+
+    def campo(self):
+        return RegistrosPorIdField(required=False, queryset=registros_seleccionables(usuario=self.usuario))
+
+    def test_ids_mal_formados(self):
+        for valor in (['1', 'x'], ['1.5'], [None]):
+            with self.subTest(valor=valor):
+                with self.assertRaises(forms.ValidationError) as error:
+                    self.campo().clean(valor)
+                self.assertEqual(error.exception.code, 'invalido')
+
+    def test_ids_validos_sin_repetidos(self):
+        self.assertEqual(self.campo().clean([str(self.libre.pk), str(self.libre.pk)]), [self.libre.pk])
+        self.assertEqual(self.campo().clean([]), [])
+
+    def test_ids_fuera_del_alcance(self):
+        # De otro usuario, ya en un FUID o inexistentes
+        for pk in (self.ajeno.pk, self.en_fuid.pk, 999999):
+            with self.subTest(pk=pk):
+                with self.assertRaises(forms.ValidationError) as error:
+                    self.campo().clean([str(self.libre.pk), str(pk)])
+                self.assertEqual(error.exception.code, 'no_disponibles')
+                self.assertIn(str(pk), error.exception.messages[0])
+                self.assertNotIn(str(self.libre.pk), error.exception.messages[0])
+
+    def ids_disponibles(self, **parametros):
+        respuesta = self.client.get(reverse('registros_disponibles_api'), {
+            'start': 0, 'length': 50, 'columns[0][data]': 'id', **parametros,
+        })
+        self.assertEqual(respuesta.status_code, 200)
+        return {fila['id'] for fila in respuesta.json()['data']}
+
+    def test_api_solo_registros_disponibles(self):
+        reservas.reservar(self.otro, [self.reservado.pk])
+        # Al crear: sólo los libres del usuario, sin los reservados por otro
+        self.assertEqual(self.ids_disponibles(), {self.libre.pk})
+        # Al editar: los libres de cualquier creador y los que ya tiene el FUID
+        self.assertEqual(
+            self.ids_disponibles(fuid=self.fuid.pk), {self.libre.pk, self.en_fuid.pk, self.ajeno.pk},
+        )
+
+    def test_api_fuid_inexistente(self):
+        respuesta = self.client.get(reverse('registros_disponibles_api'), {'fuid': 999999})
+        self.assertEqual(respuesta.status_code, 404)
+
+
+@override_settings(CACHES=CACHE_LOCAL)
+class AsignacionMasivaTests(TestCase):
+    """La asignación por filtro inserta en una sola sentencia y omite los registros ya asignados."""
+
+    @classmethod
+    def setUpTestData(cls):
+        cls.usuario = User.objects.create_superuser('admin', 'admin@example.com', 'clave')
+        serie = SerieDocumental.objects.create(codigo='1', nombre='Historias')
+        for i in range(10):
+            RegistroDeArchivo.objects.create(
+                numero_orden=f'REG-{i}', codigo_serie=serie, unidad_documental='Unidad',
+                ubicacion='Estante', creado_por=cls.usuario, caja=str(i % 2),
+            )
+
+    def setUp(self):
+        self.client.force_login(self.usuario)
+
+    def test_asigna_solo_registros_libres(self):
+        otro = FUID.objects.create(creado_por=self.usuario)
+        otro.registros.add(RegistroDeArchivo.objects.filter(caja='0').first())
+        fuid = FUID.objects.create(creado_por=self.usuario)
+        url = reverse('asignar_registros_fuid', args=[fuid.pk])
+
+        with CaptureQueriesContext(connection) as consultas:
+            respuesta = self.client.post(url, {'caja': '0'})
+        self.assertEqual(respuesta.json(), {'ok': True, 'asignados': 4})
+        self.assertEqual(sum(c['sql'].startswith('INSERT') for c in consultas.captured_queries), 1)
+        self.assertEqual(fuid.registros.count(), 4)
+
+        # Repetir no asigna nada nuevo
+        self.assertEqual(self.client.post(url, {'caja': '0'}).json()['asignados'], 0)
+
+    def test_serie_por_id_aunque_se_repita_el_codigo(self):
+        # El código de la serie no es único: el filtro debe elegir por id
+        repetida = SerieDocumental.objects.create(codigo='1', nombre='Historias (duplicada)')
+        RegistroDeArchivo.objects.create(
+            numero_orden='REG-X', codigo_serie=repetida, unidad_documental='Unidad',
+            ubicacion='Estante', creado_por=self.usuario,
+        )
+        fuid = FUID.objects.create(creado_por=self.usuario)
+        respuesta = self.client.post(reverse('asignar_registros_fuid', args=[fuid.pk]), {'serie': repetida.pk})
+        self.assertEqual(respuesta.json(), {'ok': True, 'asignados': 1})
+        self.assertEqual(list(fuid.registros.values_list('numero_orden', flat=True)), ['REG-X'])
+
+    def test_exige_un_filtro(self):
+        fuid = FUID.objects.create(creado_por=self.usuario)
+        respuesta = self.client.post(reverse('asignar_registros_fuid', args=[fuid.pk]), {})
+        self.assertEqual(respuesta.status_code, 400)
+        self.assertEqual(fuid.registros.count(), 0)
+
+
+@override_settings(CACHES=CACHE_LOCAL)
+class ReservasConcurrentesTests(TransactionTestCase):
+    """Varios usuarios armando FUIDs a la vez nunca obtienen el mismo registro."""
+
+    HILOS = 8
+
+    def setUp(self):
+        self.usuarios = [User.objects.create_user(f'archivista{i}') for i in range(self.HILOS)]
+        serie = SerieDocumental.objects.create(codigo='1', nombre='Historias')
+        RegistroDeArchivo.objects.bulk_create(
+            RegistroDeArchivo(numero_orden=f'REG-{i}', codigo_serie=serie, unidad_documental='Unidad',
+                              ubicacion='Estante', creado_por=self.usuarios[0])
+            for i in range(60)
+        )
+        self.ids = list(RegistroDeArchivo.objects.values_list('pk', flat=True))
+
+    def en_paralelo(self, tarea):
+        """Ejecuta ``tarea(usuario)`` en un hilo por usuario, arrancando todos a la vez."""
+        salida = threading.Barrier(self.HILOS)
+        resultados, errores = {}, []
+
+        def trabajar(usuario):
+            try:
+                salida.wait()
+                resultados[usuario.pk] = tarea(usuario)
+            except Exception as e:  # pragma: no cover - se reporta abajo
+                errores.append(e)
+            finally:
+                connections.close_all()
+
+        hilos = [threading.Thread(target=trabajar, args=(usuario,)) for usuario in self.usuarios]
+        for hilo in hilos:
+            hilo.start()
+        for hilo in hilos:
+            hilo.join()
+        self.assertEqual(errores, [])
+        return resultados
+
+    def test_reservas_sin_duplicados(self):
+        # Todos piden todos los registros; cada uno debe quedar para un solo usuario
+        obtenidos = self.en_paralelo(lambda usuario: reservas.reservar(usuario, self.ids))
+        repartidos = [pk for pks in obtenidos.values() for pk in pks]
+        self.assertEqual(sorted(repartidos), sorted(self.ids))
+        self.assertEqual(ReservaRegistro.objects.count(), len(self.ids))
+        for usuario_id, pks in obtenidos.items():
+            self.assertEqual(
+                set(ReservaRegistro.objects.filter(usuario_id=usuario_id).values_list('registro_id', flat=True)),
+                set(pks),
+            )
+
+    def test_armado_de_fuids_en_paralelo(self):
+        def armar(usuario):
+            pks = reservas.reservar(usuario, self.ids)
+            # Como FUIDCreateView.form_valid
+            with reservas.escritura_exclusiva():
+                fuid = FUID.objects.create(creado_por=usuario)
+                fuid.registros.set(pks)
+                reservas.liberar(usuario, pks)
+            # La asignación masiva tampoco toma registros ajenos
+            return asignar_registros(fuid, reservas.sin_reservas_ajenas(RegistroDeArchivo.objects.all(), usuario))
+
+        self.en_paralelo(armar)
+        intermedia = FUID.registros.through.objects
+        self.assertEqual(intermedia.count(), len(self.ids))
+        self.assertEqual(intermedia.values('registrodearchivo_id').distinct().count(), len(self.ids))
+        self.assertFalse(ReservaRegistro.objects.exists())
+
+
+@override_settings(CACHES=CACHE_LOCAL)
+class PermisosPorPeticionTests(TestCase):
+    """Las comprobaciones de permisos por objeto son de sólo lectura y no crecen con el número de objetos."""
+
+    @classmethod
+    def setUpTestData(cls):
+        cls.usuario = User.objects.create_user('archivista')
+        otro = User.objects.create_user('otro')
+        # FUIDs de otro usuario; al archivista sólo se le comparten cinco
+        cls.fuids = [FUID.objects.create(creado_por=otro) for _ in range(10)]
+        for fuid in cls.fuids[:5]:
+            assign_perm('documentos.view_own_fuid', cls.usuario, fuid)
+
+    def test_detalle_no_escribe_permisos(self):
+        self.client.force_login(self.usuario)
+        url = reverse('detalle_fuid', args=[self.fuids[0].pk])
+        with CaptureQueriesContext(connection) as consultas:
+            respuesta = self.client.get(url)
+        self.assertEqual(respuesta.status_code, 200)
+        escrituras = [c['sql'] for c in consultas.captured_queries if not c['sql'].startswith(('SELECT', 'SAVEPOINT', 'RELEASE'))]
+        self.assertEqual(escrituras, [])
+        self.assertEqual(self.client.get(reverse('detalle_fuid', args=[self.fuids[9].pk])).status_code, 403)
+
+    def test_precarga_y_memoria_por_peticion(self):
+        request = RequestFactory().get('/')
+        request.user = self.usuario
+        permisos = permisos_de(request)
+        self.assertIs(permisos_de(request), permisos)
+        # Permisos del usuario y de sus grupos: dos consultas para toda la lista
+        with self.assertNumQueries(2):
+            permisos.precargar(self.fuids)
+        with self.assertNumQueries(0):
+            visibles = [fuid for fuid in self.fuids if permisos.tiene('documentos.view_own_fuid', fuid)]
+        self.assertEqual(visibles, self.fuids[:5])
+
+    def test_banderas_por_fila_en_la_api(self):
+        for fuid in self.fuids[:3]:
+            assign_perm('documentos.edit_own_fuid', self.usuario, fuid)
+        propio = FUID.objects.create(creado_por=self.usuario)
+        cache.clear()
+        self.client.force_login(self.usuario)
+        with CaptureQueriesContext(connection) as consultas:
+            respuesta = self.client.get(reverse('fuids_api'), {'start': 0, 'length': 50, 'columns[0][data]': 'id'})
+        filas = {fila['id']: fila for fila in respuesta.json()['data']}
+        self.assertEqual({pk for pk, fila in filas.items() if fila['can_edit']}, {f.pk for f in self.fuids[:3]} | {propio.pk})
+        self.assertEqual({pk for pk, fila in filas.items() if fila['can_delete']}, {propio.pk})
+        # Toda la página se resuelve con una consulta de permisos del usuario y otra de sus grupos
+        guardian = [c for c in consultas.captured_queries if 'objectpermission' in c['sql']]
+        self.assertEqual(len(guardian), 2)
+
+
+class PermisosDelCreadorTests(TestCase):
+    """El creador tiene sus permisos propios sin filas de guardian."""
+
+    def test_permisos_implicitos(self):
+        creador, otro = User.objects.create_user('creador'), User.objects.create_user('otro')
+        serie = SerieDocumental.objects.create(codigo='1', nombre='Historias')
+        registro = RegistroDeArchivo.objects.create(
+            numero_orden='REG', codigo_serie=serie, unidad_documental='Unidad', ubicacion='Estante', creado_por=creador,
+        )
+        fuid = FUID.objects.create(creado_por=creador)
+        with self.assertNumQueries(0):
+            self.assertTrue(creador.has_perm('documentos.edit_own_registro', registro))
+            self.assertTrue(creador.has_perm('documentos.delete_own_fuid', fuid))
+        # Eliminar registros no es implícito; tampoco hay permisos sobre objetos ajenos
+        self.assertFalse(creador.has_perm('documentos.delete_own_registro', registro))
+        self.assertFalse(otro.has_perm('documentos.view_own_fuid', fuid))
+        assign_perm('documentos.view_own_fuid', otro, fuid)
+        self.assertTrue(User.objects.get(pk=otro.pk).has_perm('documentos.view_own_fuid', fuid))
+
+
+@override_settings(CACHES=CACHE_LOCAL)
+class PermisosPorSerieTests(TestCase):
+    """Una fila de PermisoUsuarioSerie da acceso a toda la serie, filtrando en SQL."""
+
+    @classmethod
+    def setUpTestData(cls):
+        cls.autor = User.objects.create_user('autor')
+        cls.archivista = User.objects.create_user('archivista')
+        cls.historias = SerieDocumental.objects.create(codigo='1', nombre='Historias')
+        cls.contratos = SerieDocumental.objects.create(codigo='2', nombre='Contratos')
+        for serie in (cls.historias, cls.contratos):
+            for i in range(3):
+                RegistroDeArchivo.objects.create(
+                    numero_orden=f'{serie.codigo}-{i}', codigo_serie=serie, unidad_documental='Unidad',
+                    ubicacion='Estante', creado_por=cls.autor,
+                )
+
+    def setUp(self):
+        cache.clear()
+        self.client.force_login(self.archivista)
+
+    def visibles(self):
+        respuesta = self.client.get(reverse('registros_api_con_id'), {'start': 0, 'length': 50, 'columns[0][data]': 'id'})
+        return {fila['id'] for fila in respuesta.json()['data']}
+
+    def test_sin_filas_no_hay_restriccion(self):
+        self.assertIsNone(permisos_serie.matriz(self.archivista))
+        self.assertEqual(len(self.visibles()), 6)
+
+    def test_filtra_y_concede_por_serie(self):
+        PermisoUsuarioSerie.objects.create(
+            usuario=self.archivista, serie=self.historias, permiso_consultar=True, permiso_editar=True,
+        )
+        historias = set(self.historias.registros.values_list('pk', flat=True))
+        self.assertEqual(self.visibles(), historias)
+
+        archivista = User.objects.get(pk=self.archivista.pk)
+        registro = self.historias.registros.first()
+        self.assertTrue(archivista.has_perm('documentos.edit_own_registro', registro))
+        self.assertFalse(archivista.has_perm('documentos.delete_own_registro', registro))
+        self.assertFalse(archivista.has_perm('documentos.view_own_registro', self.contratos.registros.first()))
+        # La matriz ya está en memoria del proceso: otra petición (otro objeto usuario) no consulta la base
+        otra_peticion = User.objects.get(pk=self.archivista.pk)
+        with self.assertNumQueries(0):
+            self.assertTrue(permisos_serie.permite(otra_peticion, 'consultar', self.historias.pk))
+            self.assertFalse(permisos_serie.permite(otra_peticion, 'crear', self.historias.pk))
+
+        # Un cambio en la tabla invalida la matriz y las respuestas cacheadas
+        PermisoUsuarioSerie.objects.create(usuario=self.archivista, serie=self.contratos)
+        self.assertEqual(len(self.visibles()), 6)
+
+    def test_creador_edita_su_registro_fuera_de_sus_series(self):
+        # Sólo puede editar en Historias, pero el registro de Contratos es suyo (PropietarioBackend)
+        PermisoUsuarioSerie.objects.create(
+            usuario=self.autor, serie=self.historias, permiso_crear=True, permiso_editar=True,
+        )
+        registro = self.contratos.registros.first()
+        registro.codigo_subserie = SubserieDocumental.objects.create(serie=self.contratos, codigo='1', nombre='Obra')
+        registro.save()
+        datos = {campo: valor for campo, valor in forms.models.model_to_dict(registro).items() if valor is not None}
+        datos['notas'] = 'Revisado'
+        form = RegistroDeArchivoForm(datos, instance=registro, usuario=User.objects.get(pk=self.autor.pk))
+        self.assertTrue(form.is_valid(), form.errors)
+        self.assertEqual(set(form.fields['codigo_serie'].queryset), {self.historias, self.contratos})
+
+        # Al crear sólo se ofrecen las series permitidas
+        nuevo = RegistroDeArchivoForm(usuario=User.objects.get(pk=self.autor.pk))
+        self.assertEqual(list(nuevo.fields['codigo_serie'].queryset), [self.historias])
+
+    def test_desalojo_de_la_generacion_no_revive_permisos(self):
+        permiso = PermisoUsuarioSerie.objects.create(
+            usuario=self.archivista, serie=self.historias, permiso_consultar=True, permiso_editar=True,
+        )
+        self.assertEqual(permisos_serie.series_permitidas(User.objects.get(pk=self.archivista.pk), 'editar'),
+                         {self.historias.pk})
+        permiso.permiso_editar = False
+        permiso.save()
+        self.assertEqual(permisos_serie.series_permitidas(User.objects.get(pk=self.archivista.pk), 'editar'), set())
+
+        # La caché pierde la generación y luego hay una escritura ajena al archivista
+        cache.delete(conteos._clave_generacion(PermisoUsuarioSerie))
+        PermisoUsuarioSerie.objects.create(usuario=self.autor, serie=self.contratos)
+        self.assertEqual(permisos_serie.series_permitidas(User.objects.get(pk=self.archivista.pk), 'editar'), set())
+
+    def test_memoria_del_proceso_acotada(self):
+        PermisoUsuarioSerie.objects.create(usuario=self.archivista, serie=self.historias)
+        with mock.patch.object(permisos_serie, 'MAXIMO_EN_MEMORIA', 2), \
+                mock.patch.object(permisos_serie, '_matrices', {}):
+            for usuario in (self.autor, self.archivista, User.objects.create_user('otro')):
+                permisos_serie.matriz(User.objects.get(pk=usuario.pk))
+            self.assertEqual(len(permisos_serie._matrices), 2)
+            self.assertNotIn(self.autor.pk, permisos_serie._matrices)
+
+
+class AlcancePorOficinaTests(TestCase):
+    """Con PerfilUsuario, las listas y APIs sólo devuelven la parte de la oficina del usuario."""
+
+    @classmethod
+    def setUpTestData(cls):
+        unidad = UnidadAdministrativa.objects.create(
+            nombre='Gestión', entidad_productora=EntidadProductora.objects.create(nombre='Hospital'),
+        )
+        cls.archivo = OficinaProductora.objects.create(nombre='Archivo', unidad_administrativa=unidad)
+        cls.farmacia = OficinaProductora.objects.create(nombre='Farmacia', unidad_administrativa=unidad)
+        cls.archivista = User.objects.create_user('archivista')
+        cls.companero = User.objects.create_user('companero')
+        cls.farmaceuta = User.objects.create_user('farmaceuta')
+        PerfilUsuario.objects.create(user=cls.archivista, oficina=cls.archivo)
+        PerfilUsuario.objects.create(user=cls.companero, oficina=cls.archivo)
+        PerfilUsuario.objects.create(user=cls.farmaceuta, oficina=cls.farmacia)
+        serie = SerieDocumental.objects.create(codigo='1', nombre='Historias')
+
+        def registro(numero, autor):
+            return RegistroDeArchivo.objects.create(
+                numero_orden=numero, codigo_serie=serie, unidad_documental='Unidad', ubicacion='Estante',
+                creado_por=autor,
+            )
+
+        cls.del_companero = registro('A-1', cls.companero)
+        cls.de_farmacia = registro('F-1', cls.farmaceuta)
+        # Creado en farmacia pero archivado en un FUID del archivo: también es del archivo
+        cls.transferido = registro('F-2', cls.farmaceuta)
+        cls.fuid_archivo = FUID.objects.create(oficina_productora=cls.archivo, creado_por=cls.companero)
+        cls.fuid_archivo.registros.add(cls.transferido)
+        cls.fuid_farmacia = FUID.objects.create(oficina_productora=cls.farmacia, creado_por=cls.farmaceuta)
+
+    def setUp(self):
+        cache.clear()
+        self.client.force_login(self.archivista)
+
+    def ids(self, url):
+        respuesta = self.client.get(reverse(url), {'start': 0, 'length': 50, 'columns[0][data]': 'id'})
+        self.assertEqual(respuesta.status_code, 200)
+        return {fila['id'] for fila in respuesta.json()['data']}
+
+    def test_listas_y_apis_de_la_oficina(self):
+        self.assertEqual(self.ids('registros_api_con_id'), {self.del_companero.pk, self.transferido.pk})
+        self.assertEqual(self.ids('fuids_api'), {self.fuid_archivo.pk})
+        self.assertEqual(self.client.get(reverse('detalle_fuid', args=[self.fuid_farmacia.pk])).status_code, 404)
+        self.assertEqual(self.client.get(reverse('estadisticas_fuids')).json()['total_fuids'], 1)
+
+    def test_sin_perfil_ni_superusuario_no_hay_restriccion(self):
+        sin_perfil = User.objects.create_user('sin_perfil')
+        self.assertIsNone(oficinas.oficina_de(sin_perfil))
+        self.client.force_login(sin_perfil)
+        self.assertEqual(len(self.ids('registros_api_con_id')), 3)
+        self.assertEqual(len(self.ids('fuids_api')), 2)
+
+    def test_anonimo_no_ve_nada(self):
+        anonimo = AnonymousUser()
+        self.assertFalse(oficinas.filtrar_fuids(FUID.objects.all(), anonimo).exists())
+        self.assertFalse(oficinas.filtrar_registros(RegistroDeArchivo.objects.all(), anonimo).exists())
+        self.client.logout()
+        for url in (
+            reverse('export_fuid_to_excel', args=[self.fuid_archivo.pk]),
+            reverse('estadisticas_fuids'),
+            reverse('estadisticas_pacientes'),
+        ):
+            with self.subTest(url=url):
+                respuesta = self.client.get(url)
+                self.assertEqual(respuesta.status_code, 302)
+                self.assertTrue(respuesta['Location'].startswith(settings.LOGIN_URL))
+        # estadisticas_registros no tiene nombre de URL propio
+        peticion = RequestFactory().get('/registros/estadisticas/registros/')
+        peticion.user = AnonymousUser()
+        self.assertEqual(views.estadisticas_registros(peticion).status_code, 302)
+
+    def test_cambiar_de_oficina_invalida_las_respuestas(self):
+        self.assertEqual(self.ids('fuids_api'), {self.fuid_archivo.pk})
+        PerfilUsuario.objects.filter(user=self.archivista).update(oficina=self.farmacia)
+        PerfilUsuario.objects.get(user=self.archivista).save()  # update() no dispara señales
+        self.assertEqual(self.ids('fuids_api'), {self.fuid_farmacia.pk})
+
+    @unittest.skipUnless(connection.vendor == 'sqlite', "EXPLAIN QUERY PLAN de SQLite")
+    def test_filtros_por_oficina_usan_indices(self):
+        archivista = User.objects.get(pk=self.archivista.pk)
+        with CaptureQueriesContext(connection) as consultas:
+            list(oficinas.filtrar_fuids(FUID.objects.order_by('id'), archivista))
+            list(oficinas.filtrar_registros(RegistroDeArchivo.objects.order_by('fecha_creacion', 'id'), archivista))
+        self.assertEqual(planes_con_recorrido_completo(consultas), [])
+
+
+@override_settings(CACHES=CACHE_LOCAL)
+class ExportacionRegistrosTests(TestCase):
+    """La descarga síncrona de registros respeta filtros, alcance del usuario y escapa lo necesario."""
+
+    @classmethod
+    def setUpTestData(cls):
+        unidad = UnidadAdministrativa.objects.create(
+            nombre='Gestión', entidad_productora=EntidadProductora.objects.create(nombre='Hospital'),
+        )
+        cls.archivo = OficinaProductora.objects.create(nombre='Archivo', unidad_administrativa=unidad)
+        farmacia = OficinaProductora.objects.create(nombre='Farmacia', unidad_administrativa=unidad)
+        cls.archivista = User.objects.create_user('archivista')
+        cls.farmaceuta = User.objects.create_user('farmaceuta')
+        PerfilUsuario.objects.create(user=cls.archivista, oficina=cls.archivo)
+        PerfilUsuario.objects.create(user=cls.farmaceuta, oficina=farmacia)
+        cls.serie = SerieDocumental.objects.create(codigo='1', nombre='Historias')
+        cls.texto_dificil = 'Caja "A", estante 3\nfila 2 · ñandú'
+        cls.formula = '=HYPERLINK("http://ejemplo.com","ver")'
+        cls.propio = RegistroDeArchivo.objects.create(
+            numero_orden='A-1', codigo_serie=cls.serie, unidad_documental=cls.texto_dificil, ubicacion=cls.formula,
+            notas='-descartar', fecha_archivo=date(2023, 5, 14), soporte_fisico=True, creado_por=cls.archivista,
+        )
+        cls.otro = RegistroDeArchivo.objects.create(
+            numero_orden='A-2', codigo_serie=cls.serie, unidad_documental='Unidad', ubicacion='Estante',
+            creado_por=cls.archivista,
+        )
+        cls.ajeno = RegistroDeArchivo.objects.create(
+            numero_orden='F-1', codigo_serie=cls.serie, unidad_documental='Unidad', ubicacion='Estante',
+            creado_por=cls.farmaceuta,
+        )
+
+    def setUp(self):
+        cache.clear()
+        self.client.force_login(self.archivista)
+
+    def exportar(self, formato, **parametros):
+        return self.client.get(reverse('exportar_registros'), {'formato': formato, **parametros})
+
+    def filas_csv(self, respuesta):
+        contenido = b''.join(respuesta.streaming_content).decode('utf-8')
+        self.assertTrue(contenido.startswith('\ufeff'))
+        encabezado, *filas = csv.reader(StringIO(contenido[1:]))
+        return encabezado, [dict(zip(encabezado, fila)) for fila in filas]
+
+    def test_csv(self):
+        respuesta = self.exportar('csv')
+        self.assertEqual(respuesta.status_code, 200)
+        self.assertEqual(respuesta['Content-Type'], 'text/csv; charset=utf-8')
+        self.assertEqual(
+            respuesta['Content-Disposition'], f'attachment; filename="registros_{timezone.localdate():%Y%m%d}.csv"',
+        )
+        encabezado, filas = self.filas_csv(respuesta)
+        self.assertEqual(encabezado, [columna.titulo for columna in views.TABLA_REGISTROS_CON_ID.columnas])
+        # Sólo los registros de la oficina del usuario, en el orden por defecto
+        self.assertEqual([fila['N° Orden'] for fila in filas], ['A-1', 'A-2'])
+        primera = filas[0]
+        self.assertEqual(primera['Unidad Documental'], self.texto_dificil)
+        self.assertEqual((primera['Fecha Archivo'], primera['Soporte Físico']), ('2023-05-14', 'Sí'))
+        # Lo que parece una fórmula no se ejecuta al abrir el archivo
+        self.assertEqual(primera['Ubicación'], "'" + self.formula)
+        self.assertEqual(primera['Notas'], "'-descartar")
+
+    def test_filtros_y_orden_de_la_tabla(self):
+        columnas = list(views.TABLA_REGISTROS_CON_ID.columnas_por_nombre)
+        parametros = peticion_datatables(columnas, {'numero_orden': 'A'}, orden=[(1, 'desc')]).GET.dict()
+        _, filas = self.filas_csv(self.exportar('csv', **parametros))
+        self.assertEqual([fila['N° Orden'] for fila in filas], ['A-2', 'A-1'])
+
+    def test_xlsx(self):
+        respuesta = self.exportar('xlsx')
+        self.assertEqual(respuesta['Content-Type'], FORMATOS_EXPORTACION['xlsx'])
+        self.assertIn(f'registros_{timezone.localdate():%Y%m%d}.xlsx', respuesta['Content-Disposition'])
+        hoja = openpyxl.load_workbook(BytesIO(b''.join(respuesta.streaming_content))).active
+        encabezado, primera, *resto = hoja.iter_rows()
+        columnas = {celda.value: i for i, celda in enumerate(encabezado)}
+        self.assertEqual(len(resto), 1)
+        ubicacion = primera[columnas['Ubicación']]
+        self.assertEqual((ubicacion.value, ubicacion.data_type), (self.formula, 's'))
+        self.assertEqual(primera[columnas['Unidad Documental']].value, self.texto_dificil)
+
+    @override_settings(EXPORTACIONES_MAXIMO_SINCRONO=1)
+    def test_xlsx_grande_se_encola(self):
+        # Dos filas visibles superan el máximo: el libro no se genera en la petición
+        respuesta = self.exportar('xlsx', **{'columns[0][data]': 'numero_orden', 'columns[0][search][value]': 'A'})
+        self.assertEqual(respuesta.status_code, 202)
+        trabajo = TrabajoExportacion.objects.get(pk=respuesta.json()['id'])
+        self.assertEqual((trabajo.tipo, trabajo.usuario, trabajo.parametros['formato']), ('registros', self.archivista, 'xlsx'))
+        self.assertEqual(trabajo.parametros['filtros']['columns[0][search][value]'], ['A'])
+        self.assertNotIn('formato', trabajo.parametros['filtros'])
+        self.assertEqual(respuesta.json()['url_estado'], reverse('estado_exportacion', args=[trabajo.pk]))
+
+        # En el límite, y los formatos en streaming, se siguen descargando directamente
+        self.assertEqual(self.exportar('xlsx', **{'columns[0][data]': 'numero_orden', 'columns[0][search][value]': 'A-2'}).status_code, 200)
+        self.assertEqual(self.exportar('csv').status_code, 200)
+        self.assertEqual(TrabajoExportacion.objects.count(), 1)
+
+    def test_ndjson(self):
+        respuesta = self.exportar('ndjson')
+        self.assertEqual(respuesta['Content-Type'], 'application/x-ndjson; charset=utf-8')
+        filas = [json.loads(linea) for linea in b''.join(respuesta.streaming_content).decode().splitlines()]
+        self.assertEqual([fila['id'] for fila in filas], [self.propio.pk, self.otro.pk])
+        self.assertEqual(filas[0]['ubicacion'], self.formula)
+        self.assertEqual(filas[0]['fecha_archivo'], '2023-05-14')
+
+    def test_alcance_y_errores(self):
+        self.client.force_login(self.farmaceuta)
+        _, filas = self.filas_csv(self.exportar('csv'))
+        self.assertEqual([fila['N° Orden'] for fila in filas], ['F-1'])
+
+        self.assertEqual(self.exportar('pdf').status_code, 400)
+        self.client.logout()
+        self.assertEqual(self.exportar('csv').status_code, 302)
+
+    def test_la_importacion_quita_el_apostrofo(self):
+        archivo = BytesIO(b''.join(self.exportar('csv').streaming_content))
+        resultado = importar_registros(filas_archivo(archivo, 'registros.csv'), self.archivista)
+        self.assertEqual((resultado.creados, resultado.total_errores), (2, 0))
+        importado = RegistroDeArchivo.objects.exclude(pk__in=[self.propio.pk, self.otro.pk, self.ajeno.pk]).get(
+            numero_orden='A-1',
+        )
+        self.assertEqual((importado.ubicacion, importado.notas), (self.formula, '-descartar'))
+
+
+class ExportacionFuidTests(TestCase):
+    """El formato FUID se escribe en streaming con una sola consulta de registros."""
+
+    @classmethod
+    def setUpTestData(cls):
+        cls.usuario = User.objects.create_user('archivista')
+        serie = SerieDocumental.objects.create(codigo='1', nombre='Historias')
+        subserie = SubserieDocumental.objects.create(serie=serie, codigo='1.1', nombre='Clínicas')
+        cls.fuid = FUID.objects.create(creado_por=cls.usuario, elaborado_por_nombre='Ana')
+        cls.fuid.registros.add(*[
+            RegistroDeArchivo.objects.create(
+                numero_orden=f'REG-{i}', codigo_serie=serie, codigo_subserie=subserie,
+                unidad_documental='Unidad documental con un nombre bastante largo', ubicacion='Estante',
+                creado_por=cls.usuario,
+            )
+            for i in range(30)
+        ])
+
+    def libro(self, fuid, **kwargs):
+        destino = BytesIO()
+        escribir_fuid(fuid, destino, **kwargs)
+        return openpyxl.load_workbook(BytesIO(destino.getvalue())).active
+
+    def test_formato_y_consultas(self):
+        with self.assertNumQueries(1):
+            ws = self.libro(self.fuid, chunk_size=7)
+        self.assertEqual(ws['A7'].value, 'Campo')
+        self.assertEqual(ws['A15'].value, 'N° Orden')
+        self.assertIn('A15:A18', {str(rango) for rango in ws.merged_cells.ranges})
+        self.assertEqual([ws.cell(row=fila, column=1).value for fila in (19, 48)], ['REG-0', 'REG-29'])
+        self.assertEqual(ws['C19'].value, 'Historias')
+        self.assertEqual(ws['E19'].value, 'Unidad documental con un no...')
+        self.assertEqual(ws['T19'].value, 'archivista')
+        self.assertEqual(ws['B50'].value, 'Ana')
+        # Ancho: texto más largo de la columna + 2
+        self.assertEqual(ws.column_dimensions['E'].width, len('Unidad documental con un no...') + 2)
+
+    def test_fuid_sin_registros(self):
+        ws = self.libro(FUID.objects.create(creado_por=self.usuario))
+        self.assertEqual(ws['A19'].value, 'Sin registros asociados')
+
+
+class ExportacionesEnSegundoPlanoTests(TestCase):
+    """Las exportaciones se encolan, las genera el worker y sólo las descarga su dueño."""
+
+    @classmethod
+    def setUpTestData(cls):
+        cls.usuario = User.objects.create_user('archivista', password='x')
+        serie = SerieDocumental.objects.create(codigo='1', nombre='Historias')
+        subserie = SubserieDocumental.objects.create(serie=serie, codigo='1.1', nombre='Clínicas')
+        cls.fuid = FUID.objects.create(creado_por=cls.usuario)
+        cls.fuid.registros.add(*[
+            RegistroDeArchivo.objects.create(
+                numero_orden=f'REG-{i}', codigo_serie=serie, codigo_subserie=subserie,
+                unidad_documental='Unidad', creado_por=cls.usuario,
+            )
+            for i in range(5)
+        ])
+
+    def setUp(self):
+        self.directorio = tempfile.TemporaryDirectory()
+        self.addCleanup(self.directorio.cleanup)
+        ajustes = override_settings(
+            EXPORTACIONES_DIR=Path(self.directorio.name) / 'exportaciones',
+            FUID_CACHE_DIR=Path(self.directorio.name) / 'fuids',
+        )
+        ajustes.enable()
+        self.addCleanup(ajustes.disable)
+        self.client.force_login(self.usuario)
+
+    def encolar(self, **datos):
+        respuesta = self.client.post(reverse('crear_exportacion'), datos)
+        self.assertEqual(respuesta.status_code, 202)
+        self.assertEqual(respuesta.json()['estado'], TrabajoExportacion.PENDIENTE)
+        return respuesta.json()
+
+    def procesar(self):
+        call_command('procesar_exportaciones', procesos=0, una_vez=True, stdout=StringIO())
+
+    def test_exportacion_de_fuid(self):
+        trabajo = self.encolar(tipo='fuid', fuid=self.fuid.pk)
+        self.procesar()
+
+        estado = self.client.get(trabajo['url_estado']).json()
+        self.assertEqual(estado['estado'], TrabajoExportacion.TERMINADO)
+        self.assertEqual((estado['procesados'], estado['total'], estado['progreso']), (5, 5, 100))
+
+        respuesta = self.client.get(estado['url_descarga'])
+        self.assertEqual(respuesta.status_code, 200)
+        ws = openpyxl.load_workbook(BytesIO(b''.join(respuesta.streaming_content))).active
+        self.assertEqual(ws['A19'].value, 'REG-0')
+
+        # Otro usuario no ve ni descarga la exportación
+        self.client.force_login(User.objects.create_user('otro'))
+        self.assertEqual(self.client.get(trabajo['url_estado']).status_code, 404)
+        self.assertEqual(self.client.get(estado['url_descarga']).status_code, 404)
+
+    def test_exportacion_de_registros_con_filtros(self):
+        trabajo = self.encolar(tipo='registros', formato='csv', **{
+            'columns[0][data]': 'numero_orden', 'columns[0][search][value]': 'REG-3',
+        })
+        self.procesar()
+
+        estado = self.client.get(trabajo['url_estado']).json()
+        self.assertEqual(estado['estado'], TrabajoExportacion.TERMINADO)
+        contenido = b''.join(self.client.get(estado['url_descarga']).streaming_content).decode('utf-8-sig')
+        self.assertIn('REG-3', contenido)
+        self.assertNotIn('REG-4', contenido)
+
+    def test_formato_y_tipo_invalidos(self):
+        self.assertEqual(self.client.post(reverse('crear_exportacion'), {'tipo': 'registros', 'formato': 'pdf'}).status_code, 400)
+        self.assertEqual(self.client.post(reverse('crear_exportacion'), {'tipo': 'otro'}).status_code, 400)
+
+    def test_limpieza_de_vencidos(self):
+        trabajo = self.encolar(tipo='fuid', fuid=self.fuid.pk)
+        self.procesar()
+        carpeta = Path(self.directorio.name) / 'exportaciones' / str(trabajo['id'])
+        self.assertTrue(carpeta.exists())
+
+        TrabajoExportacion.objects.filter(pk=trabajo['id']).update(expira=now() - timedelta(seconds=1))
+        self.assertEqual(trabajos.limpiar_vencidos(), 1)
+        self.assertFalse(carpeta.exists())
+        self.assertFalse(TrabajoExportacion.objects.filter(pk=trabajo['id']).exists())
+
+    def test_lote_de_fuids(self):
+        otro = FUID.objects.create(creado_por=self.usuario)
+        trabajo = self.encolar(tipo='lote_fuids', fuids=[self.fuid.pk, otro.pk])
+        self.procesar()
+
+        estado = self.client.get(trabajo['url_estado']).json()
+        self.assertEqual((estado['estado'], estado['procesados'], estado['total']), (TrabajoExportacion.TERMINADO, 2, 2))
+        contenido = BytesIO(b''.join(self.client.get(estado['url_descarga']).streaming_content))
+        with zipfile.ZipFile(contenido) as zip_:
+            self.assertEqual(sorted(zip_.namelist()), [f'FUID_{self.fuid.pk}.xlsx', f'FUID_{otro.pk}.xlsx'])
+            ws = openpyxl.load_workbook(BytesIO(zip_.read(f'FUID_{self.fuid.pk}.xlsx'))).active
+        self.assertEqual(ws['A19'].value, 'REG-0')
+
+    def test_lote_por_filtros_y_oficina(self):
+        unidad = UnidadAdministrativa.objects.create(
+            nombre='Gerencia', entidad_productora=EntidadProductora.objects.create(nombre='Hospital'),
+        )
+        oficina = OficinaProductora.objects.create(nombre='Archivo central', unidad_administrativa=unidad)
+        ajena = OficinaProductora.objects.create(nombre='Facturación', unidad_administrativa=unidad)
+        PerfilUsuario.objects.create(user=self.usuario, oficina=oficina)
+        propio = FUID.objects.create(creado_por=self.usuario, oficina_productora=oficina)
+        FUID.objects.create(creado_por=self.usuario, oficina_productora=ajena)
+
+        # Sin ids se usan los filtros de la tabla de FUIDs, dentro de la oficina del usuario
+        trabajo = self.encolar(tipo='lote_fuids', **{'columns[0][data]': 'fecha_creacion', 'columns[0][search][value]': '2000..'})
+        self.assertEqual(TrabajoExportacion.objects.get(pk=trabajo['id']).parametros, {'fuids': [propio.pk]})
+        # Los ids de otra oficina se descartan
+        respuesta = self.client.post(reverse('crear_exportacion'), {'tipo': 'lote_fuids', 'fuids': [self.fuid.pk]})
+        self.assertEqual(respuesta.status_code, 400)
+
+
+class CacheFuidTests(TestCase):
+    """El libro del FUID se sirve desde disco mientras no cambie su versión."""
+
+    @classmethod
+    def setUpTestData(cls):
+        cls.usuario = User.objects.create_user('archivista', password='x')
+        cls.serie = SerieDocumental.objects.create(codigo='1', nombre='Historias')
+        cls.fuid = FUID.objects.create(creado_por=cls.usuario)
+        cls.registro = RegistroDeArchivo.objects.create(
+            numero_orden='REG-0', codigo_serie=cls.serie, unidad_documental='Unidad', creado_por=cls.usuario,
+        )
+        cls.fuid.registros.add(cls.registro)
+
+    def setUp(self):
+        directorio = tempfile.TemporaryDirectory()
+        self.addCleanup(directorio.cleanup)
+        ajustes = override_settings(FUID_CACHE_DIR=Path(directorio.name))
+        ajustes.enable()
+        self.addCleanup(ajustes.disable)
+        self.carpeta = Path(directorio.name) / str(self.fuid.pk)
+        self.client.force_login(self.usuario)
+
+    def descargar(self, **cabeceras):
+        return self.client.get(reverse('export_fuid_to_excel', args=[self.fuid.pk]), headers=cabeceras)
+
+    def version(self):
+        return FUID.objects.get(pk=self.fuid.pk).version_contenido
+
+    def test_etag_y_no_modificado(self):
+        respuesta = self.descargar()
+        self.assertEqual(respuesta.status_code, 200)
+        ws = openpyxl.load_workbook(BytesIO(b''.join(respuesta.streaming_content))).active
+        self.assertEqual(ws['A19'].value, 'REG-0')
+        self.assertEqual(len(list(self.carpeta.iterdir())), 1)
+
+        # Misma versión: 304 sin consultar los registros
+        with CaptureQueriesContext(connection) as consultas:
+            self.assertEqual(self.descargar(if_none_match=respuesta['ETag']).status_code, 304)
+        self.assertFalse([c for c in consultas if RegistroDeArchivo._meta.db_table in c['sql']])
+        self.assertEqual(self.descargar(if_modified_since=respuesta['Last-Modified']).status_code, 304)
+
+        # Otra versión: ETag nuevo y el libro anterior se borra
+        self.registro.unidad_documental = 'Otra unidad'
+        self.registro.save()
+        nueva = self.descargar(if_none_match=respuesta['ETag'])
+        self.assertEqual(nueva.status_code, 200)
+        self.assertNotEqual(nueva['ETag'], respuesta['ETag'])
+        b''.join(nueva.streaming_content)
+        self.assertEqual(len(list(self.carpeta.iterdir())), 1)
+
+    def test_fuid_grande_sin_cache_se_encola(self):
+        with override_settings(EXPORTACIONES_MAXIMO_SINCRONO=0):
+            respuesta = self.descargar()
+            self.assertEqual(respuesta.status_code, 202)
+            trabajo = TrabajoExportacion.objects.get(pk=respuesta.json()['id'])
+            self.assertEqual((trabajo.tipo, trabajo.parametros), ('fuid', {'fuid': self.fuid.pk}))
+            self.assertFalse(self.carpeta.exists())
+
+            # Ya generado (p. ej. por el worker), se sirve desde la caché aunque supere el límite
+            cache_fuid.archivo(FUID.objects.get(pk=self.fuid.pk))
+            self.assertEqual(self.descargar().status_code, 200)
+        # Dentro del límite se genera en la petición
+        self.registro.save()
+        self.assertEqual(self.descargar().status_code, 200)
+        self.assertEqual(TrabajoExportacion.objects.count(), 1)
+
+    def test_peticion_lenta_no_borra_una_version_mas_nueva(self):
+        vieja = FUID.objects.get(pk=self.fuid.pk)
+        self.registro.save()
+        nueva = FUID.objects.get(pk=self.fuid.pk)
+        ruta_nueva = cache_fuid.archivo(nueva)
+        # La petición que leyó el FUID antes del cambio termina después
+        ruta_vieja = cache_fuid.archivo(vieja)
+        self.assertTrue(ruta_nueva.exists())
+        self.assertNotEqual(ruta_vieja, ruta_nueva)
+        # La siguiente versión sí limpia las anteriores
+        self.registro.save()
+        ruta_siguiente = cache_fuid.archivo(FUID.objects.get(pk=self.fuid.pk))
+        self.assertEqual(list(self.carpeta.iterdir()), [ruta_siguiente])
+
+    def test_cambios_que_invalidan(self):
+        def cambiar_nombre(usuario, nombre):
+            usuario.username = nombre
+            usuario.save(update_fields=['username'])
+
+        version = self.version()
+        cambios = [
+            lambda: self.fuid.registros.add(RegistroDeArchivo.objects.create(numero_orden='REG-1', codigo_serie=self.serie)),
+            lambda: self.registro.fuids.clear(),
+            lambda: self.fuid.registros.add(self.registro),
+            lambda: SerieDocumental.objects.filter(pk=self.serie.pk).first().save(),
+            lambda: cambiar_nombre(User.objects.get(pk=self.usuario.pk), 'archivista2'),
+            lambda: asignar_registros(
+                self.fuid, RegistroDeArchivo.objects.filter(pk=RegistroDeArchivo.objects.create(
+                    numero_orden='REG-2', codigo_serie=self.serie).pk),
+            ),
+            lambda: FUID.objects.get(pk=self.fuid.pk).save(),
+        ]
+        for cambio in cambios:
+            cambio()
+            self.assertGreater(self.version(), version)
+            version = self.version()
+
+        # Iniciar sesión, o guardar el usuario sin cambiar lo que muestra el formato, no lo cambia
+        self.client.login(username='archivista2', password='x')
+        usuario = User.objects.get(pk=self.usuario.pk)
+        usuario.first_name = 'Ana'
+        with CaptureQueriesContext(connection) as consultas:
+            usuario.save()
+        self.assertEqual(len(consultas), 1)
+        cambiar_nombre(usuario, 'archivista2')
+        self.assertEqual(self.version(), version)
+
+
+class ImportacionRegistrosTests(TestCase):
+    """La importación valida contra los catálogos en memoria e inserta por lotes."""
+
+    @classmethod
+    def setUpTestData(cls):
+        cls.usuario = User.objects.create_user('archivista')
+        cls.usuario.user_permissions.add(Permission.objects.get(codename='add_registrodearchivo'))
+        cls.serie = SerieDocumental.objects.create(codigo='2', nombre='Historias')
+        cls.subserie = SubserieDocumental.objects.create(serie=cls.serie, codigo='3', nombre='Clínicas')
+        cls.fuid = FUID.objects.create(creado_por=cls.usuario)
+
+    def csv(self, *filas):
+        contenido = '\n'.join(['N° Orden;Código Serie;Código Subserie;Unidad Documental;Ubicación;Fecha Inicial;Soporte Físico', *filas])
+        return SimpleUploadedFile('registros.csv', contenido.encode('utf-8-sig'))
+
+    def test_importa_csv_y_asocia_al_fuid(self):
+        self.client.force_login(self.usuario)
+        version = self.fuid.version_contenido
+        respuesta = self.client.post(reverse('importar_registros'), {
+            'archivo': self.csv('A-1;Historias;3;Unidad 1;Estante 1;14/05/2020;Sí', 'A-2;2;;Unidad 2;Estante 2;;no'),
+            'fuid': self.fuid.pk,
+        })
+        self.assertEqual(respuesta.status_code, 200)
+        self.assertEqual(respuesta.context['resultado'].creados, 2)
+
+        primero, segundo = RegistroDeArchivo.objects.order_by('numero_orden')
+        self.assertEqual((primero.codigo, primero.codigo_subserie, primero.fecha_inicial), ('301.02.03', self.subserie, date(2020, 5, 14)))
+        self.assertTrue(primero.soporte_fisico)
+        self.assertEqual((segundo.codigo, segundo.creado_por), ('301.02.00', self.usuario))
+        self.assertEqual(set(self.fuid.registros.all()), {primero, segundo})
+        self.assertEqual(IndiceBusquedaRegistro.objects.get(registro=primero).subserie, 'Clínicas')
+        self.assertGreater(FUID.objects.get(pk=self.fuid.pk).version_contenido, version)
+
+    def test_fuid_ajeno_exige_permiso_de_edicion(self):
+        # Mismo criterio que al editar el FUID: sin edit_own_fuid no se le añaden registros
+        companero = User.objects.create_user('companero')
+        ajeno = FUID.objects.create(creado_por=companero)
+        self.client.force_login(self.usuario)
+        respuesta = self.client.post(reverse('importar_registros'), {
+            'archivo': self.csv('A-1;Historias;;Unidad 1;Estante 1;;'), 'fuid': ajeno.pk,
+        })
+        self.assertEqual(respuesta.status_code, 200)
+        self.assertIn('fuid', respuesta.context['form'].errors)
+        self.assertFalse(RegistroDeArchivo.objects.exists())
+
+        with tempfile.TemporaryDirectory() as carpeta:
+            ruta = Path(carpeta) / 'registros.csv'
+            ruta.write_bytes(self.csv('A-1;Historias;;Unidad 1;Estante 1;;').read())
+            with self.assertRaisesMessage(CommandError, 'no tiene permiso'):
+                call_command('importar_registros', str(ruta), usuario='archivista', fuid=ajeno.pk, stdout=StringIO())
+            self.assertFalse(RegistroDeArchivo.objects.exists())
+
+            # Con el permiso sobre ese FUID sí se puede
+            assign_perm('documentos.edit_own_fuid', self.usuario, ajeno)
+            call_command('importar_registros', str(ruta), usuario='archivista', fuid=ajeno.pk, stdout=StringIO())
+        self.assertEqual(ajeno.registros.count(), 1)
+
+    def test_motor_sin_ids_en_bulk_insert(self):
+        # mssql-django sin 'return_rows_bulk_insert': bulk_create no rellena los pk
+        existente = RegistroDeArchivo.objects.create(
+            numero_orden='A-1', codigo_serie=self.serie, unidad_documental='Anterior', ubicacion='Estante',
+            creado_por=self.usuario,
+        )
+        with mock.patch.object(type(connection.features), 'can_return_rows_from_bulk_insert', False):
+            resultado = importar_registros(
+                filas_archivo(self.csv('A-1;Historias;3;Unidad 1;Estante 1;;', 'A-2;2;;Unidad 2;Estante 2;;'), 'registros.csv'),
+                self.usuario, fuid=self.fuid, tamano_lote=1,
+            )
+        self.assertEqual(resultado.creados, 2)
+        nuevos = set(RegistroDeArchivo.objects.exclude(pk=existente.pk))
+        self.assertEqual(set(self.fuid.registros.all()), nuevos)
+        self.assertEqual(
+            set(IndiceBusquedaRegistro.objects.values_list('registro_id', 'unidad_documental')),
+            {(registro.pk, registro.unidad_documental) for registro in nuevos}
+            | {(existente.pk, 'Anterior')},
+        )
+
+    def test_errores_por_fila(self):
+        filas = ('A-1;Historias;;Unidad;Estante;;', 'A-2;Inexistente;;Unidad;Estante;;', 'A-3;2;;Unidad;Estante;2020-13-01;quizás')
+        resultado = importar_registros(filas_archivo(self.csv(*filas), 'registros.csv'), self.usuario)
+        self.assertTrue(resultado.revertida)
+        self.assertEqual([fila for fila, _ in resultado.errores], [3, 4])
+        self.assertIn('Fecha Inicial', resultado.errores[1][1])
+        self.assertIn('Soporte Físico', resultado.errores[1][1])
+        self.assertFalse(RegistroDeArchivo.objects.exists())
+
+        resultado = importar_registros(filas_archivo(self.csv(*filas), 'registros.csv'), self.usuario, omitir_errores=True)
+        self.assertEqual((resultado.creados, resultado.total_errores), (1, 2))
+        self.assertEqual(list(RegistroDeArchivo.objects.values_list('numero_orden', flat=True)), ['A-1'])
+
+    def test_columnas_obligatorias_y_formato(self):
+        with self.assertRaises(ArchivoInvalido):
+            importar_registros([['numero_orden', 'caja']], self.usuario)
+        with self.assertRaises(ArchivoInvalido):
+            filas_archivo(BytesIO(b''), 'registros.pdf')
+
+    def test_consultas_constantes_con_xlsx(self):
+        def libro(cantidad):
+            wb = openpyxl.Workbook()
+            ws = wb.active
+            ws.append(['numero_orden', 'codigo_serie', 'unidad_documental', 'ubicacion', 'fecha_archivo', 'numero_folios'])
+            for i in range(cantidad):
+                ws.append([f'X-{i}', 'Historias', 'Unidad', 'Estante', datetime(2021, 1, 2), 15])
+            destino = BytesIO()
+            wb.save(destino)
+            destino.seek(0)
+            return destino
+
+        with CaptureQueriesContext(connection) as capturadas:
+            resultado = importar_registros(filas_archivo(libro(200), 'libro.xlsx'), self.usuario, tamano_lote=100)
+        self.assertEqual(resultado.creados, 200)
+        # Catálogos (2) e INSERTs por lote; SQLite parte además cada INSERT por su límite de variables
+        inserciones = [c for c in capturadas if c['sql'].startswith('INSERT')]
+        self.assertEqual(len(capturadas) - len(inserciones), 4)  # catálogos, BEGIN y COMMIT
+        self.assertLess(len(inserciones), 20)
+        registro = RegistroDeArchivo.objects.get(numero_orden='X-0')
+        self.assertEqual((registro.fecha_archivo, registro.numero_folios), (date(2021, 1, 2), 15))
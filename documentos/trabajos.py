@@ -0,0 +1,212 @@
+"""
+Exportaciones en segundo plano (``TrabajoExportacion``).
+
+Las exportaciones grandes (formato FUID, listados de registros) no se generan
+en el proceso web:
+
+1. La vista crea el trabajo (``encolar``) y responde enseguida con su id.
+2. El comando ``procesar_exportaciones`` toma los pendientes
+   (``tomar_pendientes``) y los ejecuta en un pool de procesos
+   (``ejecutar``). Cada trabajo guarda su avance en ``procesados``/``total``.
+3. El navegador consulta el estado y, cuando está terminado, descarga el
+   archivo de ``EXPORTACIONES_DIR``.
+4. Los lotes de FUIDs (``lote_fuids``, transferencias documentales) generan
+   sus libros uno tras otro dentro del mismo proceso del pool y los van
+   agregando a un ZIP: el paralelismo lo da el pool del worker, no un pool
+   anidado por trabajo. Los libros del formato FUID salen de la caché en disco
+   de ``cache_fuid`` cuando no cambiaron.
+5. Los archivos y trabajos vencidos (``EXPORTACIONES_DURACION``) se borran
+   con ``limpiar_vencidos``, que el worker ejecuta periódicamente.
+
+Todo vive en la base de datos y el disco local: no hace falta un broker.
+Tomar un trabajo es un ``UPDATE ... WHERE estado = 'pendiente'`` por fila,
+así que dos workers no pueden ejecutar el mismo.
+"""
+import logging
+import os
+import shutil
+import zipfile
+from datetime import timedelta
+from pathlib import Path
+
+from django.conf import settings
+from django.http import QueryDict
+from django.utils import timezone
+
+from .conteos import contar
+from .exportacion import escribir_exportacion
+from .models import FUID, RegistroDeArchivo, TrabajoExportacion
+from . import cache_fuid
+
+logger = logging.getLogger(__name__)
+
+
+def directorio():
+    return Path(getattr(settings, 'EXPORTACIONES_DIR', Path(settings.BASE_DIR) / 'exportaciones'))
+
+
+def duracion():
+    return timedelta(seconds=getattr(settings, 'EXPORTACIONES_DURACION', 24 * 60 * 60))
+
+
+def procesos_por_defecto():
+    return getattr(settings, 'EXPORTACIONES_PROCESOS', None) or os.cpu_count() or 1
+
+
+def maximo_sincrono():
+    """Filas por encima de las cuales una descarga XLSX se encola en lugar de generarse en la petición."""
+    return getattr(settings, 'EXPORTACIONES_MAXIMO_SINCRONO', 2000)
+
+
+def ruta(trabajo):
+    """Ruta absoluta del archivo generado por ``trabajo`` (o None si aún no lo hay)."""
+    return directorio() / trabajo.archivo if trabajo.archivo else None
+
+
+# Generadores por tipo de trabajo: (trabajo, archivo binario, progreso) -> nombre del archivo
+
+def _fuid(pk):
+    return FUID.objects.select_related(
+        'entidad_productora', 'unidad_administrativa', 'oficina_productora', 'objeto',
+    ).get(pk=pk)
+
+
+def _exportar_fuid(trabajo, archivo, progreso):
+    # El libro sale de la caché en disco si la versión del FUID no cambió
+    fuid = _fuid(trabajo.parametros['fuid'])
+    with open(cache_fuid.archivo(fuid, progreso=progreso), 'rb') as libro:
+        shutil.copyfileobj(libro, archivo)
+    return f'FUID_{fuid.pk}.xlsx'
+
+
+def generar_fuid(pk):
+    """
+    Ruta (en la caché de cache_fuid) del libro vigente del FUID ``pk``,
+    generándolo si hace falta.
+    """
+    return str(cache_fuid.archivo(_fuid(pk)))
+
+
+def _exportar_lote_fuids(trabajo, archivo, progreso):
+    pks = trabajo.parametros['fuids']
+    progreso(0, len(pks))
+    # Los .xlsx ya están comprimidos: se guardan sin volver a comprimir (ZIP_STORED)
+    with zipfile.ZipFile(archivo, 'w', zipfile.ZIP_STORED) as zip_:
+        for procesados, pk in enumerate(pks, 1):
+            nombre = f'FUID_{pk}.xlsx'
+            try:
+                zip_.write(generar_fuid(pk), nombre)
+            except FileNotFoundError:
+                # El FUID cambió mientras tanto y su libro se reemplazó: se usa la versión nueva
+                zip_.write(generar_fuid(pk), nombre)
+            progreso(procesados)
+    return f'FUIDs_{timezone.localdate():%Y%m%d}.zip'
+
+
+def _exportar_registros(trabajo, archivo, progreso):
+    # Import diferido: las tablas de registros están en views, que importa este módulo
+    from .views import TABLA_REGISTROS_CON_ID, registros_visibles
+
+    params = QueryDict(mutable=True)
+    for clave, valores in trabajo.parametros.get('filtros', {}).items():
+        params.setlist(clave, valores)
+    formato = trabajo.parametros.get('formato', 'xlsx')
+    tabla = TABLA_REGISTROS_CON_ID.ordenada(params)
+    registros = tabla.filtrar(registros_visibles(RegistroDeArchivo.objects.all(), trabajo.usuario), params)
+    progreso(0, contar(registros).valor)
+    escribir_exportacion(tabla, registros, formato, archivo, 'registros', progreso)
+    return f'registros_{timezone.localdate():%Y%m%d}.{formato}'
+
+
+GENERADORES = {
+    'fuid': _exportar_fuid,
+    'registros': _exportar_registros,
+    'lote_fuids': _exportar_lote_fuids,
+}
+
+
+def encolar(usuario, tipo, parametros):
+    """Crea un trabajo pendiente; el worker lo recogerá en su siguiente vuelta."""
+    if tipo not in GENERADORES:
+        raise ValueError(f"Tipo de exportación desconocido: {tipo}")
+    return TrabajoExportacion.objects.create(usuario=usuario, tipo=tipo, parametros=parametros)
+
+
+def tomar_pendientes(cantidad):
+    """Marca como en proceso hasta ``cantidad`` trabajos pendientes (los más antiguos) y devuelve sus ids."""
+    if cantidad <= 0:
+        return []
+    candidatos = (
+        TrabajoExportacion.objects.filter(estado=TrabajoExportacion.PENDIENTE)
+        .order_by('creado', 'id').values_list('pk', flat=True)[:cantidad * 2]
+    )
+    tomados = []
+    for pk in candidatos:
+        actualizados = TrabajoExportacion.objects.filter(pk=pk, estado=TrabajoExportacion.PENDIENTE).update(
+            estado=TrabajoExportacion.EN_PROCESO, iniciado=timezone.now(),
+        )
+        if actualizados:
+            tomados.append(pk)
+            if len(tomados) == cantidad:
+                break
+    return tomados
+
+
+def reanudar_interrumpidos():
+    """
+    Devuelve a la cola los trabajos que quedaron en proceso porque el worker
+    se detuvo. Se llama al arrancar el worker (uno por servidor).
+    """
+    return TrabajoExportacion.objects.filter(estado=TrabajoExportacion.EN_PROCESO).update(
+        estado=TrabajoExportacion.PENDIENTE, procesados=0, iniciado=None,
+    )
+
+
+def _terminar(pk, estado, **campos):
+    ahora = timezone.now()
+    TrabajoExportacion.objects.filter(pk=pk).update(estado=estado, terminado=ahora, expira=ahora + duracion(), **campos)
+
+
+def marcar_error(pk, mensaje):
+    _terminar(pk, TrabajoExportacion.ERROR, error=mensaje)
+
+
+def _progreso(pk):
+    def progreso(procesados, total=None):
+        campos = {'procesados': procesados}
+        if total is not None:
+            campos['total'] = total
+        TrabajoExportacion.objects.filter(pk=pk).update(**campos)
+    return progreso
+
+
+def ejecutar(pk):
+    """
+    Genera el archivo del trabajo ``pk`` (ya tomado con ``tomar_pendientes``).
+    Se ejecuta en un proceso del pool; si falla, el error queda en el trabajo.
+    Devuelve True si terminó bien.
+    """
+    trabajo = TrabajoExportacion.objects.select_related('usuario').get(pk=pk)
+    carpeta = directorio() / str(pk)
+    carpeta.mkdir(parents=True, exist_ok=True)
+    parcial = carpeta / 'parcial'
+    try:
+        with open(parcial, 'wb') as archivo:
+            nombre = GENERADORES[trabajo.tipo](trabajo, archivo, _progreso(pk))
+        os.replace(parcial, carpeta / nombre)
+    except Exception as e:
+        logger.exception("Error generando la exportación %s", pk)
+        parcial.unlink(missing_ok=True)
+        marcar_error(pk, str(e) or e.__class__.__name__)
+        return False
+    _terminar(pk, TrabajoExportacion.TERMINADO, archivo=f'{pk}/{nombre}', nombre_archivo=nombre)
+    return True
+
+
+def limpiar_vencidos():
+    """Borra los trabajos vencidos y sus archivos. Devuelve cuántos se borraron."""
+    vencidos = TrabajoExportacion.objects.filter(expira__lt=timezone.now())
+    for pk in vencidos.values_list('pk', flat=True).iterator():
+        shutil.rmtree(directorio() / str(pk), ignore_errors=True)
+    borrados, _ = vencidos.delete()
+    return borrados
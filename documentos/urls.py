@@ -28,6 +28,7 @@ handler403 = 'documentos.views.mi_error_403'
 urlpatterns = [
     path('', views.lista_registros, name='lista_registros'),  # Página principal de registros
     path('nuevo/', views.crear_registro, name='crear_registro'),
+    path('importar/', views.importar_registros, name='importar_registros'),
     path('<int:pk>/editar/', views.editar_registro, name='editar_registro'),
     path('<int:pk>/eliminar/', views.eliminar_registro, name='eliminar_registro'),
     path('cargar_subseries/', views.cargar_subseries, name='cargar_subseries'),
@@ -50,6 +51,9 @@ urlpatterns = [
     path('detalle-ficha/<int:consecutivo>/', detalle_ficha_paciente, name='detalle_ficha'),
     path('api/lista-fichas/', ListaFichasAPIView.as_view(), name='api_lista_fichas'),
     path('fuid/<int:pk>/export-excel/', export_fuid_to_excel, name='export_fuid_to_excel'),
+    path('api/exportaciones/', views.crear_exportacion, name='crear_exportacion'),
+    path('api/exportaciones/<int:pk>/', views.estado_exportacion, name='estado_exportacion'),
+    path('exportaciones/<int:pk>/descargar/', views.descargar_exportacion, name='descargar_exportacion'),
     path('fuids/<int:fuid_id>/agregar_registro/', views.agregar_registro_a_fuid, name='agregar_registro_a_fuid'),
       # Otras rutas de tu app...
     path('estadisticas/pacientes/', views.estadisticas_pacientes, name='estadisticas_pacientes'),
@@ -62,6 +66,12 @@ urlpatterns = [
     path('api/registros/', registros_api, name='registros_api'),
     path('api/registros_api_completo/', views.registros_api_completo, name='registros_api_completo'),
     path('registros_api_con_id/', registros_api_con_id, name='registros_api_con_id'),
+    path('api/registros/exportar/', views.exportar_registros, name='exportar_registros'),
+    path('api/fuids/', views.fuids_api, name='fuids_api'),
+    path('api/fuids/registros-disponibles/', views.registros_disponibles_api, name='registros_disponibles_api'),
+    path('api/fuids/reservas/', views.reservar_registros_fuid, name='reservar_registros_fuid'),
+    path('api/fuids/<int:pk>/asignar-registros/', views.asignar_registros_fuid, name='asignar_registros_fuid'),
+    path('api/metricas/cache/', views.metricas_cache_respuestas, name='metricas_cache_respuestas'),
 
 
 
@@ -4,9 +4,9 @@ from datetime import date, datetime  # Manejo de fechas y horas
 # Importaciones de Django
 from django.contrib.auth.decorators import permission_required
 from django.contrib.auth.decorators import login_required
+from django.contrib.admin.views.decorators import staff_member_required
 from django.shortcuts import render, redirect, get_object_or_404
 from django.http import HttpResponseForbidden
-from guardian.shortcuts import get_perms
 from .models import RegistroDeArchivo, SubserieDocumental
 from .forms import RegistroDeArchivoForm
 from django.utils.decorators import method_decorator
@@ -15,37 +15,55 @@ from django.contrib.auth.decorators import login_required  # Decorador para rest
 from django.contrib.auth.mixins import LoginRequiredMixin  # Mixin para vistas basadas en clases que requieren autenticación
 from django.contrib.auth.models import User  # Modelo de usuarios de Django
 from django.core.paginator import Paginator  # Paginación de listas de objetos
-from django.db import IntegrityError  # Manejo de errores de integridad en la base de datos
-from django.db.models import Q, Count, Avg  # Operadores para consultas avanzadas a la base de datos
-from django.http import HttpResponse, HttpResponseForbidden, JsonResponse  # Respuestas HTTP y JSON
+from django.db import IntegrityError, transaction  # Errores de integridad y transacciones
+from django.db.models import Q, Count, Avg, IntegerField, OuterRef, Subquery  # Operadores para consultas avanzadas a la base de datos
+from django.http import FileResponse, Http404, HttpResponse, HttpResponseForbidden, JsonResponse  # Respuestas HTTP y JSON
 from django.shortcuts import render, redirect, get_object_or_404  # Métodos para renderizar vistas y manejar redirecciones
-from django.urls import reverse_lazy  # Generación de URLs reversas para redirección
+from django.urls import reverse, reverse_lazy  # Generación de URLs reversas para redirección
 from django.utils.timezone import now, timedelta  # Fechas y tiempos con soporte de zona horaria
 from django.views.generic.edit import CreateView, UpdateView  # Vistas genéricas para creación y edición de objetos
-# Librerías de terceros
-import openpyxl  # Librería para trabajar con archivos Excel
-from openpyxl.utils import get_column_letter  # Utilidad para obtener letras de columnas en Excel
-from openpyxl.styles import Alignment, Border, Side, PatternFill, Font  # Estilos y formato para celdas en Excel
-from openpyxl.drawing.image import Image  # Insertar imágenes en hojas de cálculo Excel
 
 # Framework Django Rest Framework
 from rest_framework.response import Response  # Respuestas de APIs
 from rest_framework.views import APIView  # Clase base para construir APIs
 
 # Importaciones específicas del proyecto
-from .forms import RegistroDeArchivoForm, FUIDForm, FichaPacienteForm  # Formularios personalizados
+from .forms import RegistroDeArchivoForm, FUIDForm, FichaPacienteForm, AsignacionRegistrosForm, ImportacionRegistrosForm, registros_seleccionables  # Formularios personalizados
+from .datatables import Columna, ColumnaFecha, TablaDataTables, longitud_maxima, parsear_booleano, parsear_entero, respuesta_json  # Motor de las APIs de DataTables
+from .conteos import contar  # Conteos cacheados para recordsTotal / recordsFiltered
+from .busqueda import ColumnaTextoCompleto, buscar as buscar_registros  # Índice de texto completo
+from .exportacion import FORMATOS as FORMATOS_EXPORTACION, respuesta_exportacion  # Descargas en streaming
+from . import cache_fuid  # Formato FUID en Excel, cacheado en disco por versión
+from .cache_fuid import respuesta_fuid
+from . import trabajos  # Exportaciones en segundo plano (TrabajoExportacion)
+from . import cache_respuestas  # Caché de respuestas de las APIs de DataTables
+from .asignacion import asignar_registros  # Asignación masiva de registros a un FUID
+from . import reservas  # Reservas de registros mientras se arma un FUID
+from .permisos import permisos_de  # Permisos por objeto memorizados por petición
+from . import permisos_serie  # Permisos por serie documental (PermisoUsuarioSerie)
+from . import oficinas  # Alcance por la oficina del perfil del usuario (PerfilUsuario)
+from . import importacion  # Carga masiva de registros desde CSV / XLSX
 from .models import (  # Modelos de la base de datos
     RegistroDeArchivo,
     SubserieDocumental,
     SerieDocumental,
     FUID,
-    FichaPaciente
+    FichaPaciente,
+    UnidadAdministrativa,
+    OficinaProductora,
+    Objeto,
+    ReservaRegistro,
+    TrabajoExportacion,
 )
 
 
 @login_required
 def cargar_series(request):
-    series = SerieDocumental.objects.all().values('codigo', 'nombre')
+    series = SerieDocumental.objects.all()
+    permitidas = permisos_serie.series_permitidas(request.user, 'crear')
+    if permitidas is not None:
+        series = series.filter(pk__in=sorted(permitidas))
+    series = series.values('codigo', 'nombre')
     return JsonResponse(list(series), safe=False)
 @login_required
 def cargar_subseries(request):
@@ -58,8 +76,11 @@ from guardian.shortcuts import assign_perm  # <-- Importamos assign_perm
 @login_required
 # Listar registros
 def lista_registros(request):
-    registros = RegistroDeArchivo.objects.all()
-    return render(request, 'registro_list.html', {'registros': registros})
+    # Sólo la estructura de la tabla y su primera página; DataTables pide el resto a registros_api
+    return render(request, 'registro_list.html', {
+        'primera_pagina': TABLA_REGISTROS.primera_pagina(request, LONGITUD_PAGINA_REGISTROS),
+        'longitud_pagina': LONGITUD_PAGINA_REGISTROS,
+    })
 
 
 @login_required
@@ -67,23 +88,20 @@ def crear_registro(request):
     if not request.user.has_perm('documentos.add_registrodearchivo'):
         return HttpResponseForbidden("No tienes permiso para crear registros.")
     if request.method == 'POST':
-        form = RegistroDeArchivoForm(request.POST)
+        form = RegistroDeArchivoForm(request.POST, usuario=request.user)
         if form.is_valid():
             registro = form.save(commit=False)
             registro.creado_por = request.user  # Asigna el usuario autenticado
             registro.save()
 
-            # 1) Asignar los permisos a nivel de objeto al usuario creador.
-            assign_perm('documentos.view_own_registro', request.user, registro)
-            assign_perm('documentos.edit_own_registro', request.user, registro)
-            # assign_perm('documentos.delete_own_registro', request.user, registro)
-            # se pueden modificar estas lineas para limitar los permisos al crearse el objeto, estos permisos se deben asignar desde la consola de django
+            # 1) Permisos: ver y editar los tiene el creador por serlo (backends.PropietarioBackend);
+            # eliminar u otros permisos se comparten explícitamente con guardian desde la consola de django
 
             # 2) Mensajes de éxito
             messages.success(request, 'Registro de archivo creado exitosamente.')
 
             # 3) Limpiamos el formulario para que quede listo para un nuevo registro
-            form = RegistroDeArchivoForm()
+            form = RegistroDeArchivoForm(usuario=request.user)
         else:
             # Agrega mensajes de error para cada campo inválido
             for field, errors in form.errors.items():
@@ -92,25 +110,59 @@ def crear_registro(request):
                     messages.error(request, f"{field_name}: {error}")
 
     else:
-        form = RegistroDeArchivoForm()
+        form = RegistroDeArchivoForm(usuario=request.user)
         # Subseries vacío por defecto (si no se selecciona serie)
         form.fields['codigo_subserie'].queryset = SubserieDocumental.objects.none()
 
     return render(request, 'registro_form.html', {'form': form})
 
 
+@login_required
+def importar_registros(request):
+    """
+    Carga masiva de registros desde un CSV o XLSX (ver importacion.py).
+    Muestra cuántos se crearon y los errores por número de fila.
+    """
+    if not request.user.has_perm('documentos.add_registrodearchivo'):
+        return HttpResponseForbidden("No tienes permiso para crear registros.")
+
+    resultado = None
+    if request.method == 'POST':
+        form = ImportacionRegistrosForm(request.POST, request.FILES, usuario=request.user)
+        if form.is_valid():
+            archivo = form.cleaned_data['archivo']
+            try:
+                resultado = importacion.importar_registros(
+                    importacion.filas_archivo(archivo, archivo.name), request.user,
+                    fuid=form.cleaned_data['fuid'], omitir_errores=form.cleaned_data['omitir_errores'],
+                )
+            except importacion.ArchivoInvalido as e:
+                form.add_error('archivo', str(e))
+            else:
+                if resultado.creados:
+                    messages.success(request, f"Se importaron {resultado.creados} registros.")
+    else:
+        form = ImportacionRegistrosForm(usuario=request.user)
+
+    return render(request, 'importar_registros.html', {
+        'form': form,
+        'resultado': resultado,
+        'columnas': [titulos[0] for titulos in importacion.COLUMNAS.values()],
+    })
+
+
 
 
 @login_required
 def editar_registro(request, pk):
-    registro = get_object_or_404(RegistroDeArchivo, id=pk)
+    registro = get_object_or_404(oficinas.filtrar_registros(RegistroDeArchivo.objects.all(), request.user), id=pk)
 
     # Verifica si el usuario tiene permiso de edición a nivel de objeto
-    if not request.user.is_superuser and 'edit_own_registro' not in get_perms(request.user, registro):
+    if not permisos_de(request).tiene('edit_own_registro', registro):
         return HttpResponseForbidden("No tienes permiso para editar este registro.")
 
     if request.method == 'POST':
-        form = RegistroDeArchivoForm(request.POST, instance=registro)
+        form = RegistroDeArchivoForm(request.POST, instance=registro, usuario=request.user)
         # Lógica de subseries
         codigo_serie = request.POST.get('codigo_serie')
         if codigo_serie:
@@ -120,7 +172,7 @@ def editar_registro(request, pk):
             form.save()
             return redirect('lista_registros')
     else:
-        form = RegistroDeArchivoForm(instance=registro)
+        form = RegistroDeArchivoForm(instance=registro, usuario=request.user)
         if registro.codigo_serie:
             form.fields['codigo_subserie'].queryset = SubserieDocumental.objects.filter(serie=registro.codigo_serie)
         else:
@@ -132,14 +184,12 @@ def editar_registro(request, pk):
 
 
 from guardian.utils import get_anonymous_user
-from guardian.shortcuts import get_perms
 
 
-from guardian.shortcuts import get_perms
 
 @login_required
 def eliminar_registro(request, pk):
-    registro = get_object_or_404(RegistroDeArchivo, pk=pk)
+    registro = get_object_or_404(oficinas.filtrar_registros(RegistroDeArchivo.objects.all(), request.user), pk=pk)
 
     # Si superuser, ok
     if request.user.is_superuser:
@@ -147,8 +197,7 @@ def eliminar_registro(request, pk):
         return redirect('lista_registros')
 
     # Verifica si el user tiene permiso de delete a nivel de objeto
-    perms = get_perms(request.user, registro)
-    if 'delete_own_registro' in perms:
+    if permisos_de(request).tiene('delete_own_registro', registro):
         registro.delete()
         return redirect('lista_registros')
     else:
@@ -157,268 +206,144 @@ def eliminar_registro(request, pk):
 
 @login_required
 def lista_completa_registros(request):
-    registros = RegistroDeArchivo.objects.all()
-    return render(request, 'registro_completo.html', {'registros': registros})
+    # Igual que lista_registros, con la tabla de registros_api_con_id
+    return render(request, 'registro_completo.html', {
+        'primera_pagina': TABLA_REGISTROS_CON_ID.primera_pagina(request, LONGITUD_PAGINA_COMPLETA),
+        'longitud_pagina': LONGITUD_PAGINA_COMPLETA,
+    })
+
+
+# Columnas disponibles para las APIs de registros.
+# Cada endpoint elige el subconjunto que necesita su tabla.
+# Las columnas de texto se buscan con el índice de texto completo (busqueda.py) y las
+# de fecha por rangos ("2023", "2023-05", "2023-05-14", "2023-01..2023-06").
+# Sólo las columnas con índice (ver RegistroDeArchivo.Meta.indexes) son ordenables.
+COLUMNAS_REGISTRO = {
+    columna.nombre: columna for columna in [
+        Columna('id', buscable=False, ordenable=True, titulo="ID"),
+        ColumnaTextoCompleto('numero_orden', ordenable=True, titulo="N° Orden"),
+        Columna('codigo', titulo="Código"),
+        ColumnaTextoCompleto('codigo_serie', 'codigo_serie__nombre', indice='serie', por_defecto="", titulo="Código Serie"),
+        ColumnaTextoCompleto('codigo_subserie', 'codigo_subserie__nombre', indice='subserie', por_defecto="", titulo="Código Subserie"),
+        ColumnaTextoCompleto('unidad_documental', titulo="Unidad Documental"),
+        ColumnaFecha('fecha_archivo', ordenable=True, titulo="Fecha Archivo"),
+        ColumnaFecha('fecha_inicial', ordenable=True, titulo="Fecha Inicial"),
+        ColumnaFecha('fecha_final', ordenable=True, titulo="Fecha Final"),
+        Columna('soporte_fisico', lookup='exact', parser=parsear_booleano, titulo="Soporte Físico"),
+        Columna('soporte_electronico', lookup='exact', parser=parsear_booleano, titulo="Soporte Electrónico"),
+        ColumnaTextoCompleto('caja', titulo="Caja"),
+        ColumnaTextoCompleto('carpeta', titulo="Carpeta"),
+        Columna('tomo_legajo_libro', buscable=False, titulo="Tomo/Legajo/Libro"),
+        Columna('numero_folios', buscable=False, titulo="N° Folios"),
+        Columna('tipo', buscable=False, titulo="Tipo"),
+        Columna('cantidad', buscable=False, titulo="Cantidad"),
+        ColumnaTextoCompleto('ubicacion', titulo="Ubicación"),
+        Columna('cantidad_documentos_electronicos', buscable=False, titulo="Cantidad Electrónicos"),
+        Columna('tamano_documentos_electronicos', buscable=False, titulo="Tamaño Electrónico"),
+        Columna('notas', buscable=False, titulo="Notas"),
+        Columna('creado_por', 'creado_por__username', por_defecto="", titulo="Creado Por"),
+        ColumnaFecha('fecha_creacion', con_hora=True, ordenable=True, titulo="Fecha Creación"),
+    ]
+}
+
+
+class TablaRegistros(TablaDataTables):
+    """
+    Tabla de registros limitada a la oficina del usuario (oficinas) y a las
+    series que puede consultar (permisos_serie).
+    """
+
+    def get_queryset(self, request):
+        return registros_visibles(super().get_queryset(request), request.user)
+
+
+def registros_visibles(registros, usuario):
+    """Aplica a ``registros`` el alcance por oficina y por serie de ``usuario``."""
+    return permisos_serie.filtrar_registros(oficinas.filtrar_registros(registros, usuario), usuario)
+
+
+# Banderas por fila de las listas de registros, con los mismos permisos que
+# comprueban editar_registro y eliminar_registro
+PERMISOS_FILA_REGISTRO = {'can_edit': 'edit_own_registro', 'can_delete': 'delete_own_registro'}
+
+
+def tabla_registros(*nombres, permisos=None, **reemplazos):
+    """
+    Construye una TablaDataTables de registros con las columnas indicadas.
+    ``reemplazos`` permite cambiar la definición de una columna concreta y
+    ``permisos`` añade banderas de permisos por fila (ver TablaDataTables).
+    """
+    columnas = [reemplazos.get(nombre, COLUMNAS_REGISTRO[nombre]) for nombre in nombres]
+    # Clave de orden estable: sirve tanto para OFFSET como para el modo cursor.
+    # Las filas muestran nombres de serie y subserie, así que sus cambios también invalidan la caché.
+    return TablaRegistros(
+        RegistroDeArchivo, columnas, orden=('fecha_creacion', 'id'), busqueda_global=buscar_registros,
+        cachear=True, dependencias=(RegistroDeArchivo, SerieDocumental, SubserieDocumental), permisos=permisos,
+    )
+
+
+COLUMNAS_COMPLETAS = (
+    'numero_orden', 'codigo', 'codigo_serie', 'codigo_subserie', 'unidad_documental',
+    'fecha_archivo', 'fecha_inicial', 'fecha_final', 'soporte_fisico', 'soporte_electronico',
+    'caja', 'carpeta', 'tomo_legajo_libro', 'numero_folios', 'tipo', 'cantidad', 'ubicacion',
+    'cantidad_documentos_electronicos', 'tamano_documentos_electronicos', 'notas',
+    'creado_por', 'fecha_creacion',
+)
+
+TABLA_REGISTROS = tabla_registros(
+    'numero_orden', 'codigo', 'codigo_serie', 'codigo_subserie', 'unidad_documental',
+    'fecha_archivo', 'soporte_fisico', 'soporte_electronico', 'creado_por',
+    'id',  # importante para los enlaces Editar/Eliminar
+    permisos=PERMISOS_FILA_REGISTRO,
+    creado_por=Columna('creado_por', 'creado_por__username', por_defecto="N/A", titulo="Creado Por"),
+)
+TABLA_REGISTROS_COMPLETO = tabla_registros(*COLUMNAS_COMPLETAS, permisos=PERMISOS_FILA_REGISTRO)
+TABLA_REGISTROS_CON_ID = tabla_registros('id', *COLUMNAS_COMPLETAS, permisos=PERMISOS_FILA_REGISTRO)
+
+# Filas de la primera página de registro_list.html y registro_completo.html
+LONGITUD_PAGINA_REGISTROS = 10
+LONGITUD_PAGINA_COMPLETA = 20
 
 
 @login_required
 def registros_api(request):
-    registros = RegistroDeArchivo.objects.all()
-
-    # Parámetros básicos
-    draw = request.GET.get("draw", 1)
-    start = int(request.GET.get("start", 0))
-    length = int(request.GET.get("length", 10))
-
-    # Búsqueda por columna
-    # DataTables envía columns[0][data], columns[0][search][value], etc.
-    i = 0
-    while True:
-        col_data = request.GET.get(f'columns[{i}][data]')
-        if col_data is None:
-            break  # no hay más columnas en el request
-        col_search_value = request.GET.get(f'columns[{i}][search][value]', '').strip()
-
-        if col_search_value:
-            if col_data == 'numero_orden':
-                registros = registros.filter(numero_orden__icontains=col_search_value)
-            elif col_data == 'codigo':
-                registros = registros.filter(codigo__icontains=col_search_value)
-            elif col_data == 'codigo_serie':
-                registros = registros.filter(codigo_serie__nombre__icontains=col_search_value)
-            elif col_data == 'codigo_subserie':
-                registros = registros.filter(codigo_subserie__nombre__icontains=col_search_value)
-            elif col_data == 'unidad_documental':
-                registros = registros.filter(unidad_documental__icontains=col_search_value)
-            elif col_data == 'fecha_archivo':
-                # Si es un texto parcial, puedes dejarlo con icontains
-                registros = registros.filter(fecha_archivo__icontains=col_search_value)
-            elif col_data == 'soporte_fisico':
-                # Mapeo opcional si usas "✔", "✖", "True", "False", etc.
-                if col_search_value in ['✔','true','True','1','si','Sí']:
-                    registros = registros.filter(soporte_fisico=True)
-                elif col_search_value in ['✖','false','False','0','no','No']:
-                    registros = registros.filter(soporte_fisico=False)
-            elif col_data == 'soporte_electronico':
-                if col_search_value in ['✔','true','True','1','si','Sí']:
-                    registros = registros.filter(soporte_electronico=True)
-                elif col_search_value in ['✖','false','False','0','no','No']:
-                    registros = registros.filter(soporte_electronico=False)
-            elif col_data == 'creado_por':
-                registros = registros.filter(creado_por__username__icontains=col_search_value)
-            # Añade más elif si tuvieras más campos
-        i += 1
-
-    # Total sin filtros (para recordsTotal)
-    total_registros = RegistroDeArchivo.objects.count()
-
-    # Paginación
-    paginator = Paginator(registros, length)
-    page_number = start // length + 1
-    page = paginator.get_page(page_number)
-
-    # Construye la data de respuesta
-    data = []
-    for registro in page:
-        data.append({
-            "numero_orden": registro.numero_orden,
-            "codigo": registro.codigo,
-            "codigo_serie": registro.codigo_serie.nombre if registro.codigo_serie else "",
-            "codigo_subserie": registro.codigo_subserie.nombre if registro.codigo_subserie else "",
-            "unidad_documental": registro.unidad_documental,
-            "fecha_archivo": registro.fecha_archivo,
-            "soporte_fisico": registro.soporte_fisico,
-            "soporte_electronico": registro.soporte_electronico,
-            "creado_por": registro.creado_por.username if registro.creado_por else "N/A",
-            "id": registro.id,  # importante para los enlaces Editar/Eliminar
-        })
-
-    response = {
-        "draw": int(draw),
-        "recordsTotal": total_registros,
-        "recordsFiltered": registros.count(),
-        "data": data,
-    }
-    return JsonResponse(response)
+    return TABLA_REGISTROS.responder(request)
+
 
 @login_required
 def registros_api_completo(request):
-    registros = RegistroDeArchivo.objects.all()
-
-    # Paginación y parámetros de DataTables
-    draw = int(request.GET.get('draw', 1))
-    start = int(request.GET.get('start', 0))
-    length = int(request.GET.get('length', 10))
-
-    # Filtrar por columnas
-    i = 0
-    while True:
-        col_data = request.GET.get(f'columns[{i}][data]')
-        if col_data is None:
-            break
-        search_value = request.GET.get(f'columns[{i}][search][value]', '').strip()
-        if search_value:
-            if col_data == 'numero_orden':
-                registros = registros.filter(numero_orden__icontains=search_value)
-            elif col_data == 'codigo':
-                registros = registros.filter(codigo__icontains=search_value)
-            elif col_data == 'codigo_serie':
-                registros = registros.filter(codigo_serie__nombre__icontains=search_value)
-            elif col_data == 'codigo_subserie':
-                registros = registros.filter(codigo_subserie__nombre__icontains=search_value)
-            elif col_data == 'unidad_documental':
-                registros = registros.filter(unidad_documental__icontains=search_value)
-            elif col_data == 'fecha_archivo':
-                registros = registros.filter(fecha_archivo__icontains=search_value)
-            elif col_data == 'fecha_inicial':
-                registros = registros.filter(fecha_inicial__icontains=search_value)
-            elif col_data == 'fecha_final':
-                registros = registros.filter(fecha_final__icontains=search_value)
-            elif col_data == 'soporte_fisico':
-                registros = registros.filter(soporte_fisico=search_value.lower() in ['true', '1', '✔'])
-            elif col_data == 'soporte_electronico':
-                registros = registros.filter(soporte_electronico=search_value.lower() in ['true', '1', '✔'])
-            elif col_data == 'caja':
-                registros = registros.filter(caja__icontains=search_value)
-            elif col_data == 'carpeta':
-                registros = registros.filter(carpeta__icontains=search_value)
-            elif col_data == 'ubicacion':
-                registros = registros.filter(ubicacion__icontains=search_value)
-            # Agrega más filtros si es necesario
-        i += 1
-
-    # Paginación
-    paginator = Paginator(registros, length)
-    page_number = start // length + 1
-    page = paginator.get_page(page_number)
-
-    # Preparar datos para DataTables
-    data = []
-    for registro in page:
-        data.append({
-            "numero_orden": registro.numero_orden,
-            "codigo": registro.codigo,
-            "codigo_serie": registro.codigo_serie.nombre if registro.codigo_serie else "",
-            "codigo_subserie": registro.codigo_subserie.nombre if registro.codigo_subserie else "",
-            "unidad_documental": registro.unidad_documental,
-            "fecha_archivo": registro.fecha_archivo,
-            "fecha_inicial": registro.fecha_inicial,
-            "fecha_final": registro.fecha_final,
-            "soporte_fisico": registro.soporte_fisico,
-            "soporte_electronico": registro.soporte_electronico,
-            "caja": registro.caja,
-            "carpeta": registro.carpeta,
-            "tomo_legajo_libro": registro.tomo_legajo_libro,
-            "numero_folios": registro.numero_folios,
-            "tipo": registro.tipo,
-            "cantidad": registro.cantidad,
-            "ubicacion": registro.ubicacion,
-            "cantidad_documentos_electronicos": registro.cantidad_documentos_electronicos,
-            "tamano_documentos_electronicos": registro.tamano_documentos_electronicos,
-            "notas": registro.notas,
-            "creado_por": registro.creado_por.username if registro.creado_por else "",
-            "fecha_creacion": registro.fecha_creacion,
-        })
-
-    # Respuesta JSON
-    response = {
-        "draw": draw,
-        "recordsTotal": RegistroDeArchivo.objects.count(),
-        "recordsFiltered": registros.count(),
-        "data": data,
-    }
-    return JsonResponse(response)
-
+    return TABLA_REGISTROS_COMPLETO.responder(request)
 
 
-####
 @login_required
 def registros_api_con_id(request):
-    registros = RegistroDeArchivo.objects.all()
-
-    draw = int(request.GET.get('draw', 1))
-    start = int(request.GET.get('start', 0))
-    length = int(request.GET.get('length', 10))
-
-    # Filtro por columnas (idéntico a tu lógica actual)
-    i = 0
-    while True:
-        col_data = request.GET.get(f'columns[{i}][data]')
-        if col_data is None:
-            break
-        search_value = request.GET.get(f'columns[{i}][search][value]', '').strip()
-
-        if search_value:
-            if col_data == 'numero_orden':
-                registros = registros.filter(numero_orden__icontains=search_value)
-            elif col_data == 'codigo':
-                registros = registros.filter(codigo__icontains=search_value)
-            elif col_data == 'codigo_serie':
-                registros = registros.filter(codigo_serie__nombre__icontains=search_value)
-            elif col_data == 'codigo_subserie':
-                registros = registros.filter(codigo_subserie__nombre__icontains=search_value)
-            elif col_data == 'unidad_documental':
-                registros = registros.filter(unidad_documental__icontains=search_value)
-            elif col_data == 'fecha_archivo':
-                registros = registros.filter(fecha_archivo__icontains=search_value)
-            elif col_data == 'fecha_inicial':
-                registros = registros.filter(fecha_inicial__icontains=search_value)
-            elif col_data == 'fecha_final':
-                registros = registros.filter(fecha_final__icontains=search_value)
-            elif col_data == 'soporte_fisico':
-                registros = registros.filter(soporte_fisico=search_value.lower() in ['true', '1', '✔'])
-            elif col_data == 'soporte_electronico':
-                registros = registros.filter(soporte_electronico=search_value.lower() in ['true', '1', '✔'])
-            elif col_data == 'caja':
-                registros = registros.filter(caja__icontains=search_value)
-            elif col_data == 'carpeta':
-                registros = registros.filter(carpeta__icontains=search_value)
-            elif col_data == 'ubicacion':
-                registros = registros.filter(ubicacion__icontains=search_value)
-            # Agrega más si fuese necesario
-        i += 1
-
-    # Paginación
-    paginator = Paginator(registros, length)
-    page_number = start // length + 1
-    page = paginator.get_page(page_number)
-
-    # Construye la lista de data con id incluido
-    data = []
-    for registro in page:
-        data.append({
-            "id": registro.id,  # <--- Aquí agregamos el id
-            "numero_orden": registro.numero_orden,
-            "codigo": registro.codigo,
-            "codigo_serie": registro.codigo_serie.nombre if registro.codigo_serie else "",
-            "codigo_subserie": registro.codigo_subserie.nombre if registro.codigo_subserie else "",
-            "unidad_documental": registro.unidad_documental,
-            "fecha_archivo": registro.fecha_archivo,
-            "fecha_inicial": registro.fecha_inicial,
-            "fecha_final": registro.fecha_final,
-            "soporte_fisico": registro.soporte_fisico,
-            "soporte_electronico": registro.soporte_electronico,
-            "caja": registro.caja,
-            "carpeta": registro.carpeta,
-            "tomo_legajo_libro": registro.tomo_legajo_libro,
-            "numero_folios": registro.numero_folios,
-            "tipo": registro.tipo,
-            "cantidad": registro.cantidad,
-            "ubicacion": registro.ubicacion,
-            "cantidad_documentos_electronicos": registro.cantidad_documentos_electronicos,
-            "tamano_documentos_electronicos": registro.tamano_documentos_electronicos,
-            "notas": registro.notas,
-            "creado_por": registro.creado_por.username if registro.creado_por else "",
-            "fecha_creacion": registro.fecha_creacion,
-        })
-
-    response = {
-        "draw": draw,
-        "recordsTotal": RegistroDeArchivo.objects.count(),
-        "recordsFiltered": registros.count(),
-        "data": data,
-    }
-    return JsonResponse(response)
+    return TABLA_REGISTROS_CON_ID.responder(request)
+
+
+@staff_member_required
+def metricas_cache_respuestas(request):
+    """Aciertos y fallos de la caché de respuestas por endpoint (sólo personal)."""
+    return JsonResponse(cache_respuestas.metricas())
+
+
+@login_required
+def exportar_registros(request):
+    """
+    Descarga todos los registros que cumplen los filtros de la tabla
+    (mismos parámetros que registros_api_con_id, incluido el orden) en CSV, NDJSON o XLSX.
+    Un XLSX de más de EXPORTACIONES_MAXIMO_SINCRONO filas se encola y se
+    responde 202 con la URL de su estado, como crear_exportacion.
+    """
+    formato = request.GET.get('formato', 'csv')
+    if formato not in FORMATOS_EXPORTACION:
+        return JsonResponse({"error": f"Formato no soportado: {formato}"}, status=400)
+    tabla = TABLA_REGISTROS_CON_ID.ordenada(request.GET)
+    registros = tabla.filtrar(tabla.get_queryset(request), request.GET)
+    if formato == 'xlsx' and contar(registros).valor > trabajos.maximo_sincrono():
+        # El libro no se arma en el proceso web: se encola como en crear_exportacion
+        filtros = {clave: request.GET.getlist(clave) for clave in request.GET if clave not in PARAMETROS_NO_FILTRO}
+        return _respuesta_encolada(request, 'registros', {'formato': formato, 'filtros': filtros})
+    return respuesta_exportacion(tabla, registros, formato, 'registros')
 
 
 
@@ -438,8 +363,8 @@ def form_registro_fuid_ajax(request, fuid_id):
     Retorna el HTML parcial de un formulario para crear un RegistroDeArchivo
     asociado a un FUID, listo para inyectar en un modal.
     """
-    fuid = get_object_or_404(FUID, pk=fuid_id)
-    form = RegistroDeArchivoForm()  # Form vacío
+    fuid = get_object_or_404(oficinas.filtrar_fuids(FUID.objects.all(), request.user), pk=fuid_id)
+    form = RegistroDeArchivoForm(usuario=request.user)  # Form vacío
     
     # Renderizamos un template parcial con el formulario
     html_form = render_to_string(
@@ -451,18 +376,17 @@ def form_registro_fuid_ajax(request, fuid_id):
 
 @login_required
 def crear_registro_fuid_ajax(request, fuid_id):
-    fuid = get_object_or_404(FUID, pk=fuid_id)
+    fuid = get_object_or_404(oficinas.filtrar_fuids(FUID.objects.all(), request.user), pk=fuid_id)
 
     if request.method == 'POST':
-        form = RegistroDeArchivoForm(request.POST)
+        form = RegistroDeArchivoForm(request.POST, usuario=request.user)
         if form.is_valid():
             registro = form.save(commit=False)
             registro.creado_por = request.user
             registro.save()
 
-            # Asignar permisos a nivel de objeto (si usas Guardian)
-            assign_perm('documentos.view_own_registro', request.user, registro)
-            assign_perm('documentos.edit_own_registro', request.user, registro)
+            # Ver y editar los tiene el creador (backends.PropietarioBackend); por esta vía
+            # también puede eliminarlo, permiso que no es implícito y se guarda en guardian
             assign_perm('documentos.delete_own_registro', request.user, registro)
 
             # Asociar con FUID
@@ -493,7 +417,31 @@ def crear_registro_fuid_ajax(request, fuid_id):
 
 
 from django.http import HttpResponseForbidden
-from guardian.shortcuts import assign_perm
+
+
+def reservar_seleccion(form, usuario, fuid=None):
+    """
+    Reserva (o renueva) los registros elegidos en el formulario de FUID justo
+    antes de guardarlo. Si otro usuario se quedó con alguno, lo indica como
+    error del campo y devuelve False.
+    """
+    ids = form.cleaned_data['registros']
+    perdidos = set(ids) - set(reservas.reservar(usuario, ids, fuid))
+    if perdidos:
+        form.add_error('registros', "Otro usuario tomó estos registros mientras armabas el FUID: %s." % (
+            ', '.join(str(pk) for pk in sorted(perdidos)[:20])))
+    return not perdidos
+
+
+class OficinaFilterMixin:
+    """
+    Limita el queryset de las vistas basadas en clases a los FUIDs de la
+    oficina del usuario (oficinas.filtrar_fuids): los de otras oficinas no se
+    listan y al pedirlos por pk dan 404.
+    """
+    def get_queryset(self):
+        return oficinas.filtrar_fuids(super().get_queryset(), self.request.user)
+
 
 class FUIDCreateView(LoginRequiredMixin, CreateView):
     model = FUID
@@ -507,25 +455,17 @@ class FUIDCreateView(LoginRequiredMixin, CreateView):
             return HttpResponseForbidden("No tienes permiso para crear FUIDs.")
         return super().dispatch(request, *args, **kwargs)
 
+    def get_form_kwargs(self):
+        kwargs = super().get_form_kwargs()
+        kwargs['user'] = self.request.user  # Limita la oficina productora a la del perfil
+        return kwargs
+
     def get_form(self, *args, **kwargs):
         form = super().get_form(*args, **kwargs)
 
-        # Solo registros creados por el usuario autenticado
-        registros = RegistroDeArchivo.objects.filter(
-            fuids__isnull=True,
-            creado_por=self.request.user
-        )
-
-        # Aplicar filtros opcionales
-        fecha_inicio = self.request.GET.get("fecha_inicio")
-        fecha_fin = self.request.GET.get("fecha_fin")
-        if fecha_inicio:
-            registros = registros.filter(fecha_creacion__gte=fecha_inicio)
-        if fecha_fin:
-            registros = registros.filter(fecha_creacion__lte=fecha_fin)
-
-        # Asignar el queryset de registros al formulario
-        form.fields['registros'].queryset = registros
+        # Solo registros sin FUID creados por el usuario autenticado; se eligen con el
+        # selector paginado (registros_disponibles_api) y aquí sólo se validan sus ids
+        form.fields['registros'].queryset = registros_seleccionables(usuario=self.request.user)
 
         # Establecer el usuario autenticado en el formulario y ocultarlo en la plantilla
         form.fields['usuario'].initial = self.request.user.id
@@ -535,36 +475,40 @@ class FUIDCreateView(LoginRequiredMixin, CreateView):
     def form_valid(self, form):
         # Asigna automáticamente el usuario que crea el FUID
         form.instance.creado_por = self.request.user
-        fuid = form.save()
+        if not reservar_seleccion(form, self.request.user):
+            return self.form_invalid(form)
 
-        # Asigna permisos a nivel de objeto al creador usando django-guardian
-        assign_perm('documentos.view_own_fuid', self.request.user, fuid)
-        assign_perm('documentos.edit_own_fuid', self.request.user, fuid)
-        assign_perm('documentos.delete_own_fuid', self.request.user, fuid)
+        with reservas.escritura_exclusiva(), transaction.atomic():
+            # El creador ve, edita y elimina su FUID por serlo (backends.PropietarioBackend)
+            fuid = form.save()
 
-        # Asociar registros al FUID
-        registros = form.cleaned_data["registros"]
-        fuid.registros.set(registros)
+            # Asociar registros al FUID (lista de ids ya validada y reservada)
+            registros = form.cleaned_data["registros"]
+            fuid.registros.set(registros)
+            reservas.liberar(self.request.user, registros)
 
         return super().form_valid(form)
 
 
-class FUIDUpdateView(LoginRequiredMixin, UpdateView):
+class FUIDUpdateView(LoginRequiredMixin, OficinaFilterMixin, UpdateView):
     model = FUID
     form_class = FUIDForm
     template_name = "fuid_form.html"
     success_url = reverse_lazy("lista_fuids")
 
     def dispatch(self, request, *args, **kwargs):
-        # Obtén el objeto que se va a editar
-        fuid = self.get_object()
+        # Obtén el objeto que se va a editar (get/post lo reutilizan)
+        self.object = self.get_object()
 
         # Verifica si el usuario tiene el permiso de editar este objeto
-        if not request.user.is_superuser and 'edit_own_fuid' not in get_perms(request.user, fuid):
+        if not permisos_de(request).tiene('edit_own_fuid', self.object):
             return HttpResponseForbidden("No tienes permiso para editar este FUID.")
 
         return super().dispatch(request, *args, **kwargs)
 
+    def get_object(self, queryset=None):
+        return getattr(self, 'object', None) or super().get_object(queryset)
+
     def get_form_kwargs(self):
         # Pasa argumentos adicionales al formulario
         kwargs = super().get_form_kwargs()
@@ -572,31 +516,159 @@ class FUIDUpdateView(LoginRequiredMixin, UpdateView):
         return kwargs
 
     def form_valid(self, form):
+        if not reservar_seleccion(form, self.request.user, fuid=self.object):
+            return self.form_invalid(form)
+
         # Asigna los registros seleccionados al FUID
-        fuid = form.save()
-        registros = form.cleaned_data.get("registros")
-        fuid.registros.set(registros)
+        with reservas.escritura_exclusiva(), transaction.atomic():
+            fuid = form.save()
+            registros = form.cleaned_data.get("registros")
+            fuid.registros.set(registros)
+            reservas.liberar(self.request.user, registros)
         return super().form_valid(form)
     
+# Registros de cada FUID, como subconsulta correlacionada: sólo se evalúa
+# para las filas de la página, sin agrupar toda la tabla de FUIDs
+TOTAL_REGISTROS_FUID = Subquery(
+    FUID.registros.through.objects.filter(fuid_id=OuterRef('pk'))
+    .order_by().values('fuid_id').annotate(total=Count('pk')).values('total'),
+    output_field=IntegerField(),
+)
+
+class TablaFUIDs(TablaDataTables):
+    """Tabla de FUIDs limitada a la oficina del usuario (oficinas)."""
+
+    def get_queryset(self, request):
+        return oficinas.filtrar_fuids(super().get_queryset(request), request.user)
+
+
+TABLA_FUIDS = TablaFUIDs(
+    FUID,
+    [
+        Columna('id', buscable=False, ordenable=True, titulo="ID"),
+        Columna('unidad_administrativa', 'unidad_administrativa__nombre', por_defecto="", titulo="Unidad Administrativa"),
+        Columna('oficina_productora', 'oficina_productora__nombre', por_defecto="", titulo="Oficina Productora"),
+        Columna('objeto', 'objeto__nombre', por_defecto="", titulo="Objeto"),
+        ColumnaFecha('fecha_creacion', con_hora=True, ordenable=True, titulo="Fecha de Creación"),
+        Columna('creado_por', 'creado_por__username', por_defecto="", titulo="Creado por"),
+        Columna('total_registros', buscable=False, por_defecto=0, titulo="Registros"),
+    ],
+    orden=('id',),
+    anotaciones={'total_registros': TOTAL_REGISTROS_FUID},
+    cachear=True,
+    dependencias=(FUID, UnidadAdministrativa, OficinaProductora, Objeto),
+    # Banderas por fila para los botones de la lista (editar: el permiso que comprueba FUIDUpdateView)
+    permisos={'can_edit': 'edit_own_fuid', 'can_delete': 'delete_own_fuid'},
+)
+
+LONGITUD_PAGINA_FUIDS = 25
+
+
 @login_required
 def lista_fuids(request):
-    fuids = FUID.objects.all()  # Obtén todos los FUIDs
-    return render(request, 'fuid_list.html', {'fuids': fuids})
+    # Estructura de la tabla y primera página; DataTables pide el resto a fuids_api
+    return render(request, 'fuid_list.html', {
+        'primera_pagina': TABLA_FUIDS.primera_pagina(request, LONGITUD_PAGINA_FUIDS),
+        'longitud_pagina': LONGITUD_PAGINA_FUIDS,
+    })
+
+
+# Selector de registros del formulario de FUID
+TABLA_REGISTROS_SELECCIONABLES = tabla_registros(
+    'id', 'numero_orden', 'codigo_serie', 'unidad_documental', 'fecha_archivo', 'caja', 'carpeta', 'fecha_creacion',
+)
+# Las reservas de otros usuarios quitan registros del selector
+TABLA_REGISTROS_SELECCIONABLES.dependencias += (ReservaRegistro,)
+
+
+@login_required
+def registros_disponibles_api(request):
+    """
+    Registros que se pueden asociar al FUID, paginados y filtrables como en
+    registros_api. Sin ``fuid`` son los registros sin FUID del usuario (crear);
+    con ``fuid=<id>`` se incluyen además los que ya tiene ese FUID (editar).
+    """
+    fuid = None
+    if request.GET.get('fuid'):
+        fuid = get_object_or_404(oficinas.filtrar_fuids(FUID.objects.all(), request.user), pk=parsear_entero(request.GET['fuid']))
+    registros = registros_seleccionables(usuario=None if fuid else request.user, fuid=fuid)
+    registros = registros_visibles(reservas.sin_reservas_ajenas(registros, request.user), request.user)
+    return TABLA_REGISTROS_SELECCIONABLES.responder(request, registros)
+
+
+@login_required
+def reservar_registros_fuid(request):
+    """
+    Reserva (``accion=reservar``) o libera (``accion=liberar``) los registros
+    que el usuario marca o desmarca en el selector del formulario de FUID.
+    Responde con los ids efectivamente reservados; los que falten ya los tomó
+    otro usuario o dejaron de estar libres.
+    """
+    if request.method != 'POST':
+        return JsonResponse({'ok': False, 'message': 'Método no permitido'}, status=405)
+
+    try:
+        ids = list(dict.fromkeys(int(pk) for pk in request.POST.getlist('registros')))
+    except ValueError:
+        return JsonResponse({'ok': False, 'message': 'Identificadores de registro inválidos.'}, status=400)
+
+    if request.POST.get('accion') == 'liberar':
+        reservas.liberar(request.user, ids)
+        return JsonResponse({'ok': True, 'reservados': []})
+
+    fuid = None
+    if request.POST.get('fuid'):
+        fuid = get_object_or_404(oficinas.filtrar_fuids(FUID.objects.all(), request.user), pk=parsear_entero(request.POST['fuid']))
+    registros = registros_visibles(registros_seleccionables(usuario=None if fuid else request.user, fuid=fuid), request.user)
+    permitidos = list(registros.filter(pk__in=ids).values_list('pk', flat=True)) if ids else []
+    return JsonResponse({'ok': True, 'reservados': reservas.reservar(request.user, permitidos, fuid)})
+
+
+@login_required
+def asignar_registros_fuid(request, pk):
+    """
+    Asocia al FUID, con una sola sentencia, todos los registros sin FUID que
+    cumplan el filtro enviado (AsignacionRegistrosForm). Los usuarios que no
+    son superusuarios sólo asignan registros creados por ellos.
+    """
+    if request.method != 'POST':
+        return JsonResponse({'ok': False, 'message': 'Método no permitido'}, status=405)
+
+    fuid = get_object_or_404(oficinas.filtrar_fuids(FUID.objects.all(), request.user), pk=pk)
+    if not permisos_de(request).tiene('edit_own_fuid', fuid):
+        return JsonResponse({'ok': False, 'message': 'No tienes permiso para editar este FUID.'}, status=403)
+
+    form = AsignacionRegistrosForm(request.POST)
+    if not form.is_valid():
+        return JsonResponse({'ok': False, 'errors': form.errors}, status=400)
+
+    registros = registros_visibles(reservas.sin_reservas_ajenas(RegistroDeArchivo.objects.all(), request.user), request.user)
+    if not request.user.is_superuser:
+        registros = registros.filter(creado_por=request.user)
+    asignados = asignar_registros(fuid, form.filtrar(registros))
+    return JsonResponse({'ok': True, 'asignados': asignados})
+
+
+@login_required
+def fuids_api(request):
+    """
+    API server-side de DataTables para la lista de FUIDs. Filtra por oficina,
+    creador (texto) y fecha de creación ("2024", "2024-03", "2024-01..2024-06").
+    """
+    return TABLA_FUIDS.responder(request)
 
 @login_required
 def detalle_fuid(request, pk):
-    fuid = get_object_or_404(FUID, pk=pk)
+    fuid = get_object_or_404(oficinas.filtrar_fuids(FUID.objects.all(), request.user), pk=pk)
 
-    # Verificar si el usuario tiene el permiso 'documentos.view_own_fuid'
-    if not request.user.has_perm('documentos.view_own_fuid', fuid):
+    # Verificar si el usuario tiene el permiso 'documentos.view_own_fuid' (sólo lectura:
+    # el permiso se asigna al crear el FUID, no al consultarlo)
+    if not permisos_de(request).tiene('documentos.view_own_fuid', fuid):
         # Si no tiene permiso, mostrar error 403
         return mi_error_403(request)
 
-    # Asignar el permiso si es necesario
-    assign_perm('documentos.view_own_fuid', request.user, fuid)
-
-    # Obtener los registros relacionados
-    registros = fuid.registros.all()
+    # Obtener los registros relacionados (con serie, subserie y creador en la misma consulta)
+    registros = fuid.registros.select_related('codigo_serie', 'codigo_subserie', 'creado_por')
     return render(request, 'fuid_complete_list.html', {'fuid': fuid, 'registros': registros})
 
 
@@ -607,21 +679,17 @@ def agregar_registro_a_fuid(request, fuid_id):
     if not request.user.has_perm('documentos.add_registrodearchivo'):
         return HttpResponseForbidden("No tienes permiso para crear registros.")
     
-    # Obtenemos el FUID o mostramos 404 si no existe
-    fuid = get_object_or_404(FUID, pk=fuid_id)
+    # Obtenemos el FUID o mostramos 404 si no existe (o es de otra oficina)
+    fuid = get_object_or_404(oficinas.filtrar_fuids(FUID.objects.all(), request.user), pk=fuid_id)
 
     if request.method == 'POST':
-        form = RegistroDeArchivoForm(request.POST)
+        form = RegistroDeArchivoForm(request.POST, usuario=request.user)
         if form.is_valid():
             # Guardamos el registro y asignamos el usuario creador
             registro = form.save(commit=False)
             registro.creado_por = request.user
             registro.save()
-            
-            # Asignar permisos de objeto al usuario (opcional, si usas Guardian)
-            assign_perm('documentos.view_own_registro', request.user, registro)
-            assign_perm('documentos.edit_own_registro', request.user, registro)
-            # assign_perm('documentos.delete_own_registro', request.user, registro)
+            # Ver y editar los tiene el creador por serlo (backends.PropietarioBackend)
 
             # Asociar el registro recién creado al FUID
             fuid.registros.add(registro)
@@ -630,7 +698,7 @@ def agregar_registro_a_fuid(request, fuid_id):
             messages.success(request, 'Registro creado y asociado correctamente al FUID.')
 
             # Si quieres limpiar el formulario y mantenerte en la misma página:
-            form = RegistroDeArchivoForm()
+            form = RegistroDeArchivoForm(usuario=request.user)
         else:
             # Mostrar mensajes de error de validación
             for field, errors in form.errors.items():
@@ -639,7 +707,7 @@ def agregar_registro_a_fuid(request, fuid_id):
                     messages.error(request, f"{field_name}: {error}")
     else:
         # GET: formulario vacío
-        form = RegistroDeArchivoForm()
+        form = RegistroDeArchivoForm(usuario=request.user)
         # Subseries vacío por defecto (si no se ha seleccionado serie)
         form.fields['codigo_subserie'].queryset = SubserieDocumental.objects.none()
 
@@ -732,6 +800,11 @@ def detalle_ficha_paciente(request, consecutivo):
 
 class ListaFichasAPIView(APIView):
     def get(self, request):
+        # La respuesta (sin draw) se comparte en la caché mientras no cambien las fichas
+        datos = cache_respuestas.obtener(request, [FichaPaciente], lambda: self.datos(request))
+        return respuesta_json({"draw": request.GET.get("draw", 1), **datos})
+
+    def datos(self, request):
         # Parámetros enviados desde el frontend
         fecha_inicio = request.GET.get('fecha_inicio', None)
         fecha_fin = request.GET.get('fecha_fin', None)
@@ -758,10 +831,12 @@ class ListaFichasAPIView(APIView):
             7: 'Numero_historia_clinica',
         }
 
-        # Determinar el campo para ordenar
+        # Determinar el campo para ordenar; consecutivo desempata en la misma dirección
+        # para que el orden sea estable y use los índices (campo, consecutivo)
         order_field = column_mapping.get(order_column, 'consecutivo')  # Campo predeterminado: consecutivo
+        order_fields = [order_field] if order_field == 'consecutivo' else [order_field, 'consecutivo']
         if order_dir == 'desc':
-            order_field = f"-{order_field}"  # Prefijo "-" para orden descendente
+            order_fields = [f"-{campo}" for campo in order_fields]  # Prefijo "-" para orden descendente
 
         # Base queryset
         queryset = FichaPaciente.objects.all()
@@ -791,219 +866,148 @@ class ListaFichasAPIView(APIView):
             )
 
         # Aplicar ordenamiento dinámico
-        queryset = queryset.order_by(order_field)
-
-        # Paginación
-        total_records = queryset.count()
-        paginator = Paginator(queryset, length)
-        fichas = paginator.get_page(start // length + 1).object_list
+        queryset = queryset.order_by(*order_fields)
+
+        # Conteos cacheados (total sin filtros y total filtrado) y paginación por slicing
+        total = contar(FichaPaciente.objects.all())
+        filtrados = contar(queryset)
+        if length <= 0 or length > longitud_maxima():
+            length = longitud_maxima()  # "Todos" (length=-1) también queda acotado
+        # Sólo las columnas que se muestran, sin construir instancias del modelo
+        fichas = queryset.values_list(
+            'consecutivo', 'primer_nombre', 'segundo_nombre', 'primer_apellido', 'segundo_apellido',
+            'tipo_identificacion', 'num_identificacion', 'sexo', 'activo', 'fecha_nacimiento',
+            'Numero_historia_clinica',
+        )[start:start + length]
 
         # Formato JSON para DataTables
         data = [
             {
-                "consecutivo": ficha.consecutivo,
-                "nombre_completo": f"{ficha.primer_nombre} {ficha.segundo_nombre or ''} {ficha.primer_apellido} {ficha.segundo_apellido}",
-                "tipo_identificacion": ficha.tipo_identificacion,
-                "num_identificacion": ficha.num_identificacion,
-                "sexo": ficha.sexo,
-                "estado": ficha.activo,
-                "fecha_nacimiento": ficha.fecha_nacimiento.strftime("%Y-%m-%d"),
-                "numero_historia_clinica": ficha.Numero_historia_clinica,
+                "consecutivo": consecutivo,
+                "nombre_completo": f"{primer_nombre} {segundo_nombre or ''} {primer_apellido} {segundo_apellido}",
+                "tipo_identificacion": tipo_identificacion,
+                "num_identificacion": num_identificacion,
+                "sexo": sexo,
+                "estado": activo,
+                "fecha_nacimiento": fecha_nacimiento.strftime("%Y-%m-%d"),
+                "numero_historia_clinica": numero_historia_clinica,
             }
-            for ficha in fichas
+            for (consecutivo, primer_nombre, segundo_nombre, primer_apellido, segundo_apellido,
+                 tipo_identificacion, num_identificacion, sexo, activo, fecha_nacimiento,
+                 numero_historia_clinica) in fichas
         ]
 
-        return Response(
-            {
-                "draw": request.GET.get("draw", 1),
-                "recordsTotal": total_records,
-                "recordsFiltered": total_records,
-                "data": data,
-            }
-        )
+        return {
+            "recordsTotal": total.valor,
+            "recordsFiltered": filtrados.valor,
+            "recordsTotalExact": total.exacto,
+            "recordsFilteredExact": filtrados.exacto,
+            "data": data,
+        }
 
 
+@login_required
 def export_fuid_to_excel(request, pk):
-    # Obtener el FUID específico
-    fuid = FUID.objects.get(pk=pk)
-
-    wb = openpyxl.Workbook()
-    ws = wb.active
-    ws.title = f"FUID #{fuid.id}"
-
-    # Función para truncar valores largos
-    def truncate_value(value, max_length=30):
-        if not value:
-            return "N/A"
-        value = str(value)
-        return value if len(value) <= max_length else value[:max_length - 3] + "..."
-
-    # Crear estilos
-    border = Border(
-        left=Side(border_style="thin"),
-        right=Side(border_style="thin"),
-        top=Side(border_style="thin"),
-        bottom=Side(border_style="thin")
-    )
-    header_fill = PatternFill(start_color="EEECE1", end_color="EEECE1", fill_type="solid")
-
-    # Combinar celdas para la imagen
-    ws.merge_cells(start_row=1, start_column=1, end_row=6, end_column=22)
-
-    # Insertar la imagen
-    img_path = r"D:\descargas d\xtz\pino-d-angio-c92c3fc03f2f716d1835fcf5b169efc11833deab\hospital_document_management\documentos\templates\images\fuid_logo.png"
-    img = Image(img_path)
-    img.width = 1000
-    img.height = 120
-    ws.add_image(img, "A1")
-
-    # Mover el cursor de escritura a la fila 7 para continuar con el contenido
-    current_row = 7
-
-    # Encabezados de datos generales
-    ws.cell(row=current_row, column=1, value="Campo")
-    ws.cell(row=current_row, column=2, value="Valor")
-    ws.cell(row=current_row, column=17, value="AÑO")
-    ws.cell(row=current_row, column=18, value="MES")
-    ws.cell(row=current_row, column=19, value="DÍA")
-    ws.cell(row=current_row, column=20, value="N.T.")
-    current_row += 1
-
-    # Datos generales del FUID
-    fuid_data = [
-        ("Entidad Productora", fuid.entidad_productora.nombre if fuid.entidad_productora else "N/A", fuid.fecha_creacion.year, fuid.fecha_creacion.month, fuid.fecha_creacion.day, ""),
-        ("Unidad Administrativa", fuid.unidad_administrativa.nombre if fuid.unidad_administrativa else "N/A", "", "", "", ""),
-        ("Oficina Productora", fuid.oficina_productora.nombre if fuid.oficina_productora else "N/A", "", "", "", ""),
-        ("Objeto", fuid.objeto.nombre if fuid.objeto else "N/A", "", "", "", ""),
-    ]
-    for row_data in fuid_data:
-        ws.cell(row=current_row, column=1, value=row_data[0])  # Campo
-        ws.cell(row=current_row, column=2, value=row_data[1])  # Valor
-        ws.cell(row=current_row, column=17, value=row_data[2])  # AÑO
-        ws.cell(row=current_row, column=18, value=row_data[3])  # MES
-        ws.cell(row=current_row, column=19, value=row_data[4])  # DÍA
-        ws.cell(row=current_row, column=20, value=row_data[5])  # N.T.
-        current_row += 1
-
-    # Aplicar bordes solo a celdas con contenido
-    for row in ws.iter_rows(min_row=7, max_row=current_row-1):
-        for cell in row:
-            if cell.value:  # Aplica bordes solo si hay contenido
-                cell.border = border
-
-    # Espacio antes de la sección de registros
-    current_row += 1
-    ws.cell(row=current_row, column=1, value="")
-    current_row += 1
-
-    # Encabezados de los registros (sin "Fecha Archivo")
-    headers = [
-        "N° Orden", "Código", "Código Serie", "Código Subserie", "Unidad Documental",
-        "Fecha Inicial", "Fecha Final", "Soporte Físico", "Soporte Electrónico",
-        "Caja", "Carpeta", "Tomo/Legajo/Libro", "N° Folios", "Tipo", "Cantidad",
-        "Ubicación", "Cantidad Electrónicos", "Tamaño Electrónico", "Notas", "Creado Por", "Fecha Creación"
-    ]
-    start_row = current_row + 1
-    for col_idx, header in enumerate(headers, start=1):
-        col_letter = get_column_letter(col_idx)
-        ws.merge_cells(start_row=start_row, start_column=col_idx, end_row=start_row+3, end_column=col_idx)
-        cell = ws[f"{col_letter}{start_row}"]
-        cell.value = header
-        cell.alignment = Alignment(horizontal="center", vertical="center")
-        cell.fill = header_fill
-        if cell.value:  # Aplica bordes solo si hay contenido
-            cell.border = border
-
-    # Mover el current_row debajo de las cabeceras
-    current_row = start_row + 4
-
-    # Agregar registros asociados (sin "Fecha Archivo")
-    registros = fuid.registros.all()
-    if registros.exists():
-        for registro in registros:
-            row_data = [
-                registro.numero_orden,
-                truncate_value(registro.codigo or "N/A"),
-                truncate_value(registro.codigo_serie.nombre if registro.codigo_serie else "N/A"),
-                truncate_value(registro.codigo_subserie.nombre if registro.codigo_subserie else "N/A"),
-                truncate_value(registro.unidad_documental),
-                registro.fecha_inicial.strftime('%Y-%m-%d') if registro.fecha_inicial else "N/A",
-                registro.fecha_final.strftime('%Y-%m-%d') if registro.fecha_final else "N/A",
-                "Sí" if registro.soporte_fisico else "No",
-                "Sí" if registro.soporte_electronico else "No",
-                truncate_value(registro.caja or "N/A"),
-                truncate_value(registro.carpeta or "N/A"),
-                truncate_value(registro.tomo_legajo_libro or "N/A"),
-                registro.numero_folios or "N/A",
-                truncate_value(registro.tipo or "N/A"),
-                registro.cantidad or "N/A",
-                truncate_value(registro.ubicacion),
-                registro.cantidad_documentos_electronicos or "N/A",
-                truncate_value(registro.tamano_documentos_electronicos or "N/A"),
-                truncate_value(registro.notas or "N/A"),
-                registro.creado_por.username if registro.creado_por else "N/A",
-                registro.fecha_creacion.strftime('%Y-%m-%d %H:%M'),
-            ]
-            for col_idx, val in enumerate(row_data, start=1):
-                c = ws.cell(row=current_row, column=col_idx, value=val)
-                if c.value:  # Aplica bordes solo si hay contenido
-                    c.border = border
-            current_row += 1
+    # FUID de la oficina del usuario, con sus relaciones en la misma consulta; el libro
+    # sale de la caché en disco si su versión no cambió (cache_fuid.py, con ETag)
+    fuids = FUID.objects.select_related('entidad_productora', 'unidad_administrativa', 'oficina_productora', 'objeto')
+    fuid = get_object_or_404(oficinas.filtrar_fuids(fuids, request.user), pk=pk)
+    # Un libro grande que no está en la caché se genera en segundo plano (202 con la URL de su estado)
+    if not cache_fuid.en_cache(fuid) and fuid.registros.count() > trabajos.maximo_sincrono():
+        return _respuesta_encolada(request, 'fuid', {'fuid': fuid.pk})
+    return respuesta_fuid(request, fuid)
+
+
+# Parámetros del formulario que no son filtros de la tabla
+PARAMETROS_NO_FILTRO = {'tipo', 'formato', 'csrfmiddlewaretoken'}
+
+
+def _estado_exportacion(trabajo):
+    datos = {
+        'id': trabajo.pk,
+        'estado': trabajo.estado,
+        'procesados': trabajo.procesados,
+        'total': trabajo.total,
+        'progreso': trabajo.progreso,
+        'error': trabajo.error,
+        'url_estado': reverse('estado_exportacion', args=[trabajo.pk]),
+        'url_descarga': None,
+    }
+    if trabajo.estado == TrabajoExportacion.TERMINADO:
+        datos['url_descarga'] = reverse('descargar_exportacion', args=[trabajo.pk])
+    return datos
+
+
+def _respuesta_encolada(request, tipo, parametros):
+    trabajo = trabajos.encolar(request.user, tipo, parametros)
+    return JsonResponse({'ok': True, **_estado_exportacion(trabajo)}, status=202)
+
+
+@login_required
+def crear_exportacion(request):
+    """
+    Encola una exportación y responde 202 con la URL para consultar su avance.
+    El archivo lo genera el comando ``procesar_exportaciones``. Tipos:
+
+    - ``fuid``: el formato FUID de ``fuid=<id>``.
+    - ``registros``: ``formato`` y los mismos filtros de registros_api_con_id.
+    - ``lote_fuids``: ZIP con el formato FUID de los ids ``fuids`` o, si no se
+      envían, de los FUIDs que cumplen los filtros de fuids_api (oficina,
+      rango de fechas...).
+    """
+    if request.method != 'POST':
+        return JsonResponse({'ok': False, 'message': 'Método no permitido'}, status=405)
+
+    tipo = request.POST.get('tipo')
+    if tipo == 'fuid':
+        fuid = get_object_or_404(
+            oficinas.filtrar_fuids(FUID.objects.all(), request.user),
+            pk=parsear_entero(request.POST.get('fuid')),
+        )
+        parametros = {'fuid': fuid.pk}
+    elif tipo == 'registros':
+        formato = request.POST.get('formato', 'xlsx')
+        if formato not in FORMATOS_EXPORTACION:
+            return JsonResponse({'ok': False, 'message': f"Formato no soportado: {formato}"}, status=400)
+        filtros = {
+            clave: request.POST.getlist(clave)
+            for clave in request.POST if clave not in PARAMETROS_NO_FILTRO
+        }
+        parametros = {'formato': formato, 'filtros': filtros}
+    elif tipo == 'lote_fuids':
+        # Los ids se fijan al encolar, con el alcance por oficina del usuario
+        fuids = TABLA_FUIDS.get_queryset(request)
+        ids = request.POST.getlist('fuids')
+        if ids:
+            fuids = fuids.filter(pk__in=[parsear_entero(pk) for pk in ids])
+        else:
+            fuids = TABLA_FUIDS.filtrar(fuids, request.POST)
+        parametros = {'fuids': list(fuids.order_by('id').values_list('pk', flat=True))}
+        if not parametros['fuids']:
+            return JsonResponse({'ok': False, 'message': 'No hay FUIDs para exportar.'}, status=400)
     else:
-        ws.cell(row=current_row, column=1, value="Sin registros asociados")
-        current_row += 1
-
-    # Espacio antes de la sección de roles
-    current_row += 1
-
-    # Datos de roles
-    roles_data = [
-        ["Elaborado Por (Nombre)", truncate_value(fuid.elaborado_por_nombre or "N/A"), 
-         "Entregado Por (Nombre)", truncate_value(fuid.entregado_por_nombre or "N/A"), 
-         "Recibido Por (Nombre)", truncate_value(fuid.recibido_por_nombre or "N/A")],
-        ["Elaborado Por (Cargo)", truncate_value(fuid.elaborado_por_cargo or "N/A"), 
-         "Entregado Por (Cargo)", truncate_value(fuid.entregado_por_cargo or "N/A"), 
-         "Recibido Por (Cargo)", truncate_value(fuid.recibido_por_cargo or "N/A")],
-        ["Elaborado Por (Lugar)", truncate_value(fuid.elaborado_por_lugar or "N/A"), 
-         "Entregado Por (Lugar)", truncate_value(fuid.entregado_por_lugar or "N/A"), 
-         "Recibido Por (Lugar)", truncate_value(fuid.recibido_por_lugar or "N/A")],
-        ["Firma", "", "Firma", "", "Firma", ""],
-        ["Lugar", "", "Lugar", "", "Lugar", ""],
-        ["Elaborado Por (Fecha)", fuid.elaborado_por_fecha.strftime('%Y-%m-%d') if fuid.elaborado_por_fecha else "N/A",
-         "Entregado Por (Fecha)", fuid.entregado_por_fecha.strftime('%Y-%m-%d') if fuid.entregado_por_fecha else "N/A",
-         "Recibido Por (Fecha)", fuid.recibido_por_fecha.strftime('%Y-%m-%d') if fuid.recibido_por_fecha else "N/A"],
-    ]
+        return JsonResponse({'ok': False, 'message': 'Tipo de exportación no válido.'}, status=400)
 
-    # Asegurar bordes para todas las celdas de roles (rango expandido)
-    start_col = 1  # Columna inicial para los datos de roles
-    end_col = 10  # Aumentamos el rango de columnas ocupadas
-    for row_idx, row_data in enumerate(roles_data, start=current_row):
-        for col_idx, val in enumerate(row_data, start=start_col):
-            c = ws.cell(row=row_idx, column=col_idx, value=val)
-            c.border = border  # Aplicar bordes incluso si está vacío
-        current_row += 1
-
-    # Ajustar el ancho de las columnas automáticamente
-    for column_cells in ws.columns:
-        max_length = 0
-        column_letter = get_column_letter(column_cells[0].column)
-        for cell in column_cells:
-            try:
-                if cell.value:
-                    max_length = max(max_length, len(str(cell.value)))
-            except:
-                pass
-        adjusted_width = max_length + 2
-        ws.column_dimensions[column_letter].width = adjusted_width
-
-    # Configurar la respuesta HTTP
-    response = HttpResponse(
-        content_type="application/vnd.openxmlformats-officedocument.spreadsheetml.sheet"
-    )
-    response['Content-Disposition'] = f'attachment; filename=FUID_{fuid.id}.xlsx'
+    return _respuesta_encolada(request, tipo, parametros)
 
-    wb.save(response)
-    return response
+
+@login_required
+def estado_exportacion(request, pk):
+    """Avance de una exportación del usuario (el navegador la consulta hasta que termina)."""
+    trabajo = get_object_or_404(TrabajoExportacion, pk=pk, usuario=request.user)
+    return JsonResponse(_estado_exportacion(trabajo))
+
+
+@login_required
+def descargar_exportacion(request, pk):
+    """Descarga el archivo de una exportación terminada del usuario."""
+    trabajo = get_object_or_404(
+        TrabajoExportacion, pk=pk, usuario=request.user, estado=TrabajoExportacion.TERMINADO,
+    )
+    ruta = trabajos.ruta(trabajo)
+    if ruta is None or not ruta.exists():
+        raise Http404("La exportación ya no está disponible.")
+    return FileResponse(open(ruta, 'rb'), as_attachment=True, filename=trabajo.nombre_archivo)
 
 
 #  @login_required
@@ -1015,7 +1019,7 @@ def calcular_edad(fecha_nacimiento):
         hoy = date.today()
         return hoy.year - fecha_nacimiento.year - ((hoy.month, hoy.day) < (fecha_nacimiento.month, fecha_nacimiento.day))
     return None
-# @login_required
+@login_required
 def estadisticas_pacientes(request):
     """
     API para devolver estadísticas de pacientes considerando varios atributos.
@@ -1048,7 +1052,7 @@ def estadisticas_pacientes(request):
 
     return JsonResponse(datos, safe=False)
 
-# @login_required
+@login_required
 def estadisticas_registros(request):
     """
     API para devolver estadísticas de registros, organizados por series documentales y tipos.
@@ -1056,7 +1060,7 @@ def estadisticas_registros(request):
     try:
         fecha_inicio = request.GET.get('fecha_inicio')
         fecha_fin = request.GET.get('fecha_fin')
-        registros = RegistroDeArchivo.objects.all()
+        registros = oficinas.filtrar_registros(RegistroDeArchivo.objects.all(), request.user)
 
         # Filtrar por rango de fechas si se proporcionan
         if fecha_inicio and fecha_fin:
@@ -1085,13 +1089,13 @@ def estadisticas_registros(request):
 
 
 
-# @login_required
+@login_required
 def estadisticas_fuids(request):
     """
     API para devolver estadísticas de FUIDs, organizados por oficinas productoras.
     """
     usuario = request.GET.get('usuario')
-    fuids = FUID.objects.all()
+    fuids = oficinas.filtrar_fuids(FUID.objects.all(), request.user)
 
     if usuario:
         fuids = fuids.filter(creado_por__username=usuario)
@@ -1105,7 +1109,7 @@ def estadisticas_fuids(request):
 
     return JsonResponse(datos, safe=False)
 
-# @login_required
+@login_required
 def pagina_estadisticas(request):
     """
     Página principal para mostrar gráficos de las estadísticas.
@@ -1117,31 +1121,3 @@ def pagina_estadisticas(request):
 def obtener_usuarios(request):
     usuarios = User.objects.values('username')
     return JsonResponse(list(usuarios), safe=False)
-
-# mixins.py
-from django.http import HttpResponseForbidden
-
-class OficinaFilterMixin:
-    """
-    Filtra los objetos para que el usuario solo vea y manipule
-    aquellos creados por su oficina. También bloquea la edición
-    de objetos de otras oficinas.
-    """
-    def get_queryset(self):
-        qs = super().get_queryset()
-        # Si deseas que el superusuario vea todo, déjalo pasar:
-        if self.request.user.is_superuser:
-            return qs
-        # Caso contrario, filtra por la oficina del perfil
-        return qs.filter(oficina_productora=self.request.user.perfil.oficina)
-
-    def dispatch(self, request, *args, **kwargs):
-        # Bloqueo adicional para edición/eliminación
-        if hasattr(self, 'get_object'):
-            obj = self.get_object()
-            if (not request.user.is_superuser) and (obj.oficina_productora != request.user.perfil.oficina):
-                return HttpResponseForbidden("No tienes permiso sobre este recurso.")
-        return super().dispatch(request, *args, **kwargs)
-
-
-
@@ -79,7 +79,9 @@ ROOT_URLCONF = "hospital_document_management.urls"
 
 AUTHENTICATION_BACKENDS = (
     'django.contrib.auth.backends.ModelBackend',            # Permisos nativos de Django
-    'guardian.backends.ObjectPermissionBackend',            # Permisos de Guardian
+    'documentos.backends.PropietarioBackend',               # Permisos propios del creador (creado_por), sin consultas
+    'documentos.backends.SeriePermisoBackend',              # Permisos por serie (PermisoUsuarioSerie), en memoria
+    'guardian.backends.ObjectPermissionBackend',            # Permisos de Guardian (objetos compartidos)
 )
 
 
@@ -130,6 +132,8 @@ DATABASES = {
         'PASSWORD': '',  # Solo si usas SQL Server Authentication
         'OPTIONS': {
             'driver': 'ODBC Driver 17 for SQL Server',  # Verifica que tengas este driver instalado
+            # bulk_create devuelve los ids insertados (OUTPUT INSERTED); la importación los usa
+            'return_rows_bulk_insert': True,
         },
     },
 }
@@ -162,6 +166,46 @@ AUTH_PASSWORD_VALIDATORS = [
 CORS_ALLOW_ALL_ORIGINS = True
 
 
+# Máximo de filas por página en las APIs de DataTables (también para "Todos", length=-1)
+DATATABLES_LONGITUD_MAXIMA = 1000
+
+# Caché compartida entre los procesos del servidor (conteos, generaciones de modelos).
+# Se usa archivo en disco para no depender de un servicio externo.
+CACHES = {
+    'default': {
+        'BACKEND': 'django.core.cache.backends.filebased.FileBasedCache',
+        'LOCATION': BASE_DIR / 'cache',
+    }
+}
+
+# Conteos de las APIs (documentos/conteos.py)
+CONTEOS_UMBRAL_EXACTO = 200_000   # Por encima de este tamaño de tabla los conteos se estiman/acotan
+CONTEOS_TTL_TOTAL = 60 * 60       # Segundos que vive el total sin filtros (se invalida al escribir)
+CONTEOS_TTL_FILTRADO = 30         # Segundos que vive un conteo filtrado
+
+# Caché de respuestas de las APIs de DataTables (documentos/cache_respuestas.py)
+RESPUESTAS_CACHE_TTL = 15         # Segundos que vive una respuesta (se invalida al escribir)
+RESPUESTAS_CACHE_ESPERA = 5       # Segundos máximos esperando a otra petición idéntica en curso
+
+# Permisos por serie (documentos/permisos_serie.py)
+PERMISOS_SERIE_TTL = 5 * 60       # Segundos que vive en caché la matriz de series de un usuario
+
+# Reservas de registros al armar FUIDs (documentos/reservas.py)
+RESERVAS_DURACION = 15 * 60       # Segundos que un registro marcado queda reservado para su usuario
+
+# Logo del encabezado del formato FUID en Excel (documentos/exportacion_fuid.py)
+FUID_LOGO = BASE_DIR / "documentos" / "static" / "img" / "fuid_logo.png"
+# Libros del formato FUID ya generados, por versión del FUID (documentos/cache_fuid.py).
+# Fuera de la carpeta de CACHES: la purga de la FileBasedCache borraría libros
+FUID_CACHE_DIR = BASE_DIR / "cache_fuids"
+
+# Exportaciones en segundo plano (documentos/trabajos.py, comando procesar_exportaciones)
+EXPORTACIONES_DIR = BASE_DIR / "exportaciones"
+EXPORTACIONES_DURACION = 24 * 60 * 60   # Segundos que se conserva un archivo generado
+EXPORTACIONES_PROCESOS = None           # Procesos del pool del worker (None = uno por núcleo)
+EXPORTACIONES_MAXIMO_SINCRONO = 2000    # Filas de un XLSX que aún se generan en la petición web; más se encolan
+
+
 LOGIN_URL = '/registros/login/'
 LOGOUT_REDIRECT_URL = '/registros/login/'
 LOGIN_REDIRECT_URL = '/registros/welcome/'